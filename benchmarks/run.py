@@ -0,0 +1,307 @@
+'''
+Benchmarks of the projection, tax and rendering hot paths of one of the apps.
+
+    python benchmarks/run.py --app dash
+    python benchmarks/run.py --app flask --update-baseline
+
+Every run is appended to benchmarks/history.jsonl, one JSON object per run. Timings are compared with
+benchmarks/baseline.json: a case whose p50 and p99 are more than --threshold slower than its baseline, and by more than
+MIN_REGRESSION_MS, is a regression once it is still slower when timed again.
+Timings only compare on the same machine, run --update-baseline there first.
+Every case also hashes the rupee figures it produces for fixed inputs, a checksum that differs from the baseline
+is a parity failure, so a speedup cannot silently change the numbers.
+Exits with status 1 on a regression or a parity failure.
+'''
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+APP_DIRS = {'dash': os.path.join(ROOT_DIR, 'dash-app'), 'flask': os.path.join(ROOT_DIR, 'flask-app')}
+HISTORY_FILE = os.path.join(BENCHMARKS_DIR, 'history.jsonl')
+BASELINE_FILE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+HORIZONS = (10, 20, 40, 60)
+BATCH_SIZE = 1000
+SEED = 2021
+# a case is a regression when both its p50 and its p99 are this fraction slower than the baseline, and by more than
+# MIN_REGRESSION_MS, a slower p99 alone is mostly noise from the machine. The timer and the machine add about 0.05 ms
+# to the cases of 0.1 ms.
+DEFAULT_THRESHOLD = 0.25
+MIN_REGRESSION_MS = 0.1
+# times a case found slower is timed again, it is a regression only when every timing is slower
+RETRIES = 3
+
+def scenario_args(configs, years_till_retirement, rng=None):
+    '''
+    Default inputs with <years_till_retirement>, every other input scaled by a random factor when <rng> is given
+    '''
+    from projection import float_keys
+    floats = float_keys(configs)
+    args = configs.get_var_dict()
+    for key in configs.get_input_keys():
+        if rng is not None and key not in ('years_till_retirement', 'ppf_installments_left'):
+            value = args[key] * rng.uniform(0.5, 1.5)
+            args[key] = round(value, 2) if key in floats else int(value)
+    args['years_till_retirement'] = years_till_retirement
+    return args
+
+def checksum(*arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(np.asarray(array, dtype=np.int64)).tobytes())
+    return digest.hexdigest()[:16]
+
+def legacy_projection(args, configs):
+    '''
+    The per-year loop of utils.savings_calculation that the engine replaced, the reference latency of a single scenario.
+    Taxed like the old regime of Params.TAX_REGIME_RULES: the tax of Tax after the standard deduction, none up to the
+    87A rebate limit. Returns the corpus of every instrument and the expenses of every year, like project_savings.
+    '''
+    from projection import INSTRUMENTS
+    from tax import Tax
+    from utils import calc_compound_interest_final_amount, new_corpus_value_at_year_end
+
+    (_, _, _, _, standard_deduction, _, rebate_limit, _), = [rules for rules in configs.TAX_REGIME_RULES if rules[0] == 'old']
+    no_of_years = int(args['years_till_retirement'])
+    year_wise_savings = {key: [int(args[key])] for key in INSTRUMENTS}
+    year_wise_expenses = [12 * int(args['monthly_fixed_expense'])]
+    for i in range(no_of_years):
+        current_annual_basic = calc_compound_interest_final_amount(p=int(args['annual_basic']), r=float(args['income_growth_rate']) / 100, t=i)
+        current_nps_contribution = int(current_annual_basic * (float(args['nps_contribution']) / 100))
+        current_employer_pf_contribution = int(current_annual_basic * (float(args['employer_pf_contribution']) / 100))
+        current_employee_pf_contribution = int(current_annual_basic * (float(args['employee_pf_contribution']) / 100))
+        current_pf_contribution = current_employer_pf_contribution + current_employee_pf_contribution
+        current_mf_contribution = calc_compound_interest_final_amount(p=int(args['mf_contribution']), r=float(args['mf_step_up']) / 100, t=i)
+        current_equity_contribution = calc_compound_interest_final_amount(p=int(args['equity_contribution']), r=float(args['equity_step_up']) / 100, t=i)
+        current_ppf_contribution = int(args['ppf_contribution']) if i < int(args['ppf_installments_left']) else 0
+        current_income = calc_compound_interest_final_amount(p=int(args['annual_income']), r=float(args['income_growth_rate']) / 100, t=i)
+        tax = Tax(current_income - standard_deduction, current_employer_pf_contribution, int(args['80c_deductions']), current_nps_contribution, configs)
+        taxable_income = tax.annual_income_before_tax - current_employer_pf_contribution - tax.deduction_80c - tax.deduction_nps
+        after_tax_income = int(current_income - (0 if taxable_income <= rebate_limit else tax.total_income_tax))
+        current_expense = calc_compound_interest_final_amount(p=12 * int(args['monthly_fixed_expense']), r=float(args['inflation_rate']) / 100, t=i)
+        current_fd_contribution = after_tax_income - current_expense - current_nps_contribution - current_pf_contribution - current_mf_contribution - current_equity_contribution - current_ppf_contribution
+
+        additions = {
+            'nps_corpus': current_nps_contribution,
+            'pf_corpus': current_pf_contribution,
+            'mf_corpus': current_mf_contribution,
+            'equity_corpus': current_equity_contribution,
+            'fd_corpus': current_fd_contribution,
+            'savings_corpus': 0,
+            'other_savings_corpus': 0,
+        }
+        for key, additional_investment in additions.items():
+            year_wise_savings[key].append(new_corpus_value_at_year_end(starting_value=year_wise_savings[key][-1], rate=float(args[key.replace('_corpus', '_ror')]), additional_investment=additional_investment))
+        if i == int(args['ppf_installments_left']) - 1:
+            year_wise_savings['fd_corpus'][-1] = year_wise_savings['fd_corpus'][-1] + new_corpus_value_at_year_end(starting_value=year_wise_savings['ppf_corpus'][-1], rate=float(args['ppf_ror']), additional_investment=current_ppf_contribution)
+            year_wise_savings['ppf_corpus'].append(0)
+        else:
+            year_wise_savings['ppf_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['ppf_corpus'][-1], rate=float(args['ppf_ror']), additional_investment=current_ppf_contribution))
+        year_wise_expenses.append(calc_compound_interest_final_amount(p=12 * int(args['monthly_fixed_expense']), r=float(args['inflation_rate']) / 100, t=i+1))
+    return np.array([year_wise_savings[key] for key in INSTRUMENTS]).T, year_wise_expenses
+
+def projection_cases(configs):
+    '''
+    Cases shared by both apps: the projection of a single scenario next to the legacy loop, the batch projection and
+    the tax, scalar and vectorized
+    '''
+    from projection import project_batch, project_savings
+    from tax import Tax, calculate_after_tax_income
+
+    # the years depend on the current year, only the amounts are hashed, the same for both
+    for years in HORIZONS:
+        args = scenario_args(configs, years)
+        yield f'project_savings/{years}y', lambda args=args: project_savings(args, configs)[1:], lambda result: checksum(*result)
+        yield f'legacy_loop/{years}y', lambda args=args: legacy_projection(args, configs), lambda result: checksum(*result)
+
+    rng = random.Random(SEED)
+    keys = configs.get_input_keys()
+    for years in HORIZONS:
+        table = np.array([[scenario_args(configs, years, rng)[key] for key in keys] for _ in range(BATCH_SIZE)], dtype=np.float64)
+        yield f'project_batch/{BATCH_SIZE}x{years}y', lambda table=table: project_batch(table, configs), checksum
+    yield f'project_batch/monthly/{BATCH_SIZE}x{years}y', lambda table=table: project_batch(table, configs, frequency='monthly'), checksum
+
+    incomes = [rng.randrange(100000, 100000000) for _ in range(BATCH_SIZE)]
+    deductions = [(rng.randrange(0, 200000), rng.randrange(0, 200000), rng.randrange(0, 100000)) for _ in range(BATCH_SIZE)]
+    yield (
+        f'tax/scalar/{BATCH_SIZE}',
+        lambda: [Tax(income, *deduction, configs).after_tax_income for income, deduction in zip(incomes, deductions)],
+        checksum,
+    )
+    columns = np.array(incomes), *np.array(deductions).T
+    yield f'tax/vector/{BATCH_SIZE}', lambda: calculate_after_tax_income(*columns, configs), checksum
+
+def dash_cases(configs):
+    from helper_functions_callbacks import chart_layout
+    from utils import savings_calculation
+
+    for years in HORIZONS:
+        args = scenario_args(configs, years)
+        yield f'savings_calculation/{years}y', lambda args=args: savings_calculation(args, configs), lambda result: checksum(result.to_numpy())
+        result = savings_calculation(args, configs)
+        yield (
+            f'chart_data/{years}y',
+            lambda result=result: result.to_chart_data(),
+            lambda data: checksum([values for _, values in data['series']]),
+        )
+    yield 'chart_layout', lambda: chart_layout('Savings Corpus', 'Year', 'Amount', 'Savings Instrument'), None
+    yield from projection_cases(configs)
+
+def flask_cases(configs):
+    import app
+    from utils import savings_calculation
+
+    client = app.app.test_client()
+    def render_index(args):
+        with app.app.test_request_context():
+            return app.render_index(args)
+
+    for years in HORIZONS:
+        args = scenario_args(configs, years)
+        yield (
+            f'savings_calculation/{years}y',
+            lambda args=args: savings_calculation(args, configs),
+            lambda result: checksum(result.to_numpy()),
+        )
+        # the page shows the current years, only the time to render it is compared
+        yield f'render_index/{years}y', lambda args=args: render_index(args), None
+
+    query = {key: str(value) for key, value in scenario_args(configs, 25).items() if key in configs.get_input_keys()}
+    def cold_request():
+        app.page_cache.clear()
+        return client.get('/', query_string=query).status_code
+    yield 'index/cold', cold_request, None
+    yield 'index/cached', lambda: client.get('/', query_string=query).status_code, None
+    yield from projection_cases(configs)
+
+CASES = {'dash': dash_cases, 'flask': flask_cases}
+
+def measure(run, repeat, max_seconds):
+    '''
+    Times <repeat> calls of <run> after a warm-up call, stopping early once <max_seconds> are spent.
+    Returns the result of the warm-up call and the timings in ms.
+    '''
+    result = run()
+    samples = []
+    deadline = time.perf_counter() + max_seconds
+    while len(samples) < repeat and (len(samples) < 5 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples = np.array(samples)
+    return result, {
+        'calls': len(samples),
+        'mean_ms': round(float(samples.mean()), 4),
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p99_ms': round(float(np.percentile(samples, 99)), 4),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    '''
+    Status of every case against the baseline: ok, new, regression or parity
+    '''
+    statuses = {}
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            statuses[name] = 'new'
+        elif reference.get('checksum') != result.get('checksum'):
+            statuses[name] = 'parity'
+        elif all(
+            result[stat] > reference[stat] * (1 + threshold) and result[stat] - reference[stat] > MIN_REGRESSION_MS
+            for stat in ('p50_ms', 'p99_ms')
+        ):
+            statuses[name] = 'regression'
+        else:
+            statuses[name] = 'ok'
+    return statuses
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', choices=sorted(APP_DIRS), required=True)
+    parser.add_argument('--filter', default='', help='only run the cases whose name contains this text')
+    parser.add_argument('--repeat', type=int, default=200, help='timed calls per case')
+    parser.add_argument('--max-seconds', type=float, default=2.0, help='time budget per case')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--history', default=HISTORY_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true', help='store this run as the baseline of the app')
+    options = parser.parse_args(argv)
+
+    sys.path.insert(0, APP_DIRS[options.app])
+    from params import Params
+    configs = Params()
+
+    results = {}
+    runs = {}
+    for name, run, digest in CASES[options.app](configs):
+        if options.filter not in name:
+            continue
+        result, timings = measure(run, options.repeat, options.max_seconds)
+        results[name] = {**timings, 'checksum': digest(result) if digest else None}
+        runs[name] = run
+
+    baselines = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            baselines = json.load(f)
+    baseline = baselines.get(options.app, {})
+    statuses = compare(results, baseline, options.threshold)
+    # a slower case may have hit a busy moment of the machine, its fastest timing is kept
+    for name in [name for name, status in statuses.items() if status == 'regression' and not options.update_baseline]:
+        for _ in range(RETRIES):
+            _, timings = measure(runs[name], options.repeat, options.max_seconds)
+            if timings['p50_ms'] < results[name]['p50_ms']:
+                results[name].update(timings)
+            statuses[name] = compare({name: results[name]}, baseline, options.threshold)[name]
+            if statuses[name] != 'regression':
+                break
+
+    print(f'{"case":32} {"mean ms":>10} {"p50 ms":>10} {"p99 ms":>10} {"base p99":>10}  status')
+    for name, result in results.items():
+        base_p99 = baseline.get(name, {}).get('p99_ms')
+        base_p99 = f'{base_p99:10.3f}' if base_p99 is not None else f'{"-":>10}'
+        print(f'{name:32} {result["mean_ms"]:10.3f} {result["p50_ms"]:10.3f} {result["p99_ms"]:10.3f} {base_p99}  {statuses[name]}')
+
+    with open(options.history, 'a') as f:
+        f.write(json.dumps({
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'app': options.app,
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'results': results,
+            'statuses': statuses,
+        }) + '\n')
+
+    if options.update_baseline:
+        baselines[options.app] = {**baseline, **results}
+        with open(options.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+    failures = [name for name, status in statuses.items() if status in ('regression', 'parity')]
+    for name in failures:
+        print(f'{statuses[name]}: {name}', file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
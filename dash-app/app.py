@@ -1,18 +1,43 @@
-import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
-from datetime import date
-import pandas as pd
-import plotly.express as px
+from startup import startup_report
 
-from params import Params
-from utils import create_input_text_boxes, savings_calculation
-from helper_functions_callbacks import savings_chart_filter, base_chart_template
+# the imports are timed for the startup report, served on /startup
+with startup_report.recording_imports():
+    import time
+    import dash
+    from dash import dcc, html
+    from dash.dependencies import ClientsideFunction, Input, Output, State
+    from dash.exceptions import PreventUpdate
+    from datetime import date
+    from functools import lru_cache
+    from flask import Response, g, request
+
+    from inputs import MAX_YEARS_TILL_RETIREMENT, InputError, ProjectionInputs
+    from metrics import CONTENT_TYPE, observe, prometheus_text, timed
+    from params import Params
+    from projection import VIEW_LABELS, VIEWS
+    from utils import create_input_text_boxes, savings_calculation
+    from helper_functions_callbacks import chart_layout, tornado_chart_data, tornado_layout
+    from monte_carlo import simulate
+    from goal_seek import UNKNOWNS as GOAL_SEEK_UNKNOWNS, solve_for
+    from coalescing import Coalescer, Superseded
+    from jobs import job_queue
+    from sensitivity import CONTRIBUTION_DELTA, RATE_DELTA, sensitivity_analysis
 
 RUPEE_SYMBOL = u'\u20B9'
 
 configs = Params()
 
+# stochastic returns and inflation for the percentile bands of the chart, a fixed seed keeps the bands steady between updates
+MONTE_CARLO_PATHS = 2000
+MONTE_CARLO_SEED = 0
+# paths of the band computed by a background job on request, too many for a callback
+BACKGROUND_MONTE_CARLO_PATHS = 50000
+# ms between two polls of the background job
+JOB_POLL_INTERVAL = 1000
+
+# computations of the server callbacks, one at a time per page and callback, the superseded ones are dropped
+coalescer = Coalescer()
+
 usage_instructions = [
     'Current Savings By Instrument: Provide the current value of your investments in various options, such as mutual funds, FD, PF etc.',
     'Contributions (% basic salary): Provide the amount in terms of the % of your basic salary that is deducted towards NPS and PF.',
@@ -41,225 +66,566 @@ external_stylesheets = [
         "rel": "stylesheet",
     },
 ]
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-app.title = 'Financial Health Calculator'
-server = app.server
 
-app.layout = html.Div(
-    children=[
-        # header
-        html.Div(
-            children=[
-                html.P(children='🧩', className='header-emoji'),
-                html.H1(children='Financial Health Calculator', className='header-title'),
-                html.P(
-                    children='road to financial freedom: estimate your financial health',
-                    className='header-description'
-                ),
-            ],
-            className='header',
-        ),
-        # usage instructions
-        html.Div(
-            children=[
-                html.Div(
-                    children='Instructions for using this Calculator',
-                    className='descriptor-title'
-                ),
-                html.Div(
-                    children="There are 5 input sections where you can provide your financial details:",
-                    className='descriptor-description'
-                ),
-                html.Ul([html.Li(x, className='descriptor-description') for x in usage_instructions]),
-                html.Div(
-                    children='The graph at the bottom of the page will show you the value of your savings corpus every year, untill your retirement.',
-                    className='descriptor-description'
-                )
-            ],
-            className='descriptor',
-        ),
-        # current savings by instrument
-        html.Div(
-            children=[
-                html.Div(
-                    children='Current Savings By Instrument',
-                    className='subsection-title'
-                ),
-                html.Div(
-                    children=create_input_text_boxes(tuple(configs.current_savings_by_instrument.items())),
-                    className='menu'
-                )
-            ],
-            className='menu-descriptor',
-        ),
-        # contributions (% basic salary)
-        html.Div(
-            children=[
-                html.Div(
-                    children='Contributions (% basic salary)',
-                    className='subsection-title'
-                ),
-                html.Div(
-                    children=create_input_text_boxes(tuple(configs.basic_pct_contributions.items()), suffix=' (%)'),
-                    className='menu'
-                )
-            ],
-            className='menu-descriptor',
-        ),
-        # yearly contributions
-        html.Div(
-            children=[
-                html.Div(
-                    children='Yearly Contributions',
-                    className='subsection-title'
-                ),
-                html.Div(
-                    children=create_input_text_boxes(tuple(configs.contributions.items())),
-                    className='menu'
-                )
-            ],
-            className='menu-descriptor',
-        ),
-        # income and expenses
-        html.Div(
-            children=[
-                html.Div(
-                    children='Income and Expenses',
-                    className='subsection-title'
-                ),
-                html.Div(
-                    children=create_input_text_boxes(tuple(configs.income_and_expenses.items())),
-                    className='menu'
-                )
-            ],
-            className='menu-descriptor',
-        ),
-        # rates
-        html.Div(
-            children=[
-                html.Div(
-                    children='Rates',
-                    className='subsection-title'
-                ),
-                html.Div(
-                    children=create_input_text_boxes(tuple(configs.rates.items())[:6], suffix=' (%)'),
-                    className='menu'
+def metrics():
+    return Response(prometheus_text(), content_type=CONTENT_TYPE)
+
+def startup():
+    return startup_report.to_dict()
+
+# callback requests end to end, including the serialization of the outputs by dash
+def start_timer():
+    g.request_start = time.perf_counter()
+
+def record_callback_time(response):
+    if request.path.endswith('/_dash-update-component') and 'request_start' in g:
+        observe('dash.callback_request', time.perf_counter() - g.request_start)
+    return response
+
+def create_layout():
+    return html.Div(
+        children=[
+            # header
+            html.Div(
+                children=[
+                    html.P(children='🧩', className='header-emoji'),
+                    html.H1(children='Financial Health Calculator', className='header-title'),
+                    html.P(
+                        children='road to financial freedom: estimate your financial health',
+                        className='header-description'
+                    ),
+                ],
+                className='header',
+            ),
+            # usage instructions
+            html.Div(
+                children=[
+                    html.Div(
+                        children='Instructions for using this Calculator',
+                        className='descriptor-title'
+                    ),
+                    html.Div(
+                        children="There are 5 input sections where you can provide your financial details:",
+                        className='descriptor-description'
+                    ),
+                    html.Ul([html.Li(x, className='descriptor-description') for x in usage_instructions]),
+                    html.Div(
+                        children='The graph at the bottom of the page will show you the value of your savings corpus every year, untill your retirement.',
+                        className='descriptor-description'
+                    )
+                ],
+                className='descriptor',
+            ),
+            # current savings by instrument
+            html.Div(
+                children=[
+                    html.Div(
+                        children='Current Savings By Instrument',
+                        className='subsection-title'
+                    ),
+                    html.Div(
+                        children=create_input_text_boxes(tuple(configs.current_savings_by_instrument.items())),
+                        className='menu'
+                    )
+                ],
+                className='menu-descriptor',
+            ),
+            # contributions (% basic salary)
+            html.Div(
+                children=[
+                    html.Div(
+                        children='Contributions (% basic salary)',
+                        className='subsection-title'
+                    ),
+                    html.Div(
+                        children=create_input_text_boxes(tuple(configs.basic_pct_contributions.items()), suffix=' (%)'),
+                        className='menu'
+                    )
+                ],
+                className='menu-descriptor',
+            ),
+            # yearly contributions
+            html.Div(
+                children=[
+                    html.Div(
+                        children='Yearly Contributions',
+                        className='subsection-title'
+                    ),
+                    html.Div(
+                        children=create_input_text_boxes(tuple(configs.contributions.items())),
+                        className='menu'
+                    )
+                ],
+                className='menu-descriptor',
+            ),
+            # income and expenses
+            html.Div(
+                children=[
+                    html.Div(
+                        children='Income and Expenses',
+                        className='subsection-title'
+                    ),
+                    html.Div(
+                        children=create_input_text_boxes(tuple(configs.income_and_expenses.items())),
+                        className='menu'
+                    )
+                ],
+                className='menu-descriptor',
+            ),
+            # rates
+            html.Div(
+                children=[
+                    html.Div(
+                        children='Rates',
+                        className='subsection-title'
+                    ),
+                    html.Div(
+                        children=create_input_text_boxes(tuple(configs.rates.items())[:6], suffix=' (%)'),
+                        className='menu'
+                    ),
+                    html.Div(
+                        children=create_input_text_boxes(tuple(configs.rates.items())[6:], suffix=' (%)'),
+                        className='menu'
+                    ),
+                ],
+                className='menu-descriptor',
+            ),
+            # timeframe slider
+            html.Div(
+                children=[
+                    html.Div(
+                        children=[
+                            html.Div(children='Timeframe', className='center-align'),
+                            dcc.RangeSlider(
+                                id="timeframe_slider",
+                                min=configs.years_list[0],
+                                max=configs.years_list[-1],
+                                step=1,
+                                value=[configs.years_list[0], configs.years_list[-1]],
+                                marks={year: str(year) for year in configs.years_list},
+                                allowCross=False,
+                                className='margin10',
+                            ),
+                        ],
+                    ),
+                ],
+                className='temp',
+            ),
+            # checklist
+            html.Div(
+                children=[
+                    html.Div(
+                        children=[
+                            html.Div(children='Savings Instrument', className='center-align'),
+                            dcc.Checklist(
+                                id="savings_instrument_checklist",
+                                options=[{"label": savings_instrument, "value": savings_instrument} for savings_instrument in all_savings_instruments],
+                                value=[all_savings_instruments[0]]+[all_savings_instruments[-1]],
+                                labelStyle={'display': 'inline-block'},
+                                className='checklist',
+                            ),
+                            dcc.Checklist(
+                                id="monte_carlo_checklist",
+                                options=[{"label": "Total Savings P10-P90 band (stochastic returns and inflation)", "value": "bands"}],
+                                value=[],
+                                labelStyle={'display': 'inline-block'},
+                                className='checklist',
+                            ),
+                            # the band of many more paths, computed by the job workers (python jobs.py) and polled
+                            html.Div(
+                                children=[
+                                    html.Button(f'Compute the band of {BACKGROUND_MONTE_CARLO_PATHS:,} paths', id='bands_job_button', n_clicks=0),
+                                    html.Button('Cancel', id='bands_job_cancel', n_clicks=0),
+                                    html.Progress(id='bands_job_progress', value=0, max=1),
+                                    html.Span(id='bands_job_status'),
+                                    dcc.Interval(id='bands_job_interval', interval=JOB_POLL_INTERVAL, disabled=True),
+                                    dcc.Store(id='bands_job'),
+                                    dcc.Store(id='background_bands_store'),
+                                ],
+                            ),
+                            # derived from the stored projection, switching views does not project again
+                            dcc.RadioItems(
+                                id="view_radio",
+                                options=[{"label": VIEW_LABELS[view], "value": view} for view in VIEWS],
+                                value="nominal",
+                                labelStyle={'display': 'inline-block'},
+                                className='checklist',
+                            ),
+                            dcc.RadioItems(
+                                id="frequency_radio",
+                                options=[
+                                    {"label": "Yearly contributions and compounding", "value": "yearly"},
+                                    {"label": "Monthly SIPs, deductions and compounding", "value": "monthly"},
+                                ],
+                                value="yearly",
+                                labelStyle={'display': 'inline-block'},
+                                className='checklist',
+                            ),
+                            dcc.RadioItems(
+                                id="tax_regime_radio",
+                                options=[
+                                    {"label": "Old tax regime", "value": "old"},
+                                    {"label": "New tax regime", "value": "new"},
+                                    {"label": "Cheaper regime every year", "value": "auto"},
+                                ],
+                                value="old",
+                                labelStyle={'display': 'inline-block'},
+                                className='checklist',
+                            ),
+                        ],
+                    ),
+                ],
+                className='menu',
+            ),
+            # inputs that cannot be projected, the chart keeps showing the last valid projection
+            html.Ul(id='input_errors', className='input-errors'),
+            # projection of the current inputs, its stochastic bands and the chart layouts, the charts are drawn from them
+            # in the browser and every store is only sent again when its own inputs change
+            dcc.Store(id='projection_store'),
+            dcc.Store(id='bands_store'),
+            # numbered requests of the server callbacks, set in the browser when their inputs change
+            dcc.Store(id='projection_request'),
+            dcc.Store(id='sensitivity_request'),
+            dcc.Store(
+                id='chart_layout_store',
+                data=chart_layout(
+                    title_text='Yearly Savings Chart',
+                    x_title='Year',
+                    y_title='Amount',
+                    legend_title='Savings Instrument',
                 ),
-                html.Div(
-                    children=create_input_text_boxes(tuple(configs.rates.items())[6:], suffix=' (%)'),
-                    className='menu'
+            ),
+            dcc.Store(id='sensitivity_store'),
+            dcc.Store(
+                id='sensitivity_layout_store',
+                data=tornado_layout(
+                    title_text=f'Sensitivity (rates and % basic {RATE_DELTA:+} / {-RATE_DELTA:+} points, contributions {CONTRIBUTION_DELTA:+.0%} / {-CONTRIBUTION_DELTA:+.0%})',
                 ),
-            ],
-            className='menu-descriptor',
-        ),
-        # timeframe slider
-        html.Div(
-            children=[
-                html.Div(
-                    children=[
-                        html.Div(children='Timeframe', className='center-align'),
-                        dcc.RangeSlider(
-                            id="timeframe_slider",
-                            min=configs.years_list[0],
-                            max=configs.years_list[-1],
-                            step=1,
-                            value=[configs.years_list[0], configs.years_list[-1]],
-                            marks={year: str(year) for year in configs.years_list},
-                            allowCross=False,
-                            className='margin10',
+            ),
+            # plot
+            html.Div(
+                children=[
+                    html.Div(
+                        children=dcc.Graph(
+                            id='savings_chart',
+                            config={'displayModeBar': False},
                         ),
-                    ],
-                ),
-            ],
-            className='temp',
-        ),
-        # checklist
-        html.Div(
-            children=[
-                html.Div(
-                    children=[
-                        html.Div(children='Savings Instrument', className='center-align'),
-                        dcc.Checklist(
-                            id="savings_instrument_checklist",
-                            options=[{"label": savings_instrument, "value": savings_instrument} for savings_instrument in all_savings_instruments],
-                            value=[all_savings_instruments[0]]+[all_savings_instruments[-1]],
-                            labelStyle={'display': 'inline-block'},
-                            className='checklist',
+                        className='card',
+                    ),
+                ],
+                className='wrapper'
+            ),
+            # sensitivity
+            html.Div(
+                children=[
+                    html.Div(
+                        children=dcc.Graph(
+                            id='sensitivity_chart',
+                            config={'displayModeBar': False},
                         ),
-                    ],
-                ),
-            ],
-            className='menu',
-        ),
-        # plot
-        html.Div(
-            children=[
-                html.Div(
-                    children=dcc.Graph(
-                        id='savings_chart',
-                        config={'displayModeBar': False},
+                        className='card',
                     ),
-                    className='card',
-                ),
-            ],
-            className='wrapper'
-        ),
-    ]
-)
+                ],
+                className='wrapper'
+            ),
+            # goal seek
+            html.Div(
+                children=[
+                    html.Div(
+                        children='Goal Seek: reach a Total Savings corpus at retirement',
+                        className='subsection-title'
+                    ),
+                    html.Div(
+                        children=[
+                            html.Div(
+                                children=[
+                                    html.Div(children='Solve For', className='menu-title'),
+                                    dcc.Dropdown(
+                                        id='goal_seek_unknown',
+                                        options=[{'label': name.replace('_', ' ').title(), 'value': name} for name in GOAL_SEEK_UNKNOWNS],
+                                        value=next(iter(GOAL_SEEK_UNKNOWNS)),
+                                        clearable=False,
+                                        style={'width': '240px'},
+                                    ),
+                                ]
+                            ),
+                            html.Div(
+                                children=[
+                                    html.Div(children='Target Corpus', className='menu-title'),
+                                    dcc.Input(id='goal_seek_target', type='number', value=100000000),
+                                ]
+                            ),
+                            html.Button('Solve', id='goal_seek_button', n_clicks=0),
+                            html.Div(id='goal_seek_answer', className='menu-title'),
+                        ],
+                        className='menu'
+                    ),
+                ],
+                className='menu-descriptor',
+            ),
+        ]
+    )
 
 # timeframe slider
-@app.callback(
-    [Output("timeframe_slider", "min"), Output("timeframe_slider", "max"), Output("timeframe_slider", "value"), Output("timeframe_slider", "marks")],
-    [Input("years_till_retirement", "value")]
-)
 def update_timeframe_slider(years_till_retirement):
+    if not isinstance(years_till_retirement, int) or not 0 <= years_till_retirement <= MAX_YEARS_TILL_RETIREMENT:
+        raise PreventUpdate
     current_year = date.today().year
     years_list = list(range(current_year, current_year + years_till_retirement + 1))
     return years_list[0], years_list[-1], [years_list[0], years_list[-1]], {year: str(year) for year in years_list}
 
-# chart filtering for trend analysis
-@app.callback(
-    Output("savings_chart", "figure"),
-    [
-        Input("savings_instrument_checklist", "value"),
-        Input("timeframe_slider", "value"),
-        *[Input(id, "value") for id in configs.current_savings_by_instrument.keys()],
-        *[Input(id, "value") for id in configs.basic_pct_contributions.keys()],
-        *[Input(id, "value") for id in configs.contributions.keys()],
-        *[Input(id, "value") for id in configs.income_and_expenses.keys()],
-        *[Input(id, "value") for id in configs.rates.keys()],
-    ]
-)
-def update_savings_chart(*values):
-    selected_savings_instruments = values[0]
-    start_year, end_year = values[1]
-    inputs = values[2:]
-    
-    keys = [
-        *list(configs.current_savings_by_instrument.keys()),
-        *list(configs.basic_pct_contributions.keys()),
-        *list(configs.contributions.keys()),
-        *list(configs.income_and_expenses.keys()),
-        *list(configs.rates.keys()),
-    ]
-    current_args = dict(zip(keys, inputs))
-    df = savings_calculation(current_args, configs)
-    filtered_data = savings_chart_filter(df.copy(), selected_savings_instruments, start_year, end_year)
-
-    fig = base_chart_template(
-        filtered_data,
-        x = 'Year',
-        y = 'Amount',
-        color_col = 'Savings Instrument',
-        custom_data_list = ['# Guests'],
-        hovertemplate = "<br>".join([
-            "Year: %{x}",
-            "Amount: %{y:,.0f}",
-            #"# Guests: %{customdata[0]:,}",
-        ]),
-        title_text = 'Yearly Savings Chart'
+def parse_inputs(values):
+    return ProjectionInputs.from_args(dict(zip(configs.get_input_keys(), values)), configs)
+
+# projection, recomputed only when the financial inputs change
+@lru_cache(maxsize=128)
+def projection_result(inputs: ProjectionInputs, frequency, tax_regime):
+    '''
+    Memoized on the parsed inputs, going back to an earlier set of inputs reuses its projection and its derived views
+    '''
+    with timed('dash.update_projection.projection'):
+        return savings_calculation(inputs, configs, frequency, tax_regime)
+
+@lru_cache(maxsize=128)
+def projection_chart_data(inputs: ProjectionInputs, frequency, tax_regime, view='nominal'):
+    result = projection_result(inputs, frequency, tax_regime)
+    return {
+        **result.to_chart_data(view=view),
+        'label': VIEW_LABELS[view],
+        'unit': '%' if result.view(view).dtype.kind == 'f' else '',
+    }
+
+@lru_cache(maxsize=128)
+def projection_bands(inputs: ProjectionInputs, frequency, tax_regime):
+    with timed('dash.update_projection.monte_carlo'):
+        _, bands = simulate(inputs, configs, no_of_paths=MONTE_CARLO_PATHS, seed=MONTE_CARLO_SEED, frequency=frequency, tax_regime=tax_regime)
+    return {
+        'name': 'Total Savings',
+        'percentiles': [[f'P{percentile}', bands[percentile].tolist()] for percentile in sorted(bands)],
+    }
+
+def input_errors(error: InputError):
+    return [html.Li(f"{key.replace('_', ' ').title()} {message}") for key, message in error.errors.items()]
+
+def update_projection(request, monte_carlo_options, view, frequency, tax_regime, *inputs):
+    try:
+        inputs = parse_inputs(inputs)
+    except InputError as e:
+        return dash.no_update, dash.no_update, input_errors(e)
+
+    def compute():
+        try:
+            # the bands are of the nominal amounts
+            bands = projection_bands(inputs, frequency, tax_regime) if 'bands' in monte_carlo_options and view == 'nominal' else None
+            # showing or hiding the bands leaves the projection as it is in the browser
+            if request and request['triggered'] == ['monte_carlo_checklist.value']:
+                return dash.no_update, bands, dash.no_update
+            return projection_chart_data(inputs, frequency, tax_regime, view), bands, []
+        except InputError as e:
+            # inputs in range whose projection overflows
+            return dash.no_update, None, input_errors(e)
+    return coalesced('dash.update_projection', request, compute)
+
+# sensitivity of the retirement corpus to every rate and contribution
+def update_sensitivity_chart(request, frequency, tax_regime, *inputs):
+    try:
+        inputs = parse_inputs(inputs)
+    except InputError:
+        # reported next to the savings chart
+        raise PreventUpdate
+
+    def compute():
+        try:
+            base_corpus, rows = sensitivity_analysis(inputs, configs, frequency=frequency, tax_regime=tax_regime)
+        except InputError:
+            # the overflow is reported next to the savings chart too
+            raise PreventUpdate
+        return tornado_chart_data(rows, base_corpus)
+    return coalesced('dash.update_sensitivity_chart', request, compute)
+
+def coalesced(kind, request, compute):
+    if request is None:
+        return compute()
+    try:
+        return coalescer.run(kind, request, compute)
+    except Superseded:
+        raise PreventUpdate
+
+# band of BACKGROUND_MONTE_CARLO_PATHS paths, submitted as a background job and polled till it is done, dropped
+# (and its job cancelled) when the inputs, the frequency or the tax regime change, the requests of the sensitivity
+# chart, which has no other inputs
+def update_bands_job(n_clicks, cancel_clicks, n_intervals, request, job_id, frequency, tax_regime, *inputs):
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    queue = job_queue()
+    if 'bands_job_button.n_clicks' in triggered:
+        try:
+            inputs = parse_inputs(inputs)
+        except InputError:
+            raise PreventUpdate
+        if job_id:
+            queue.cancel(job_id)
+        job_id = queue.submit('monte_carlo', {
+            'args': dict(zip(inputs.keys, inputs.values)),
+            'no_of_paths': BACKGROUND_MONTE_CARLO_PATHS,
+            'seed': MONTE_CARLO_SEED,
+            'frequency': frequency,
+            'tax_regime': tax_regime,
+        })
+        return job_id, False, 0, 'Queued', None
+    if 'sensitivity_request.data' in triggered:
+        # the band, computed or not, is of other inputs
+        if job_id:
+            queue.cancel(job_id)
+        return None, True, 0, '', None
+    if job_id is None:
+        raise PreventUpdate
+    if 'bands_job_cancel.n_clicks' in triggered:
+        queue.cancel(job_id)
+        return None, True, 0, 'Cancelled', None
+
+    state = queue.get(job_id)
+    if state is None:
+        return None, True, 0, 'The job was lost', None
+    progress = state['progress']
+    if state['state'] in ('queued', 'running'):
+        return job_id, False, progress, f"{state['state'].title()} {state['progress']:.0%}", dash.no_update
+    if state['state'] != 'done':
+        return None, True, progress, state['error'] or state['state'].title(), None
+    return None, True, progress, 'Done', {'name': 'Total Savings', 'percentiles': queue.result(job_id)['percentiles']}
+
+# goal seek, the solver starts from its previous answer
+def update_goal_seek(n_clicks, unknown, target_corpus, frequency, tax_regime, *inputs):
+    if not n_clicks or target_corpus is None:
+        return ''
+    try:
+        answer = solve_for(unknown, target_corpus, parse_inputs(inputs), configs, frequency=frequency, tax_regime=tax_regime)
+    except ValueError as e:
+        return str(e)
+    suffix = ' (%)' if unknown in configs.rates else ''
+    return f"{unknown.replace('_', ' ').title()}{suffix}: {answer:,.2f}" if isinstance(answer, float) else f"{unknown.replace('_', ' ').title()}: {answer:,}"
+
+def register_callbacks(app):
+    app.callback(
+        [Output("timeframe_slider", "min"), Output("timeframe_slider", "max"), Output("timeframe_slider", "value"), Output("timeframe_slider", "marks")],
+        [Input("years_till_retirement", "value")]
+    )(update_timeframe_slider)
+    # the server callbacks run on the numbered requests, with the inputs as they are when the request is sent
+    app.clientside_callback(
+        ClientsideFunction(namespace='charts', function_name='next_request'),
+        Output("projection_request", "data"),
+        [
+            Input("monte_carlo_checklist", "value"),
+            Input("view_radio", "value"),
+            Input("frequency_radio", "value"),
+            Input("tax_regime_radio", "value"),
+            *[Input(id, "value") for id in configs.get_input_keys()],
+        ]
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='charts', function_name='next_request'),
+        Output("sensitivity_request", "data"),
+        [Input("frequency_radio", "value"), Input("tax_regime_radio", "value"), *[Input(id, "value") for id in configs.get_input_keys()]]
     )
-    return(fig)
+    app.callback(
+        [Output("projection_store", "data"), Output("bands_store", "data"), Output("input_errors", "children")],
+        [Input("projection_request", "data")],
+        [
+            State("monte_carlo_checklist", "value"),
+            State("view_radio", "value"),
+            State("frequency_radio", "value"),
+            State("tax_regime_radio", "value"),
+            *[State(id, "value") for id in configs.get_input_keys()],
+        ]
+    )(update_projection)
+    # chart filtering for trend analysis, runs in the browser on the stored projection
+    app.clientside_callback(
+        ClientsideFunction(namespace='charts', function_name='savings_chart'),
+        Output("savings_chart", "figure"),
+        [
+            Input("projection_store", "data"),
+            Input("bands_store", "data"),
+            Input("background_bands_store", "data"),
+            Input("monte_carlo_checklist", "value"),
+            Input("savings_instrument_checklist", "value"),
+            Input("timeframe_slider", "value"),
+        ],
+        [State("chart_layout_store", "data")]
+    )
+    app.callback(
+        [
+            Output("bands_job", "data"),
+            Output("bands_job_interval", "disabled"),
+            Output("bands_job_progress", "value"),
+            Output("bands_job_status", "children"),
+            Output("background_bands_store", "data"),
+        ],
+        [
+            Input("bands_job_button", "n_clicks"),
+            Input("bands_job_cancel", "n_clicks"),
+            Input("bands_job_interval", "n_intervals"),
+            Input("sensitivity_request", "data"),
+        ],
+        [
+            State("bands_job", "data"),
+            State("frequency_radio", "value"),
+            State("tax_regime_radio", "value"),
+            *[State(id, "value") for id in configs.get_input_keys()],
+        ]
+    )(update_bands_job)
+    app.callback(
+        Output("sensitivity_store", "data"),
+        [Input("sensitivity_request", "data")],
+        [State("frequency_radio", "value"), State("tax_regime_radio", "value"), *[State(id, "value") for id in configs.get_input_keys()]]
+    )(update_sensitivity_chart)
+    app.clientside_callback(
+        ClientsideFunction(namespace='charts', function_name='sensitivity_chart'),
+        Output("sensitivity_chart", "figure"),
+        [Input("sensitivity_store", "data")],
+        [State("sensitivity_layout_store", "data")]
+    )
+    app.callback(
+        Output("goal_seek_answer", "children"),
+        [Input("goal_seek_button", "n_clicks")],
+        [
+            State("goal_seek_unknown", "value"),
+            State("goal_seek_target", "value"),
+            State("frequency_radio", "value"),
+            State("tax_regime_radio", "value"),
+            *[State(id, "value") for id in configs.get_input_keys()],
+        ]
+    )(update_goal_seek)
+
+def create_app():
+    '''
+    The Dash app with its layout, callbacks and the /metrics and /startup routes of its Flask server.
+    gunicorn.conf.py loads it once in the master process and forks the workers from it, the layout, the imported
+    modules and the warmed up caches are then shared by the workers instead of being built again in each of them.
+    '''
+    app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+    app.title = 'Financial Health Calculator'
+    server = app.server
+    server.add_url_rule("/metrics", view_func=metrics)
+    server.add_url_rule("/startup", view_func=startup)
+    server.before_request(start_timer)
+    server.after_request(record_callback_time)
+    with startup_report.stage('dash.layout'):
+        app.layout = create_layout()
+    with startup_report.stage('dash.callbacks'):
+        register_callbacks(app)
+    return app
+
+def warm_up():
+    '''
+    Projects the default inputs once, like the first page load does, so that the tax rules and the memoized chart data
+    are ready before the workers are forked
+    '''
+    values = [configs.get_var_dict()[key] for key in configs.get_input_keys()]
+    projection_chart_data(parse_inputs(values), 'yearly', 'old')
+    update_sensitivity_chart(None, 'yearly', 'old', *values)
+
+with startup_report.stage('dash.create_app'):
+    app = create_app()
+server = app.server
 
 if __name__ == '__main__':
     app.run_server(debug=True)
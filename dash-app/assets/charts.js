@@ -0,0 +1,103 @@
+// clientside callbacks: the chart is filtered in the browser from the projection kept in a dcc.Store,
+// so ticking an instrument or dragging the timeframe slider needs no server round-trip.
+// The figures are built here from the data sent by the server and a layout sent once with the page.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    charts: {
+        // numbers every change of the inputs of the server callbacks, so that the server can drop the computations of
+        // the requests superseded by newer ones of the same page
+        next_request: function() {
+            var charts = window.dash_clientside.charts;
+            if (!charts.session) {
+                charts.session = Math.random().toString(36).slice(2) + Date.now().toString(36);
+                charts.seq = 0;
+            }
+            charts.seq += 1;
+            var context = window.dash_clientside.callback_context;
+            return {
+                session: charts.session,
+                seq: charts.seq,
+                triggered: context ? context.triggered.map(function(trigger) { return trigger.prop_id; }) : [],
+            };
+        },
+        savings_chart: function(projection, bands, background_bands, monte_carlo_options, selected_savings_instruments, timeframe, layout) {
+            if (!projection) {
+                return window.dash_clientside.no_update;
+            }
+            // the band computed in the background, of more paths, replaces the one of the callback when the band is shown
+            if (background_bands && monte_carlo_options.indexOf('bands') !== -1 && projection.view === 'nominal') {
+                bands = background_bands;
+            }
+            var years = projection.years;
+            var start = Math.max(timeframe[0] - years[0], 0);
+            var end = Math.min(timeframe[1] - years[0], years.length - 1) + 1;
+            var x = years.slice(start, end);
+            var hovertemplate = projection.unit ? 'Year: %{x}<br>%{y:,.2f}' + projection.unit : 'Year: %{x}<br>Amount: %{y:,.0f}';
+
+            var data = projection.series
+                .filter(function(series) { return selected_savings_instruments.indexOf(series[0]) !== -1; })
+                .map(function(series) {
+                    return {
+                        type: 'scatter',
+                        mode: 'lines',
+                        name: series[0],
+                        x: x,
+                        y: series[1].slice(start, end),
+                        hovertemplate: hovertemplate,
+                    };
+                });
+
+            // stochastic bands: lowest to highest percentile shaded, the middle one dashed
+            if (bands) {
+                var name = bands.name;
+                var low = bands.percentiles[0];
+                var mid = bands.percentiles[1];
+                var high = bands.percentiles[2];
+                data.push({
+                    type: 'scatter', mode: 'lines', name: name + ' (' + high[0] + ')', showlegend: false,
+                    x: x, y: high[1].slice(start, end), line: {width: 0},
+                    hovertemplate: high[0] + ': %{y:,.0f}<extra></extra>',
+                });
+                data.push({
+                    type: 'scatter', mode: 'lines', name: name + ' (' + low[0] + '-' + high[0] + ')',
+                    x: x, y: low[1].slice(start, end), line: {width: 0}, fill: 'tonexty', fillcolor: 'rgba(23, 184, 151, 0.2)',
+                    hovertemplate: low[0] + ': %{y:,.0f}<extra></extra>',
+                });
+                data.push({
+                    type: 'scatter', mode: 'lines', name: name + ' (' + mid[0] + ')',
+                    x: x, y: mid[1].slice(start, end), line: {dash: 'dash', color: '#17B897'},
+                    hovertemplate: mid[0] + ': %{y:,.0f}<extra></extra>',
+                });
+            }
+            return {
+                data: data,
+                layout: Object.assign({}, layout, {
+                    yaxis: Object.assign({}, layout.yaxis, {title: {text: projection.label}, ticksuffix: projection.unit}),
+                }),
+            };
+        },
+        sensitivity_chart: function(sensitivity, layout) {
+            if (!sensitivity) {
+                return window.dash_clientside.no_update;
+            }
+            var hovertemplate = 'Value: %{customdata:,.2f}<br>Change: %{x:,.0f}<extra></extra>';
+            return {
+                data: [
+                    {
+                        type: 'bar', orientation: 'h', name: 'Input Down', y: sensitivity.labels, x: sensitivity.low_changes,
+                        customdata: sensitivity.low_values, hovertemplate: hovertemplate,
+                    },
+                    {
+                        type: 'bar', orientation: 'h', name: 'Input Up', y: sensitivity.labels, x: sensitivity.high_changes,
+                        customdata: sensitivity.high_values, hovertemplate: hovertemplate,
+                    },
+                ],
+                layout: Object.assign({}, layout, {
+                    height: 150 + 25 * sensitivity.labels.length,
+                    xaxis: Object.assign({}, layout.xaxis, {
+                        title: {text: 'Change of the corpus at retirement (base ' + sensitivity.base_corpus.toLocaleString('en-US') + ')'},
+                    }),
+                }),
+            };
+        }
+    }
+});
@@ -0,0 +1,228 @@
+'''
+Projects a file of profiles, e.g. every employee of a cohort, to Parquet:
+
+    python bulk.py profiles.csv results/ --workers 8
+
+<input> is a CSV or Parquet file with one row per profile and a column per input of Params.get_input_keys(), other
+columns are ignored. It is read CHUNK_SIZE rows at a time and the chunks are projected over a process pool, at most
+two chunks per worker are in flight so the memory does not grow with the file. Every chunk is written to its own
+partition, <output>/chunk=<n>/part.parquet, with one row per profile and year: row (position of the profile in the
+input), year and the amount of every entry of BATCH_COLUMNS at the start of the year.
+Rows with invalid inputs are not projected, they are listed in <output>/_errors/chunk=<n>.csv, with the rows whose
+projection overflows: a chunk that overflows is projected again one row at a time.
+A partition is renamed into place once complete, an interrupted run is resumed by running it again with the same
+options: the chunks already written are skipped.
+Parquet needs pyarrow, which the apps do not, it is imported only here.
+'''
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date
+
+import numpy as np
+
+from inputs import ProjectionOverflow, range_error
+from params import Params
+from projection import BATCH_COLUMNS, FREQUENCIES, parse_scenarios, run_batch
+from tax import TAX_REGIME_CHOICES
+
+CHUNK_SIZE = 10000
+# chunks in flight per worker, read ahead while the others are projected
+CHUNKS_PER_WORKER = 2
+MANIFEST = '_bulk.json'
+
+configs = Params()
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('reading and writing Parquet needs pyarrow: pip install pyarrow') from None
+    return pyarrow
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    '''
+    Iterator of DataFrames of <chunk_size> rows with the input columns of the CSV or Parquet file at <path>,
+    raises ValueError right away when some are missing
+    '''
+    import pandas as pd
+
+    keys = configs.get_input_keys()
+    if path.endswith('.parquet'):
+        parquet_file = import_pyarrow().parquet.ParquetFile(path)
+        columns = parquet_file.schema_arrow.names
+    else:
+        columns = pd.read_csv(path, nrows=0).columns
+    missing = [key for key in keys if key not in columns]
+    if missing:
+        raise ValueError(f'missing profile columns: {", ".join(missing)}')
+    if path.endswith('.parquet'):
+        return (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=list(keys)))
+    return pd.read_csv(path, usecols=list(keys), chunksize=chunk_size)
+
+def validate_chunk(frame):
+    '''
+    Splits a chunk of profiles into the valid ones, parsed like <parse_scenarios>, and the invalid ones.
+    Returns
+        inputs: one array per input, for the valid rows
+        valid: bool array, one per row of <frame>
+        errors: (row in <frame>, message) for the invalid rows, the first problem of every row
+    '''
+    import pandas as pd
+
+    valid = np.ones(len(frame), dtype=bool)
+    errors = {}
+    columns = {}
+    for key in configs.get_input_keys():
+        values = pd.to_numeric(frame[key], errors='coerce').to_numpy(dtype=np.float64)
+        for row in np.flatnonzero(~np.isfinite(values)):
+            value = frame[key].iloc[row]
+            errors.setdefault(int(row), f'{key} is required' if pd.isna(value) else f'{key} must be a number, got {value!r}')
+        finite = values[np.isfinite(values)]
+        # every valid range is an interval, the column is in range when its smallest and largest values are
+        if len(finite) and (range_error(key, finite.min(), configs) or range_error(key, finite.max(), configs)):
+            for row in np.flatnonzero(np.isfinite(values)):
+                message = range_error(key, values[row], configs)
+                if message is not None:
+                    errors.setdefault(int(row), f'{key} {message}')
+        columns[key] = values
+    valid[list(errors)] = False
+    inputs = parse_scenarios({key: values[valid] for key, values in columns.items()}, configs)
+    return inputs, valid, sorted(errors.items())
+
+def project_rows(inputs, rows, frequency='yearly', tax_regime='old'):
+    '''
+    Long table of the projection of every scenario of <inputs>: one row per scenario and year till its retirement.
+    When the projection overflows the scenarios are projected again one at a time, those that overflow are left out.
+    Returns
+        table: dict of columns: row (from <rows>, one per scenario), year and every entry of BATCH_COLUMNS
+        errors: (row from <rows>, message) for the scenarios that overflow
+    '''
+    rows = np.asarray(rows, dtype=np.int64)
+    try:
+        return long_table(run_batch(inputs, configs, frequency, tax_regime), inputs['years_till_retirement'], rows), []
+    except ProjectionOverflow:
+        pass
+    tables, errors = [], []
+    for i, row in enumerate(rows.tolist()):
+        scenario = {key: values[i:i + 1] for key, values in inputs.items()}
+        try:
+            tables.append(long_table(run_batch(scenario, configs, frequency, tax_regime), scenario['years_till_retirement'], rows[i:i + 1]))
+        except ProjectionOverflow as e:
+            errors.append((row, str(e)))
+    columns = ('row', 'year', *BATCH_COLUMNS)
+    if not tables:
+        return {key: np.zeros(0, dtype=np.int64) for key in columns}, errors
+    return {key: np.concatenate([table[key] for table in tables]) for key in columns}, errors
+
+def long_table(batch, no_of_years, rows):
+    active = np.arange(batch.shape[1]) <= no_of_years[:, None]
+    values = batch[active]
+    table = {
+        'row': np.repeat(rows, no_of_years + 1),
+        'year': date.today().year + np.nonzero(active)[1],
+    }
+    table.update(zip(BATCH_COLUMNS, values.T))
+    return table
+
+def partition_path(output, index):
+    return os.path.join(output, f'chunk={index:05d}', 'part.parquet')
+
+def write_chunk(index, start, frame, output, frequency='yearly', tax_regime='old'):
+    '''
+    Projects chunk <index> of the input, whose first row is row <start> of the input, and writes its partition.
+    Returns the number of projected and invalid rows, the rows whose projection overflows are invalid.
+    '''
+    pyarrow = import_pyarrow()
+    inputs, valid, errors = validate_chunk(frame)
+    table, overflows = project_rows(inputs, np.flatnonzero(valid), frequency, tax_regime)
+    errors = sorted([*errors, *overflows])
+    if errors:
+        errors_path = os.path.join(output, '_errors', f'chunk={index:05d}.csv')
+        os.makedirs(os.path.dirname(errors_path), exist_ok=True)
+        with open(errors_path, 'w') as f:
+            f.write('row,message\n')
+            f.writelines(f'{start + row},"{message.replace(chr(34), chr(34) * 2)}"\n' for row, message in errors)
+    table['row'] += start
+    path = partition_path(output, index)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pyarrow.parquet.write_table(pyarrow.table(table), f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+    return int(valid.sum()) - len(overflows), len(errors)
+
+def check_manifest(output, options):
+    '''
+    Records the options of the run in <output>, or checks that they are the options of the run being resumed there
+    '''
+    path = os.path.join(output, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != options:
+            raise ValueError(f'{output} holds the results of another run ({previous}), resume it with the same options or use another directory')
+        return
+    os.makedirs(output, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(options, f, indent=2)
+
+def project_file(path, output, chunk_size=CHUNK_SIZE, workers=None, frequency='yearly', tax_regime='old', log=sys.stderr):
+    '''
+    Projects every profile of the file at <path> into partitions of <output>, see the module docstring.
+    Returns the number of rows projected, invalid, and skipped because their chunk was written by an earlier run.
+    '''
+    import_pyarrow()
+    if frequency not in FREQUENCIES:
+        raise ValueError(f'frequency must be one of {", ".join(FREQUENCIES)}, got {frequency!r}')
+    if tax_regime not in TAX_REGIME_CHOICES:
+        raise ValueError(f'tax_regime must be one of {", ".join(TAX_REGIME_CHOICES)}, got {tax_regime!r}')
+    workers = workers or os.cpu_count()
+    chunks = read_chunks(path, chunk_size)
+    check_manifest(output, {
+        'input': os.path.abspath(path),
+        'chunk_size': chunk_size,
+        'frequency': frequency,
+        'tax_regime': tax_regime,
+        'year': date.today().year,
+    })
+
+    totals = {'projected': 0, 'invalid': 0, 'skipped': 0}
+    def done(index, future):
+        projected, invalid = future.result()
+        totals['projected'] += projected
+        totals['invalid'] += invalid
+        print(f'chunk {index}: {projected} projected, {invalid} invalid', file=log)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        start = 0
+        for index, frame in enumerate(chunks):
+            if os.path.exists(partition_path(output, index)):
+                totals['skipped'] += len(frame)
+            else:
+                if len(pending) >= CHUNKS_PER_WORKER * workers:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        done(pending.pop(future), future)
+                pending[executor.submit(write_chunk, index, start, frame, output, frequency, tax_regime)] = index
+            start += len(frame)
+        for future in list(pending):
+            done(pending.pop(future), future)
+    return totals
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='CSV or Parquet file of profiles')
+    parser.add_argument('output', help='directory of the Parquet partitions')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=None, help='processes projecting the chunks, the number of CPUs by default')
+    parser.add_argument('--frequency', choices=FREQUENCIES, default=FREQUENCIES[0])
+    parser.add_argument('--tax-regime', choices=TAX_REGIME_CHOICES, default=TAX_REGIME_CHOICES[0])
+    options = parser.parse_args()
+    try:
+        totals = project_file(options.input, options.output, options.chunk_size, options.workers, options.frequency, options.tax_regime)
+    except (ImportError, OSError, ValueError) as e:
+        parser.exit(1, f'{e}\n')
+    print(f'{totals["projected"]} profiles projected, {totals["invalid"]} invalid, {totals["skipped"]} already projected')
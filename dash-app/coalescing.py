@@ -0,0 +1,56 @@
+import threading
+from collections import OrderedDict
+
+from metrics import increment
+
+# sessions remembered, the least recently seen idle one is forgotten first
+MAX_SESSIONS = 10000
+
+class Superseded(Exception):
+    '''
+    A newer request of the same session and kind arrived before this one was computed
+    '''
+
+class Coalescer(object):
+    '''
+    Runs the computations of the requests of every browser session one at a time, per kind of request, and drops the
+    ones superseded while they waited: of a burst of requests only the one running and the newest are computed.
+    Requests are numbered by the browser, a request with a lower number than one already seen is superseded too.
+    Every dropped computation is counted in the metrics as <kind>.superseded_computations.
+    Sessions are tracked by the worker process that serves them.
+    '''
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        # (kind, session) -> [newest request number, lock held while computing]
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def run(self, kind, request, compute):
+        '''
+        compute() for <request> ({'session': id, 'seq': number}), raises Superseded instead once a newer request of
+        the session is known
+        '''
+        key = (kind, request['session'])
+        seq = request['seq']
+        with self._lock:
+            state = self._sessions.get(key)
+            if state is None:
+                state = self._sessions[key] = [seq, threading.Lock()]
+                self.forget_idle_sessions()
+            self._sessions.move_to_end(key)
+            if seq < state[0]:
+                return self.skip(kind)
+            state[0] = seq
+        with state[1]:
+            if state[0] != seq:
+                return self.skip(kind)
+            return compute()
+
+    def skip(self, kind):
+        increment(f'{kind}.superseded_computations')
+        raise Superseded
+
+    def forget_idle_sessions(self):
+        for key in list(self._sessions)[:max(len(self._sessions) - self.max_sessions, 0)]:
+            if not self._sessions[key][1].locked():
+                del self._sessions[key]
@@ -0,0 +1,197 @@
+'''
+Projections of the default inputs precomputed over a grid of the inputs visitors change the most, built offline and
+memory-mapped by the apps, so that a page with only those inputs changed is answered without running the projection.
+
+    python grid.py --frequency yearly --tax-regime old
+
+builds <GRID_DIR>/yearly-old.npy (and .json, .errors.npy). Every other input is the default of Params. The years
+till retirement need no axis: a projection over fewer years is a prefix of the projection over GRID_YEARS.
+A grid only answers while its fingerprint matches the Params, the current year (taxes follow the rules of the year)
+and GRID_VERSION, bump GRID_VERSION when the projection itself changes. Anything else falls back to the projection.
+Between the points of the grid the projection may be interpolated (bilinearly) when the error of the interpolation,
+measured at the centre of the cell while building, is within <max_error> (GRID_MAX_ERROR by default, 0 disables it):
+the largest difference to the projected amounts over every year, relative to the total savings corpus of the year.
+'''
+import argparse
+import hashlib
+import json
+import os
+from datetime import date
+
+import numpy as np
+
+from params import Params
+
+GRID_DIR = os.environ.get('GRID_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grid')
+# bump it when the projection changes, the grids built before are then ignored
+GRID_VERSION = 2
+# longest projection of the grid, the years till retirement of a hit must not be more
+GRID_YEARS = 50
+# inputs with an axis on the grid and their values, visitors mostly type round amounts
+GRID_AXES = (
+    ('annual_income', np.arange(300000, 10000001, 50000)),
+    ('monthly_fixed_expense', np.arange(5000, 200001, 5000)),
+)
+# largest interpolation error accepted by default, as a fraction of the total savings corpus of a year
+GRID_MAX_ERROR = float(os.environ.get('GRID_MAX_ERROR', 0))
+# scenarios projected together while building
+BUILD_CHUNK_SIZE = 1000
+
+# (frequency, tax_regime, year) -> ScenarioGrid, or None when there is no grid matching the current Params and year
+_grids = {}
+
+def grid_fingerprint(configs: Params, frequency, tax_regime, year):
+    variables = {key: value for key, value in configs.get_var_dict().items() if key != 'years_list'}
+    axes = [(key, values.tolist()) for key, values in GRID_AXES]
+    text = repr((GRID_VERSION, frequency, tax_regime, year, GRID_YEARS, axes, sorted(variables.items())))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def grid_paths(frequency, tax_regime, directory=None):
+    prefix = os.path.join(directory or GRID_DIR, f'{frequency}-{tax_regime}')
+    return f'{prefix}.npy', f'{prefix}.errors.npy', f'{prefix}.json'
+
+def default_inputs(configs: Params, no_of_scenarios):
+    from projection import parse_args
+    return {key: np.repeat(value, no_of_scenarios) for key, value in parse_args(configs.get_var_dict(), configs).items()}
+
+def project_points(configs: Params, frequency, tax_regime, points):
+    '''
+    Projection over GRID_YEARS of the default inputs with the axes set to every row of <points>,
+    an int64 array of shape (scenarios, len(INSTRUMENTS) + 2) in the layout of run_batch
+    '''
+    from projection import run_batch
+    inputs = default_inputs(configs, len(points))
+    for i, (key, _) in enumerate(GRID_AXES):
+        inputs[key] = points[:, i].astype(inputs[key].dtype)
+    inputs['years_till_retirement'][:] = GRID_YEARS
+    return run_batch(inputs, configs, frequency, tax_regime)
+
+def interpolate(corners, t, u):
+    '''
+    Bilinear interpolation of the four corners (at the lower and upper values of both axes) of a cell
+    '''
+    v00, v10, v01, v11 = (corner.astype(np.float64) for corner in corners)
+    return (1 - t) * (1 - u) * v00 + t * (1 - u) * v10 + (1 - t) * u * v01 + t * u * v11
+
+def build_grid(configs: Params, frequency='yearly', tax_regime='old', directory=None):
+    '''
+    Projects every point of the grid into a memory-mapped .npy file of shape (*axis lengths, GRID_YEARS + 1, columns),
+    then every centre of a cell to measure the interpolation error of the cell. Returns the paths of the files.
+    '''
+    values_path, errors_path, metadata_path = grid_paths(frequency, tax_regime, directory)
+    os.makedirs(os.path.dirname(values_path), exist_ok=True)
+    shape = tuple(len(values) for _, values in GRID_AXES)
+    points = np.stack(np.meshgrid(*(values for _, values in GRID_AXES), indexing='ij'), axis=-1).reshape(-1, len(GRID_AXES))
+    first = project_points(configs, frequency, tax_regime, points[:1])
+    values = np.lib.format.open_memmap(f'{values_path}.tmp', mode='w+', dtype=np.int64, shape=(*shape, *first.shape[1:]))
+    flat = values.reshape(-1, *first.shape[1:])
+    for start in range(0, len(points), BUILD_CHUNK_SIZE):
+        flat[start:start + BUILD_CHUNK_SIZE] = project_points(configs, frequency, tax_regime, points[start:start + BUILD_CHUNK_SIZE])
+
+    (_, incomes), (_, expenses) = GRID_AXES
+    centres = np.stack(np.meshgrid((incomes[:-1] + incomes[1:]) // 2, (expenses[:-1] + expenses[1:]) // 2, indexing='ij'), axis=-1).reshape(-1, 2)
+    cells = np.stack(np.meshgrid(np.arange(len(incomes) - 1), np.arange(len(expenses) - 1), indexing='ij'), axis=-1).reshape(-1, 2)
+    errors = np.empty(len(cells), dtype=np.float64)
+    for start in range(0, len(cells), BUILD_CHUNK_SIZE):
+        i, j = cells[start:start + BUILD_CHUNK_SIZE].T
+        point = centres[start:start + BUILD_CHUNK_SIZE]
+        exact = project_points(configs, frequency, tax_regime, point)
+        t = ((point[:, 0] - incomes[i]) / (incomes[i + 1] - incomes[i]))[:, None, None]
+        u = ((point[:, 1] - expenses[j]) / (expenses[j + 1] - expenses[j]))[:, None, None]
+        estimate = interpolate((values[i, j], values[i + 1, j], values[i, j + 1], values[i + 1, j + 1]), t, u)
+        scale = np.maximum(np.abs(exact[..., -2:-1]), 1)
+        errors[start:start + BUILD_CHUNK_SIZE] = (np.abs(estimate - exact) / scale).max(axis=(1, 2))
+    values.flush()
+    del flat, values
+    os.replace(f'{values_path}.tmp', values_path)
+    np.save(errors_path, errors.reshape(len(incomes) - 1, len(expenses) - 1))
+
+    year = date.today().year
+    with open(metadata_path, 'w') as f:
+        json.dump({
+            'fingerprint': grid_fingerprint(configs, frequency, tax_regime, year),
+            'year': year,
+            'frequency': frequency,
+            'tax_regime': tax_regime,
+            'axes': {key: [int(values[0]), int(values[-1]), len(values)] for key, values in GRID_AXES},
+            'max_error': float(errors.max(initial=0)),
+        }, f, indent=2)
+    return values_path, errors_path, metadata_path
+
+class ScenarioGrid(object):
+    '''
+    A built grid, read through a memory map: the pages of the file are shared by every process using it.
+    Attributes:
+        values: int64 array of shape (*axis lengths, GRID_YEARS + 1, len(INSTRUMENTS) + 2), in the layout of run_batch
+        errors: interpolation error of every cell, shape (axis length - 1, ...)
+        defaults: input -> default value, the inputs without an axis must have it for the grid to answer
+    '''
+    def __init__(self, values, errors, configs: Params):
+        self.values = values
+        self.errors = errors
+        axes = {key for key, _ in GRID_AXES}
+        self.defaults = {key: value[0] for key, value in default_inputs(configs, 1).items() if key not in axes and key != 'years_till_retirement'}
+
+    def lookup(self, inputs, max_error=None):
+        '''
+        Corpus (years + 1, INSTRUMENTS) and expenses (years + 1) of a single scenario of parsed <inputs>, from the grid,
+        or None when the scenario is not on the grid or its interpolation error would be more than <max_error>
+        '''
+        max_error = GRID_MAX_ERROR if max_error is None else max_error
+        if any(np.shape(value) != (1,) for value in inputs.values()):
+            return None
+        no_of_years = int(inputs['years_till_retirement'][0])
+        if not 0 <= no_of_years <= GRID_YEARS or any(inputs[key][0] != value for key, value in self.defaults.items()):
+            return None
+        cell, weights = [], []
+        for key, axis in GRID_AXES:
+            value = inputs[key][0]
+            if not axis[0] <= value <= axis[-1]:
+                return None
+            # the cell starting at the value, the last cell for the end of the axis
+            i = min(int(np.searchsorted(axis, value, side='right')) - 1, len(axis) - 2)
+            cell.append(i)
+            weights.append(float((value - axis[i]) / (axis[i + 1] - axis[i])))
+        (i, j), (t, u) = cell, weights
+        if t in (0, 1) and u in (0, 1):
+            values = self.values[i + int(t), j + int(u), :no_of_years + 1]
+        else:
+            if not max_error or self.errors[i, j] > max_error:
+                return None
+            corners = (self.values[i, j], self.values[i + 1, j], self.values[i, j + 1], self.values[i + 1, j + 1])
+            values = np.rint(interpolate([corner[:no_of_years + 1] for corner in corners], t, u)).astype(np.int64)
+        return values[:, :-2], values[:, -1]
+
+def load_grid(configs: Params, frequency='yearly', tax_regime='old', directory=None):
+    '''
+    The grid of <frequency> and <tax_regime> when one is built for the current Params and year, None otherwise
+    '''
+    year = date.today().year
+    key = (frequency, tax_regime, year, directory)
+    if key not in _grids:
+        _grids[key] = None
+        values_path, errors_path, metadata_path = grid_paths(frequency, tax_regime, directory)
+        try:
+            with open(metadata_path) as f:
+                fingerprint = json.load(f)['fingerprint']
+            if fingerprint == grid_fingerprint(configs, frequency, tax_regime, year):
+                _grids[key] = ScenarioGrid(np.load(values_path, mmap_mode='r'), np.load(errors_path), configs)
+        except (OSError, ValueError, KeyError):
+            pass
+    return _grids[key]
+
+def lookup(inputs, configs: Params, frequency='yearly', tax_regime='old', max_error=None):
+    grid = load_grid(configs, frequency, tax_regime)
+    return None if grid is None else grid.lookup(inputs, max_error)
+
+if __name__ == '__main__':
+    from projection import FREQUENCIES
+    from tax import TAX_REGIME_CHOICES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frequency', choices=FREQUENCIES, default=FREQUENCIES[0])
+    parser.add_argument('--tax-regime', choices=TAX_REGIME_CHOICES, default=TAX_REGIME_CHOICES[0])
+    parser.add_argument('--directory', default=GRID_DIR)
+    options = parser.parse_args()
+    for path in build_grid(Params(), options.frequency, options.tax_regime, options.directory):
+        print(path)
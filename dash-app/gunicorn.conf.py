@@ -0,0 +1,26 @@
+'''
+Gunicorn settings, read from the working directory: the app is loaded and warmed up once in the master process and
+the workers are forked from it, so the imported modules, the layout and the warm caches are shared copy-on-write
+instead of being built again by every worker.
+'''
+import gc
+
+preload_app = True
+# every worker serves several requests at a time, on threads: the computations of a page are then coalesced (see
+# coalescing.py) instead of queued behind each other, and the numpy work releases the GIL
+worker_class = 'gthread'
+threads = 4
+
+def when_ready(server):
+    # runs in the master process once the app is loaded, before the first worker is forked
+    import app
+    import metrics
+    with app.startup_report.stage('warm_up'):
+        app.warm_up()
+    # the warm-up is not traffic, the workers would otherwise all report it in /metrics: the histograms of the master
+    # are forgotten and its file in METRICS_DIR, written while warming up, is deleted
+    metrics.reset()
+    # moves every object of the master out of reach of the garbage collector, a collection in a worker would
+    # otherwise write to (and copy) the pages holding them
+    gc.freeze()
+    server.log.info('startup report of the app\n%s', app.startup_report.format())
@@ -1,22 +1,34 @@
-import plotly.express as px
+import plotly.graph_objects as go
+from plotly.colors import qualitative
 
-def savings_chart_filter(df, selected_savings_instruments, start_year, end_year):
-    mask = (
-        (df['Savings Instrument'].isin(selected_savings_instruments))
-        & (df['Year'] >= start_year)
-        & (df['Year'] <= end_year)
+def chart_layout(title_text, x_title, y_title, legend_title, yaxis_format = {"fixedrange": True}):
+    '''
+    Layout of a line chart with one trace per series, built once on the server and reused by the clientside chart callbacks
+    '''
+    fig = go.Figure()
+    fig.update_layout(
+        title={
+            'text': title_text,
+            'y':0.95,
+            'x':0.2,
+            'xanchor': 'center',
+            'yanchor': 'top'
+        },
+        xaxis={"fixedrange": True, "title": {"text": x_title}},
+        yaxis={**yaxis_format, "title": {"text": y_title}},
+        legend={"title": {"text": legend_title}, "tracegroupgap": 0},
+        # plotly.js picks the colors in trace order, the same as the color sequence of plotly express, which is not
+        # imported for it: it is the slowest import of the app
+        colorway=qualitative.Plotly,
     )
-    return df.loc[mask, :]
+    return fig.layout.to_plotly_json()
 
-def base_chart_template(df, x, y, color_col, custom_data_list, hovertemplate, title_text, yaxis_format = {"fixedrange": True}):
-    fig = px.line(
-        df, x=x, y=y,
-        color=color_col,
-    )
-#        custom_data=custom_data_list,
-    fig.update_traces(
-        hovertemplate=hovertemplate
-    )
+def tornado_layout(title_text):
+    '''
+    Layout of the horizontal bars of the sensitivity chart, built once on the server and reused by the clientside chart callback,
+    which sets the height and the x axis title for the rows it draws
+    '''
+    fig = go.Figure()
     fig.update_layout(
         title={
             'text': title_text,
@@ -25,8 +37,24 @@ def base_chart_template(df, x, y, color_col, custom_data_list, hovertemplate, ti
             'xanchor': 'center',
             'yanchor': 'top'
         },
+        barmode='overlay',
         xaxis={"fixedrange": True},
-        yaxis=yaxis_format,
-        colorway=["#17B897"],
+        yaxis={"fixedrange": True},
+        colorway=["#EF553B", "#17B897"],
     )
-    return fig
+    return fig.layout.to_plotly_json()
+
+def tornado_chart_data(rows, base_corpus):
+    '''
+    JSON friendly rows of the sensitivity chart, the largest impact last (on top): the change of the corpus when every
+    input is moved down and up (None when its projection overflows), and the values it is moved to
+    '''
+    rows = rows[::-1]
+    return {
+        'base_corpus': base_corpus,
+        'labels': [row['input'].replace('_', ' ').title() for row in rows],
+        'low_changes': [None if row['low_corpus'] is None else row['low_corpus'] - base_corpus for row in rows],
+        'high_changes': [None if row['high_corpus'] is None else row['high_corpus'] - base_corpus for row in rows],
+        'low_values': [row['low_value'] for row in rows],
+        'high_values': [row['high_value'] for row in rows],
+    }
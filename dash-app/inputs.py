@@ -0,0 +1,154 @@
+import math
+
+import numpy as np
+
+from params import Params
+
+# longest horizon accepted, it bounds the size of a projection
+MAX_YEARS_TILL_RETIREMENT = 100
+# largest amount (in rupees) and rate (in % a year) accepted, far beyond any real profile, the projection of larger
+# ones would not fit in int64 rupees
+MAX_AMOUNT = 10 ** 12
+MAX_RATE = 100
+
+def float_keys(configs: Params):
+    return (*configs.basic_pct_contributions.keys(), *configs.rates.keys())
+
+class InputError(ValueError):
+    '''
+    Invalid inputs of a projection.
+    Attributes:
+        errors: dict of input name -> what is wrong with it, in the order of Params.get_input_keys()
+    '''
+    def __init__(self, errors):
+        self.errors = dict(errors)
+        super().__init__('; '.join(f'{key} {message}' for key, message in self.errors.items()))
+
+class ProjectionOverflow(InputError):
+    '''
+    Inputs each in range whose projection still grows beyond int64 rupees, e.g. the largest amounts at the largest
+    rates for a hundred years: the horizon is the input to lower
+    '''
+    def __init__(self):
+        super().__init__({'years_till_retirement': 'is too long for these amounts and rates, the savings would grow beyond what can be projected'})
+
+def input_bounds(key, configs: Params):
+    '''
+    Lowest and highest value of input <key>, a rate must be more than its lowest value
+    '''
+    if key == 'years_till_retirement':
+        return 0, MAX_YEARS_TILL_RETIREMENT
+    if key == 'ppf_installments_left':
+        # a negative count of ppf installments simply means that none are left
+        return -MAX_YEARS_TILL_RETIREMENT, MAX_YEARS_TILL_RETIREMENT
+    if key in configs.rates:
+        return -100, MAX_RATE
+    if key in configs.basic_pct_contributions:
+        return 0, 100
+    return 0, MAX_AMOUNT
+
+def range_error(key, value, configs: Params):
+    '''
+    What is wrong with the number <value> of input <key>, None when it is in range
+    '''
+    lower, upper = input_bounds(key, configs)
+    if key in configs.rates:
+        if value <= lower:
+            return f'must be more than {lower}%'
+        if value > upper:
+            return f'must be at most {upper}%'
+    elif key in configs.basic_pct_contributions:
+        if not lower <= value <= upper:
+            return f'must be between {lower} and {upper}%'
+    elif key in ('years_till_retirement', 'ppf_installments_left'):
+        if not lower <= value <= upper:
+            return f'must be between {lower} and {upper}'
+    elif value < lower:
+        return 'cannot be negative'
+    elif value > upper:
+        return f'must be at most {upper:,}'
+    return None
+
+def parse_number(value, integer):
+    '''
+    A query string value or a number as an int (truncated) or a float, raises ValueError with the reason otherwise
+    '''
+    if isinstance(value, str):
+        value = value.strip().replace(',', '')
+    if value is None or value == '':
+        raise ValueError('is required')
+    if isinstance(value, bool):
+        raise ValueError('must be a number')
+    if integer:
+        try:
+            # exact for integers beyond the precision of a float
+            return int(value)
+        except (TypeError, ValueError):
+            pass
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'must be a number, got {value!r}') from None
+    if not math.isfinite(number):
+        raise ValueError('must be a finite number')
+    return int(number) if integer else number
+
+class ProjectionInputs(object):
+    '''
+    The inputs of a single projection, parsed, validated and normalized once, use <ProjectionInputs.from_args>
+    to build them from query string values or Dash callback values.
+    Attributes (read-only):
+        keys: input names, Params.get_input_keys()
+        values: one int or float per input, floats for the rates and the % of basic contributions
+    '''
+    __slots__ = ('keys', 'values')
+
+    def __init__(self, keys, values):
+        object.__setattr__(self, 'keys', tuple(keys))
+        object.__setattr__(self, 'values', tuple(values))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ProjectionInputs is immutable')
+
+    @classmethod
+    def from_args(cls, args, configs: Params):
+        '''
+        Raises InputError naming every missing, non-numeric or out of range input
+        '''
+        floats = float_keys(configs)
+        keys = configs.get_input_keys()
+        values, errors = [], {}
+        for key in keys:
+            try:
+                value = parse_number(args.get(key), integer=key not in floats)
+            except ValueError as e:
+                errors[key] = str(e)
+                continue
+            error = range_error(key, value, configs)
+            if error is not None:
+                errors[key] = error
+            values.append(value)
+        if errors:
+            raise InputError(errors)
+        return cls(keys, values)
+
+    def __getitem__(self, key):
+        return self.values[self.keys.index(key)]
+
+    def __eq__(self, other):
+        return isinstance(other, ProjectionInputs) and (self.keys, self.values) == (other.keys, other.values)
+
+    def __hash__(self):
+        return hash(self.values)
+
+    def __repr__(self):
+        return f'ProjectionInputs({", ".join(f"{key}={value!r}" for key, value in zip(self.keys, self.values))})'
+
+    def to_dict(self):
+        return dict(zip(self.keys, self.values))
+
+    def as_batch(self):
+        '''
+        A batch of one scenario: one int64 or float64 array of length 1 per input
+        '''
+        return {key: np.array([value]) for key, value in zip(self.keys, self.values)}
@@ -0,0 +1,278 @@
+'''
+Background jobs for the computations too long for a request, e.g. the projections of a cohort or a Monte Carlo run
+of many paths: a queue in a SQLite database shared by the web workers, which submit the jobs and poll them, and the
+job workers, started apart from gunicorn:
+
+    python jobs.py --workers 4
+
+The database is JOBS_DB, jobs.sqlite next to the app by default. A job runs a task of TASKS on JSON params, the task
+reports its progress (0 to 1) through the function it is given, which raises Cancelled once the job is cancelled.
+The result of a job, JSON too, is kept RESULT_TTL seconds after the job ended. A running job whose worker did not
+report for LEASE_SECONDS, e.g. because it died, is given to another worker, MAX_ATTEMPTS times at most.
+'''
+import argparse
+import importlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import date
+
+JOBS_DB = os.environ.get('JOBS_DB') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.sqlite')
+# task name -> module:function, imported by the worker running it: function(params, progress) returns the result.
+# Only the tasks whose module is part of the app are offered, the flask app has no monte_carlo.py.
+TASKS = {
+    task: target
+    for task, target in {
+        'projections': 'jobs:projection_job',
+        'monte_carlo': 'monte_carlo:simulation_job',
+    }.items()
+    if importlib.util.find_spec(target.split(':')[0]) is not None
+}
+STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+LEASE_SECONDS = 60.0
+MAX_ATTEMPTS = 3
+# finished jobs and their results are deleted after a day
+RESULT_TTL = 24 * 3600
+# wait of an idle worker between two looks at the queue
+POLL_INTERVAL = 0.5
+# scenarios projected between two reports of the progress of a projections job
+PROJECTION_CHUNK_SIZE = 1000
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        task TEXT NOT NULL,
+        params TEXT NOT NULL,
+        state TEXT NOT NULL,
+        progress REAL NOT NULL DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        worker TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        started REAL,
+        heartbeat REAL,
+        finished REAL
+    )''',
+    'CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created)',
+)
+
+class Cancelled(Exception):
+    '''
+    Raised by the progress function of a task once its job is cancelled
+    '''
+
+class JobQueue(object):
+    '''
+    Attributes:
+        path: path of the SQLite database, created when missing
+        lease_seconds: see the module docstring
+    '''
+    def __init__(self, path, lease_seconds=LEASE_SECONDS, clock=time.time):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._local = threading.local()
+        for statement in SCHEMA:
+            self.connection().execute(statement)
+
+    def connection(self):
+        '''
+        The connection of this thread, a connection is never shared with a forked worker or another thread
+        '''
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def submit(self, task, params):
+        '''
+        Queues a job running <task> on <params>, returns its id
+        '''
+        if task not in TASKS:
+            raise ValueError(f'task must be one of {", ".join(TASKS)}, got {task!r}')
+        job_id = uuid.uuid4().hex
+        self.connection().execute(
+            'INSERT INTO jobs (id, task, params, state, created) VALUES (?, ?, ?, ?, ?)',
+            (job_id, task, json.dumps(params), 'queued', self.clock()),
+        )
+        return job_id
+
+    def get(self, job_id):
+        '''
+        The state of a job, without its result: None when there is no such job
+        '''
+        row = self.connection().execute(
+            'SELECT id, task, state, progress, error, attempts, created, started, finished FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('id', 'task', 'state', 'progress', 'error', 'attempts', 'created', 'started', 'finished'), row))
+
+    def result(self, job_id):
+        '''
+        The result of a job, None until it is done
+        '''
+        row = self.connection().execute("SELECT result FROM jobs WHERE id = ? AND state = 'done'", (job_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def cancel(self, job_id):
+        '''
+        Cancels a queued job right away and a running one at the next report of its progress.
+        Returns False when the job is missing or has already ended.
+        '''
+        connection = self.connection()
+        if connection.execute(
+            "UPDATE jobs SET state = 'cancelled', finished = ? WHERE id = ? AND state = 'queued'", (self.clock(), job_id)
+        ).rowcount:
+            return True
+        return bool(connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND state = 'running'", (job_id,)).rowcount)
+
+    def claim(self, worker):
+        '''
+        Takes the oldest queued job for <worker>, returns (id, task, params) or None when the queue is empty.
+        The jobs whose lease expired are queued again first, or failed after MAX_ATTEMPTS.
+        '''
+        connection = self.connection()
+        now = self.clock()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, finished = ? WHERE state = 'running' AND heartbeat < ? AND attempts >= ?",
+                (f'the job was given up after {MAX_ATTEMPTS} attempts', now, now - self.lease_seconds, MAX_ATTEMPTS),
+            )
+            connection.execute(
+                "UPDATE jobs SET state = 'queued', worker = NULL WHERE state = 'running' AND heartbeat < ?", (now - self.lease_seconds,)
+            )
+            connection.execute(f"DELETE FROM jobs WHERE state IN {FINISHED_STATES} AND finished < ?", (now - RESULT_TTL,))
+            row = connection.execute("SELECT id, task, params FROM jobs WHERE state = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1, progress = 0, started = ?, heartbeat = ? WHERE id = ?",
+                    (worker, now, now, row[0]),
+                )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return None if row is None else (row[0], row[1], json.loads(row[2]))
+
+    def report(self, job_id, worker, progress):
+        '''
+        Records the progress of a job run by <worker> and renews its lease.
+        Returns False when the job should stop: it was cancelled, or its lease was lost to another worker.
+        '''
+        connection = self.connection()
+        updated = connection.execute(
+            "UPDATE jobs SET progress = ?, heartbeat = ? WHERE id = ? AND worker = ? AND state = 'running' AND cancel_requested = 0",
+            (min(max(float(progress), 0.0), 1.0), self.clock(), job_id, worker),
+        ).rowcount
+        return bool(updated)
+
+    def finish(self, job_id, worker, state, result=None, error=None):
+        '''
+        Ends a job run by <worker> in <state> of FINISHED_STATES, unless its lease was lost to another worker
+        '''
+        self.connection().execute(
+            "UPDATE jobs SET state = ?, result = ?, error = ?, progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END, finished = ? WHERE id = ? AND worker = ? AND state = 'running'",
+            (state, None if result is None else json.dumps(result), error, state, self.clock(), job_id, worker),
+        )
+
+    def stats(self):
+        counts = dict(self.connection().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+_queues = {}
+
+def job_queue():
+    '''
+    The queue at JOBS_DB, one per process
+    '''
+    if JOBS_DB not in _queues:
+        _queues[JOBS_DB] = JobQueue(JOBS_DB)
+    return _queues[JOBS_DB]
+
+def resolve_task(task):
+    module, function = TASKS[task].split(':')
+    return getattr(importlib.import_module(module), function)
+
+def run_next(queue, worker):
+    '''
+    Runs the oldest queued job in this process, returns False when the queue is empty
+    '''
+    job = queue.claim(worker)
+    if job is None:
+        return False
+    job_id, task, params = job
+
+    def progress(fraction):
+        if not queue.report(job_id, worker, fraction):
+            raise Cancelled
+    try:
+        result = resolve_task(task)(params, progress)
+    except Cancelled:
+        queue.finish(job_id, worker, 'cancelled')
+    except Exception as e:
+        queue.finish(job_id, worker, 'failed', error=f'{type(e).__name__}: {e}')
+    else:
+        queue.finish(job_id, worker, 'done', result=result)
+    return True
+
+def work(path=None, poll_interval=POLL_INTERVAL):
+    '''
+    Loop of a job worker: runs the queued jobs one at a time, forever
+    '''
+    queue = JobQueue(path or JOBS_DB)
+    worker = f'{os.uname().nodename}:{os.getpid()}'
+    while True:
+        if not run_next(queue, worker):
+            time.sleep(poll_interval)
+
+def projection_job(params, progress):
+    '''
+    Task of the background jobs: projects <params>['scenarios'], a list of scenarios keyed like Params.get_var_dict(),
+    with the 'frequency' and 'tax_regime' of <params>. Returns one dict per scenario like /api/v1/projections.
+    '''
+    from params import Params
+    from projection import BATCH_COLUMNS, parse_records, run_batch
+
+    configs = Params()
+    frequency, tax_regime = params.get('frequency', 'yearly'), params.get('tax_regime', 'old')
+    inputs = parse_records(params['scenarios'], configs)
+    current_year = date.today().year
+    no_of_scenarios = len(inputs['years_till_retirement'])
+    rows = []
+    for start in range(0, no_of_scenarios, PROJECTION_CHUNK_SIZE):
+        chunk = {key: values[start:start + PROJECTION_CHUNK_SIZE] for key, values in inputs.items()}
+        batch = run_batch(chunk, configs, frequency, tax_regime)
+        for i, no_of_years in enumerate(int(years) for years in chunk['years_till_retirement']):
+            row = {'scenario': start + i, 'years': list(range(current_year, current_year + no_of_years + 1))}
+            row.update(zip(BATCH_COLUMNS, batch[i, :no_of_years + 1].T.tolist()))
+            rows.append(row)
+        progress(min(start + PROJECTION_CHUNK_SIZE, no_of_scenarios) / no_of_scenarios)
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=1, help='processes running the jobs')
+    parser.add_argument('--db', default=JOBS_DB, help='SQLite database of the queue')
+    options = parser.parse_args()
+    # creates the database before the workers race to
+    JobQueue(options.db)
+    processes = [multiprocessing.Process(target=work, args=(options.db,), daemon=True) for _ in range(options.workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,153 @@
+'''
+In-process latency histograms of the hot paths and counters of events, exposed as Prometheus text on /metrics.
+Every worker keeps its own histograms. When METRICS_DIR (or PROMETHEUS_MULTIPROC_DIR) is set, every worker also writes
+them to <dir>/<pid>.json, at most every FLUSH_INTERVAL seconds and at exit, and /metrics adds up the files of all the
+workers, so any worker of a multi-worker gunicorn answers for the whole server. The directory should be emptied
+before the server starts.
+'''
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRIC_NAME = 'fin_health_stage_duration_seconds'
+COUNTER_NAME = 'fin_health_events_total'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# upper bounds of the buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = 1.0
+
+_lock = threading.Lock()
+# stage -> {'buckets': count per bucket (the last one is +Inf), 'sum': seconds, 'count': observations}
+_histograms = {}
+# event -> count
+_counters = {}
+_last_flush = 0.0
+
+def metrics_dir():
+    return os.environ.get('METRICS_DIR') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+def new_histogram():
+    return {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+
+def observe(stage, seconds):
+    bucket = bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = new_histogram()
+        histogram['buckets'][bucket] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+def increment(event, amount=1):
+    with _lock:
+        _counters[event] = _counters.get(event, 0) + amount
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+@contextmanager
+def timed(stage):
+    '''
+    Records the time spent in the body of the with block under <stage>
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def snapshot():
+    '''
+    Copy of the histograms and the counters of this process: {'histograms': {stage: histogram}, 'counters': {event: count}}
+    '''
+    with _lock:
+        return {
+            'histograms': {stage: {**histogram, 'buckets': list(histogram['buckets'])} for stage, histogram in _histograms.items()},
+            'counters': dict(_counters),
+        }
+
+def reset():
+    '''
+    Forgets the histograms and the counters of this process, and its file in the metrics directory, which the other
+    workers would otherwise keep adding up
+    '''
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+    directory = metrics_dir()
+    if directory:
+        try:
+            os.remove(os.path.join(directory, f'{os.getpid()}.json'))
+        except FileNotFoundError:
+            pass
+
+def flush():
+    '''
+    Writes the histograms of this worker to the metrics directory, replacing the previous file atomically
+    '''
+    global _last_flush
+    # also when there is no directory, the environment is then looked up once per FLUSH_INTERVAL and not on every observation
+    _last_flush = time.monotonic()
+    directory = metrics_dir()
+    if not directory:
+        return
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(f'{path}.tmp', path)
+
+def collect():
+    '''
+    Histograms and counters of every worker added up, like <snapshot>, or of this process alone without a metrics directory
+    '''
+    directory = metrics_dir()
+    if not directory:
+        return snapshot()
+    flush()
+    merged = {'histograms': {}, 'counters': {}}
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                worker = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for stage, histogram in worker.get('histograms', {}).items():
+            total = merged['histograms'].setdefault(stage, new_histogram())
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+        for event, count in worker.get('counters', {}).items():
+            merged['counters'][event] = merged['counters'].get(event, 0) + count
+    return merged
+
+def prometheus_text():
+    collected = collect()
+    histograms, counters = collected['histograms'], collected['counters']
+    lines = [
+        f'# HELP {METRIC_NAME} Time spent in each stage of the projection, chart and page hot paths.',
+        f'# TYPE {METRIC_NAME} histogram',
+    ]
+    for stage in sorted(histograms):
+        histogram = histograms[stage]
+        cumulative = 0
+        for bound, count in zip((*map(repr, BUCKETS), '+Inf'), histogram['buckets']):
+            cumulative += count
+            lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {histogram["sum"]!r}')
+        lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {histogram["count"]}')
+    lines += [
+        f'# HELP {COUNTER_NAME} Events counted by the apps, e.g. computations skipped because a newer request superseded them.',
+        f'# TYPE {COUNTER_NAME} counter',
+    ]
+    lines += [f'{COUNTER_NAME}{{event="{event}"}} {counters[event]}' for event in sorted(counters)]
+    return '\n'.join(lines) + '\n'
+
+atexit.register(flush)
@@ -0,0 +1,110 @@
+from datetime import date
+
+import numpy as np
+
+from params import Params
+from projection import parse_args, run_projection
+
+# yearly standard deviation (in % points) of the rates that are simulated by default
+DEFAULT_VOLATILITIES = {
+    'inflation_rate': 1.5,
+    'nps_ror': 8.0,
+    'mf_ror': 12.0,
+    'equity_ror': 16.0,
+}
+DISTRIBUTIONS = ('normal', 'lognormal')
+PERCENTILES = (10, 50, 90)
+# paths projected between two reports of the progress of a simulation
+PROGRESS_CHUNK_SIZE = 5000
+
+def sample_rate_paths(means, volatilities, no_of_paths, no_of_years, correlation=None, distribution='normal', seed=None):
+    '''
+    Draws <no_of_paths> yearly paths of every rate in <volatilities>.
+    Attributes:
+        means: expected rate (in %) of every simulated rate
+        volatilities: yearly standard deviation (in % points) of every simulated rate
+        correlation: optional correlation matrix of the rates, in the order of <volatilities>
+        distribution: 'normal' draws the rate itself, 'lognormal' draws log(1 + rate) so that the growth factor stays positive
+    Returns a dict of arrays of shape (no_of_paths, no_of_years), one per rate.
+    '''
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f'distribution must be one of {", ".join(DISTRIBUTIONS)}, got {distribution!r}')
+    keys = list(volatilities)
+    rng = np.random.default_rng(seed)
+    shocks = rng.standard_normal((no_of_paths, no_of_years, len(keys)))
+    if correlation is not None:
+        correlation = np.asarray(correlation, dtype=np.float64)
+        if correlation.shape != (len(keys), len(keys)):
+            raise ValueError(f'expected a {len(keys)}x{len(keys)} correlation matrix for {", ".join(keys)}')
+        shocks = shocks @ np.linalg.cholesky(correlation).T
+
+    mean = np.array([float(means[key]) for key in keys]) / 100
+    sd = np.array([float(volatilities[key]) for key in keys]) / 100
+    if distribution == 'lognormal':
+        # match the mean and standard deviation of the gross return 1 + rate
+        sigma = np.sqrt(np.log1p((sd / (1 + mean)) ** 2))
+        mu = np.log1p(mean) - (sigma ** 2) / 2
+        rates = np.expm1(mu + sigma * shocks)
+    else:
+        rates = mean + sd * shocks
+    return {key: 100 * rates[..., j] for j, key in enumerate(keys)}
+
+def project_total_corpus(inputs, configs: Params, frequency='yearly', tax_regime='old'):
+    corpus, _ = run_projection(inputs, configs, frequency, tax_regime)
+    return corpus.sum(axis=-1)
+
+def simulate(args, configs: Params, no_of_paths=10000, volatilities=None, correlation=None, distribution='normal', seed=None, percentiles=PERCENTILES, workers=1, frequency='yearly', tax_regime='old', progress=None):
+    '''
+    Monte Carlo projection of the total savings corpus with stochastic returns and inflation.
+    The rates in <volatilities> (DEFAULT_VOLATILITIES by default) are drawn every year around their value in <args>,
+    every other input is kept fixed. The paths are sampled up front, so a seed gives the same result for any number of
+    <workers>, with more than one worker the paths are split in chunks over a process pool.
+    <progress>, when given, is called with the fraction of the paths projected, every PROGRESS_CHUNK_SIZE paths.
+    Returns
+        years: int64 array of length no_of_years + 1
+        bands: dict of percentile -> int64 array of the total savings corpus at that percentile, for every year
+    '''
+    volatilities = DEFAULT_VOLATILITIES if volatilities is None else volatilities
+    inputs = parse_args(args, configs)
+    no_of_years = int(inputs['years_till_retirement'][0])
+    current_year = date.today().year
+    years = np.arange(current_year, current_year + no_of_years + 1, dtype=np.int64)
+
+    inputs = {key: np.repeat(value, no_of_paths) for key, value in inputs.items()}
+    inputs.update(sample_rate_paths(args, volatilities, no_of_paths, no_of_years, correlation, distribution, seed))
+
+    if workers > 1 and no_of_paths > 1:
+        # only the parallel runs need the process pool, it is kept off the startup path of the apps
+        from concurrent.futures import ProcessPoolExecutor
+        chunks = np.array_split(np.arange(no_of_paths), workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            totals = np.concatenate(list(executor.map(
+                project_total_corpus,
+                [{key: value[chunk] for key, value in inputs.items()} for chunk in chunks],
+                [configs] * len(chunks),
+                [frequency] * len(chunks),
+                [tax_regime] * len(chunks),
+            )))
+    elif progress is not None:
+        totals = np.empty((no_of_paths, no_of_years + 1), dtype=np.int64)
+        for start in range(0, no_of_paths, PROGRESS_CHUNK_SIZE):
+            chunk = slice(start, start + PROGRESS_CHUNK_SIZE)
+            totals[chunk] = project_total_corpus({key: value[chunk] for key, value in inputs.items()}, configs, frequency, tax_regime)
+            progress(min(start + PROGRESS_CHUNK_SIZE, no_of_paths) / no_of_paths)
+    else:
+        totals = project_total_corpus(inputs, configs, frequency, tax_regime)
+
+    bands = np.percentile(totals, percentiles, axis=0)
+    return years, {percentile: np.trunc(band).astype(np.int64) for percentile, band in zip(percentiles, bands)}
+
+def simulation_job(params, progress):
+    '''
+    Task of the background jobs: simulate() of the inputs <params>['args'] with the other entries of <params> as
+    options. Returns the years and the bands as JSON, [[P<percentile>, amounts], ...]
+    '''
+    options = {key: value for key, value in params.items() if key != 'args'}
+    years, bands = simulate(params['args'], Params(), progress=progress, **options)
+    return {
+        'years': years.tolist(),
+        'percentiles': [[f'P{percentile}', bands[percentile].tolist()] for percentile in sorted(bands)],
+    }
@@ -0,0 +1,573 @@
+import hashlib
+import json
+import math
+from collections import namedtuple
+from datetime import date
+from functools import lru_cache, wraps
+
+import numpy as np
+
+from grid import load_grid
+from inputs import ProjectionInputs, ProjectionOverflow, float_keys, range_error
+from metrics import timed
+from params import Params
+from shared_cache import projection_cache
+from tax import calculate_regime_after_tax_income
+
+# order of the columns of the corpus matrix returned by <project_savings>
+INSTRUMENTS = (
+    'nps_corpus',
+    'pf_corpus',
+    'ppf_corpus',
+    'mf_corpus',
+    'equity_corpus',
+    'fd_corpus',
+    'savings_corpus',
+    'other_savings_corpus',
+)
+# rate of return of every instrument, in the same order as <INSTRUMENTS>
+INSTRUMENT_RATES = (
+    'nps_ror',
+    'pf_ror',
+    'ppf_ror',
+    'mf_ror',
+    'equity_ror',
+    'fd_ror',
+    'savings_ror',
+    'other_savings_ror',
+)
+# order of the last axis of the array returned by <project_batch>
+BATCH_COLUMNS = (*INSTRUMENTS, 'total_savings_corpus', 'expenses')
+PPF, FD = INSTRUMENTS.index('ppf_corpus'), INSTRUMENTS.index('fd_corpus')
+# validation errors reported at most
+MAX_ERRORS = 20
+# largest amount of a projection, in rupees, the amounts are int64
+INT64_MAX = np.iinfo(np.int64).max
+# part of the key of every cached projection, bump it when the projection changes to leave the cached ones behind
+ENGINE_VERSION = 2
+# 'yearly' steps every instrument by a year with the contributions added at the year end, 'monthly' compounds the
+# instruments of MONTHLY_INSTRUMENTS every month and spreads their contributions (SIPs, PF and NPS deductions and the
+# savings left after the monthly expenses) over twelve monthly installments
+FREQUENCIES = ('yearly', 'monthly')
+# ppf interest is credited once a year and its installment stays yearly
+MONTHLY_INSTRUMENTS = tuple(key for key in INSTRUMENTS if key != 'ppf_corpus')
+# display label of every column, in the order of the savings chart
+SERIES_LABELS = {
+    'total_savings_corpus': 'Total Savings',
+    'nps_corpus': 'NPS',
+    'pf_corpus': 'PF',
+    'ppf_corpus': 'PPF',
+    'mf_corpus': 'MF',
+    'equity_corpus': 'Equity',
+    'fd_corpus': 'FD',
+    'savings_corpus': 'Savings',
+    'other_savings_corpus': 'Other Savings',
+    'expenses': "Next Year's Expenses",
+}
+
+@lru_cache(maxsize=256)
+def growth_factors(rate, no_of_years):
+    '''
+    Returns (1 + rate%) ** t for t = 0..no_of_years as a read-only array.
+    The factors are evaluated with the same float pow as <calc_compound_interest_final_amount>
+    instead of a running product, a cumulative product drifts by an ulp and flips the integer
+    truncation of amounts that are exact in rupees (e.g. 1000000 * 1.03 ** 2).
+    '''
+    base = 1 + (float(rate) / 100)
+    factors = np.array([base ** t for t in range(no_of_years + 1)], dtype=np.float64)
+    factors.setflags(write=False)
+    return factors
+
+def grow(p, rate, no_of_years):
+    '''
+    Vector form of calc_compound_interest_final_amount(p, rate / 100, t) for t = 0..no_of_years,
+    p is an array of one value per scenario, rate is either one rate per scenario or one rate per
+    year of every scenario (shape (scenarios, no_of_years)), returns an array of shape (scenarios, no_of_years + 1)
+    '''
+    if rate.ndim == 2:
+        # the rate changes every year, so the growth is the running product of the yearly factors
+        factors = np.cumprod(1 + (rate[:, :no_of_years] / 100), axis=1)
+        factors = np.concatenate([np.ones((len(rate), 1)), factors], axis=1)
+    else:
+        unique_rates, index = np.unique(rate, return_inverse=True)
+        factors = np.stack([growth_factors(float(r), no_of_years) for r in unique_rates])[index.ravel()]
+    return np.trunc(p[:, None] * factors).astype(np.int64)
+
+def truncate(amount):
+    return np.trunc(amount).astype(np.int64)
+
+def parse_args(args, configs: Params):
+    '''
+    Converts a single set of inputs (ProjectionInputs, query string values or numbers) into a batch of one scenario,
+    raises InputError for invalid inputs
+    '''
+    if not isinstance(args, ProjectionInputs):
+        args = ProjectionInputs.from_args(args, configs)
+    return args.as_batch()
+
+def parse_scenarios(scenarios, configs: Params, columns=None):
+    '''
+    Converts a batch of scenarios into one array per input.
+    <scenarios> is either a 2-D array with one row per scenario and one column per entry of <columns>
+    (Params.get_input_keys() by default), or a columnar table (dict, DataFrame) keyed by the same names.
+    '''
+    keys = configs.get_input_keys()
+    if isinstance(scenarios, np.ndarray):
+        columns = keys if columns is None else tuple(columns)
+        if scenarios.ndim != 2 or scenarios.shape[1] != len(columns):
+            raise ValueError(f'expected a 2-D array with {len(columns)} columns, got shape {scenarios.shape}')
+        scenarios = dict(zip(columns, scenarios.T))
+
+    missing = [key for key in keys if key not in scenarios]
+    if missing:
+        raise ValueError(f'missing scenario columns: {", ".join(missing)}')
+
+    floats = float_keys(configs)
+    parsed = {}
+    for key in keys:
+        values = np.asarray(scenarios[key])
+        if key in floats:
+            parsed[key] = values.astype(np.float64)
+        elif np.issubdtype(values.dtype, np.integer):
+            parsed[key] = values.astype(np.int64)
+        else:
+            parsed[key] = truncate(values.astype(np.float64))
+    return parsed
+
+def parse_records(records, configs: Params):
+    '''
+    Validates a list of scenarios given as dicts keyed by Params.get_input_keys() (e.g. a JSON array) and converts it
+    into one array per input like <parse_scenarios>. Raises ValueError listing the first MAX_ERRORS problems.
+    '''
+    if not isinstance(records, list):
+        raise ValueError('expected a list of scenarios')
+    keys = configs.get_input_keys()
+    columns = {key: [] for key in keys}
+    errors = []
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append(f'scenario {i}: expected an object')
+            continue
+        for key in keys:
+            value = record.get(key)
+            if key not in record:
+                errors.append(f'scenario {i}: missing {key}')
+                value = 0
+            elif isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                errors.append(f'scenario {i}: {key} must be a number, got {value!r}')
+                value = 0
+            elif range_error(key, value, configs) is not None:
+                errors.append(f'scenario {i}: {key} {range_error(key, value, configs)}')
+            columns[key].append(value)
+        if len(errors) >= MAX_ERRORS:
+            break
+    if errors:
+        raise ValueError('; '.join(errors[:MAX_ERRORS]))
+    return parse_scenarios(columns, configs)
+
+def monthly_factors(rates):
+    '''
+    Year-end value of one rupee of corpus compounded monthly at the yearly <rates> (in %), and of one rupee of yearly
+    contribution paid in twelve installments at the end of every month, both in closed form
+    '''
+    monthly_rate = rates / 1200
+    growth = (1 + monthly_rate) ** 12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annuity = np.where(monthly_rate == 0, 1.0, (growth - 1) / (12 * monthly_rate))
+    return growth, annuity
+
+def overflow_checked(function):
+    '''
+    Runs <function> with the numpy overflows and invalid casts raised, as ProjectionOverflow, instead of projecting
+    amounts wrapped around int64
+    '''
+    @wraps(function)
+    def checked(*args, **kwargs):
+        try:
+            with np.errstate(over='raise', invalid='raise'):
+                return function(*args, **kwargs)
+        except (OverflowError, FloatingPointError):
+            raise ProjectionOverflow() from None
+    return checked
+
+@overflow_checked
+def run_projection(inputs, configs: Params, frequency='yearly', tax_regime='old'):
+    '''
+    Projects every scenario of <inputs> (as returned by <parse_scenarios>) over the longest horizon of the batch.
+    Any rate may also be given as one rate per year of every scenario, an array of shape (scenarios, horizon).
+    <frequency> is one of FREQUENCIES, a monthly projection is still stepped a year at a time with the months of every
+    year folded into closed-form growth and annuity factors, so it costs about the same as a yearly one.
+    <tax_regime> is one of TAX_REGIME_CHOICES, the income of every year is taxed under the rules of that year and
+    'auto' takes the cheaper regime every year.
+    Returns
+        corpus: int64 array of shape (scenarios, horizon + 1, len(INSTRUMENTS)), the value of each instrument at the start of each year
+        expenses: int64 array of shape (scenarios, horizon + 1), the expenses of the year starting at the corresponding year
+    Years after the retirement of a scenario are left as 0.
+    Raises ProjectionOverflow when the amounts grow beyond int64.
+    '''
+    if frequency not in FREQUENCIES:
+        raise ValueError(f'frequency must be one of {", ".join(FREQUENCIES)}, got {frequency!r}')
+    no_of_years = inputs['years_till_retirement']
+    no_of_scenarios = len(no_of_years)
+    if no_of_scenarios == 1 and all(values.ndim == 1 for values in inputs.values()):
+        return run_scenario({key: values[0].item() for key, values in inputs.items()}, configs, frequency, tax_regime)
+    horizon = max(int(no_of_years.max(initial=0)), 0)
+    # active[s, i] is true for the years 0..years_till_retirement of scenario s
+    active = np.arange(horizon + 1) <= no_of_years[:, None]
+
+    # yearly cash flows, built once for the whole horizon
+    annual_basic = grow(inputs['annual_basic'], inputs['income_growth_rate'], horizon)[:, :-1]
+    annual_income = grow(inputs['annual_income'], inputs['income_growth_rate'], horizon)[:, :-1]
+    expenses = grow(12 * inputs['monthly_fixed_expense'], inputs['inflation_rate'], horizon)
+
+    nps_contribution = truncate(annual_basic * (inputs['nps_contribution'][:, None] / 100))
+    employer_pf_contribution = truncate(annual_basic * (inputs['employer_pf_contribution'][:, None] / 100))
+    employee_pf_contribution = truncate(annual_basic * (inputs['employee_pf_contribution'][:, None] / 100))
+    pf_contribution = employer_pf_contribution + employee_pf_contribution
+    mf_contribution = grow(inputs['mf_contribution'], inputs['mf_step_up'], horizon)[:, :-1]
+    equity_contribution = grow(inputs['equity_contribution'], inputs['equity_step_up'], horizon)[:, :-1]
+
+    ppf_installments_left = inputs['ppf_installments_left'][:, None]
+    ppf_contribution = np.where(np.arange(horizon) < ppf_installments_left, inputs['ppf_contribution'][:, None], 0)
+
+    with timed('projection.tax'):
+        tax_years = date.today().year + np.arange(horizon)
+        income_after_tax = calculate_regime_after_tax_income(
+            annual_income, employer_pf_contribution, inputs['80c_deductions'][:, None], nps_contribution, tax_years, configs, tax_regime,
+        )
+
+    fd_contribution = income_after_tax - expenses[:, :-1] - nps_contribution - pf_contribution - mf_contribution - equity_contribution - ppf_contribution
+
+    contributions = np.zeros((no_of_scenarios, horizon, len(INSTRUMENTS)), dtype=np.int64)
+    contributions[..., INSTRUMENTS.index('nps_corpus')] = nps_contribution
+    contributions[..., INSTRUMENTS.index('pf_corpus')] = pf_contribution
+    contributions[..., PPF] = ppf_contribution
+    contributions[..., INSTRUMENTS.index('mf_corpus')] = mf_contribution
+    contributions[..., INSTRUMENTS.index('equity_corpus')] = equity_contribution
+    contributions[..., FD] = fd_contribution
+
+    # all instruments of all scenarios are rolled forward together, one year at a time
+    rates = [inputs[key] if inputs[key].ndim == 2 else inputs[key][:, None] for key in INSTRUMENT_RATES]
+    rates = np.stack(np.broadcast_arrays(*rates), axis=-1)
+    multipliers = 1 + (rates / 100)
+    if frequency == 'monthly':
+        monthly = [INSTRUMENTS.index(key) for key in MONTHLY_INSTRUMENTS]
+        multipliers[..., monthly], annuities = monthly_factors(rates[..., monthly])
+        contributions = contributions.astype(np.float64)
+        contributions[..., monthly] *= annuities
+    multipliers = np.broadcast_to(multipliers, (no_of_scenarios, horizon, len(INSTRUMENTS)))
+    # when we reach the end of ppf term, we will transfer the ppf amount to fd and the ppf corpus will become 0 from that year onwards
+    ppf_transfer = np.arange(horizon) == ppf_installments_left - 1
+    corpus = np.zeros((no_of_scenarios, horizon + 1, len(INSTRUMENTS)), dtype=np.int64)
+    corpus[:, 0] = np.stack([inputs[key] for key in INSTRUMENTS], axis=-1)
+    with timed('projection.yearly_loop'):
+        for i in range(horizon):
+            if frequency == 'monthly':
+                year_end = truncate(corpus[:, i] * multipliers[:, i] + contributions[:, i])
+            else:
+                year_end = truncate(corpus[:, i] * multipliers[:, i]) + contributions[:, i]
+            transfer = ppf_transfer[:, i]
+            year_end[transfer, FD] += year_end[transfer, PPF]
+            year_end[transfer, PPF] = 0
+            corpus[:, i + 1] = np.where(active[:, i + 1, None], year_end, 0)
+
+    return corpus, np.where(active, expenses, 0)
+
+@overflow_checked
+def scenario_cash_flows(scenario, configs: Params, tax_regime='old'):
+    '''
+    The yearly amounts of a single scenario, <scenario> is a dict of one Python number per input (e.g.
+    ProjectionInputs.to_dict()), as Python numbers: the same amounts as the arrays of <run_projection>, Python floats
+    are float64 and int() truncates like <truncate>. Only the tax is evaluated on arrays, once for all the years.
+    Returns
+        incomes, incomes_after_tax: one int per year till the year before retirement
+        contributions: one tuple per year till the year before retirement, in the order of INSTRUMENTS, the FD
+            contribution is what is left of the income after tax, the expenses and the other contributions
+        expenses: one int per year till the year of retirement
+    '''
+    no_of_years = max(scenario['years_till_retirement'], 0)
+
+    def grown(amount, rate_key):
+        # <grow> of a single scenario, the year of retirement excluded
+        return [int(amount * factor) for factor in growth_factors(scenario[rate_key], no_of_years).tolist()[:-1]]
+
+    annual_basic = grown(scenario['annual_basic'], 'income_growth_rate')
+    incomes = grown(scenario['annual_income'], 'income_growth_rate')
+    nps_contribution = [int(basic * (scenario['nps_contribution'] / 100)) for basic in annual_basic]
+    employer_pf_contribution = [int(basic * (scenario['employer_pf_contribution'] / 100)) for basic in annual_basic]
+    pf_contribution = [employer_pf + int(basic * (scenario['employee_pf_contribution'] / 100)) for basic, employer_pf in zip(annual_basic, employer_pf_contribution)]
+    with timed('projection.tax'):
+        incomes_after_tax = calculate_regime_after_tax_income(
+            np.array(incomes, dtype=np.int64),
+            np.array(employer_pf_contribution, dtype=np.int64),
+            scenario['80c_deductions'],
+            np.array(nps_contribution, dtype=np.int64),
+            date.today().year + np.arange(no_of_years), configs, tax_regime,
+        ).tolist()
+    expenses = [int(12 * scenario['monthly_fixed_expense'] * factor) for factor in growth_factors(scenario['inflation_rate'], no_of_years).tolist()]
+    ppf_contribution = [scenario['ppf_contribution'] if i < scenario['ppf_installments_left'] else 0 for i in range(no_of_years)]
+    contributions = [
+        (nps, pf, ppf, mf, equity, income_after_tax - expense - nps - pf - mf - equity - ppf, 0, 0)
+        for nps, pf, ppf, mf, equity, income_after_tax, expense in zip(
+            nps_contribution, pf_contribution, ppf_contribution, grown(scenario['mf_contribution'], 'mf_step_up'),
+            grown(scenario['equity_contribution'], 'equity_step_up'), incomes_after_tax, expenses,
+        )
+    ]
+    return incomes, incomes_after_tax, contributions, expenses
+
+def scenario_factors(scenario, frequency='yearly'):
+    '''
+    What a rupee of corpus of every instrument is worth a year later, and what a rupee of its yearly contribution is
+    worth at the year end (1 but for the instruments compounded monthly), as lists in the order of INSTRUMENTS
+    '''
+    multipliers = [1 + (scenario[key] / 100) for key in INSTRUMENT_RATES]
+    annuities = [1.0] * len(INSTRUMENTS)
+    if frequency == 'monthly':
+        monthly = [INSTRUMENTS.index(key) for key in MONTHLY_INSTRUMENTS]
+        growth, annuity = monthly_factors(np.array([scenario[INSTRUMENT_RATES[j]] for j in monthly]))
+        for j, monthly_growth, monthly_annuity in zip(monthly, growth.tolist(), annuity.tolist()):
+            multipliers[j], annuities[j] = monthly_growth, monthly_annuity
+    return multipliers, annuities
+
+def step_year(corpus, contributions, multipliers, annuities, frequency='yearly', ppf_transfer=False):
+    '''
+    The corpus of a single scenario at the end of a year from the <corpus> at its start, lists in the order of
+    INSTRUMENTS. <ppf_transfer> ends the ppf term: the ppf corpus is transferred to fd.
+    Raises ProjectionOverflow when an amount does not fit in int64.
+    '''
+    if frequency == 'monthly':
+        corpus = [int(amount * multiplier + flow * annuity) for amount, multiplier, flow, annuity in zip(corpus, multipliers, contributions, annuities)]
+    else:
+        corpus = [int(amount * multiplier) + flow for amount, multiplier, flow in zip(corpus, multipliers, contributions)]
+    if ppf_transfer:
+        corpus[FD] += corpus[PPF]
+        corpus[PPF] = 0
+    # Python ints do not wrap around, the amounts of the arrays would
+    if max(corpus) > INT64_MAX or min(corpus) < -INT64_MAX:
+        raise ProjectionOverflow()
+    return corpus
+
+@overflow_checked
+def run_scenario(scenario, configs: Params, frequency='yearly', tax_regime='old'):
+    '''
+    <run_projection> of a single scenario (see <scenario_cash_flows>), stepped with Python numbers instead of arrays of
+    one scenario, whose numpy calls cost more than the arithmetic
+    '''
+    if frequency not in FREQUENCIES:
+        raise ValueError(f'frequency must be one of {", ".join(FREQUENCIES)}, got {frequency!r}')
+    _, _, contributions, expenses = scenario_cash_flows(scenario, configs, tax_regime)
+    multipliers, annuities = scenario_factors(scenario, frequency)
+    corpus = [scenario[key] for key in INSTRUMENTS]
+    rows = [corpus]
+    with timed('projection.yearly_loop'):
+        for i, flows in enumerate(contributions):
+            corpus = step_year(corpus, flows, multipliers, annuities, frequency, i == scenario['ppf_installments_left'] - 1)
+            rows.append(corpus)
+    return np.array([rows], dtype=np.int64), np.array([expenses], dtype=np.int64)
+
+def project_savings(args, configs: Params, frequency='yearly', tax_regime='old'):
+    '''
+    Projects the savings corpus of every instrument till retirement, read from the precomputed grid when it has the inputs,
+    or else from the cache shared by the workers when PROJECTION_CACHE is set.
+    Returns
+        years: int64 array of length no_of_years + 1
+        corpus: int64 array of shape (no_of_years + 1, len(INSTRUMENTS)), the value of each instrument at the start of each year
+        expenses: int64 array of length no_of_years + 1, the expenses of the year starting at the corresponding year
+    '''
+    with timed('projection.parse_inputs'):
+        if not isinstance(args, ProjectionInputs):
+            args = ProjectionInputs.from_args(args, configs)
+    no_of_years = args['years_till_retirement']
+    current_year = date.today().year
+    years = np.arange(current_year, current_year + no_of_years + 1, dtype=np.int64)
+    with timed('projection.grid_lookup'):
+        # the batch of one scenario is only built for the grid and the shared cache
+        grid = load_grid(configs, frequency, tax_regime)
+        precomputed = None if grid is None else grid.lookup(args.as_batch())
+    if precomputed is not None:
+        return (years, *precomputed)
+    cache = projection_cache()
+    if cache is None:
+        corpus, expenses = run_scenario(args.to_dict(), configs, frequency, tax_regime)
+        return years, corpus[0], expenses[0]
+
+    def compute():
+        corpus, expenses = run_scenario(args.to_dict(), configs, frequency, tax_regime)
+        return np.concatenate([corpus[0], expenses[0, :, None]], axis=-1).tobytes()
+    with timed('projection.shared_cache'):
+        values = np.frombuffer(cache.get_or_compute(projection_key(args.as_batch(), configs, frequency, tax_regime, current_year), compute), dtype=np.int64)
+    values = values.reshape(no_of_years + 1, len(INSTRUMENTS) + 1)
+    return years, values[:, :-1], values[:, -1]
+
+# a year of <iter_projection>: the amounts at the start of the year (the columns of BATCH_COLUMNS), and the income,
+# its tax and the FD contribution (what is left of the income after the expenses and the other contributions) of the
+# year, 0 for the year of retirement
+ProjectionRow = namedtuple('ProjectionRow', ('year', *BATCH_COLUMNS, 'income', 'income_tax', 'fd_contribution'))
+
+def iter_projection(args, configs: Params, frequency='yearly', tax_regime='old'):
+    '''
+    Generator of the projection of a single set of inputs, one ProjectionRow per year from the current year till the
+    year of retirement, the same amounts as <project_savings>: the cash flows of the years are those of <run_scenario>,
+    computed up front, and the corpus of every year is stepped by the same <step_year> when it is asked for, so
+    stopping early saves the years not asked for.
+    Raises ProjectionOverflow when the amounts grow beyond int64, like <project_savings>.
+    '''
+    if frequency not in FREQUENCIES:
+        raise ValueError(f'frequency must be one of {", ".join(FREQUENCIES)}, got {frequency!r}')
+    if not isinstance(args, ProjectionInputs):
+        args = ProjectionInputs.from_args(args, configs)
+    scenario = args.to_dict()
+    no_of_years = max(scenario['years_till_retirement'], 0)
+    current_year = date.today().year
+    incomes, incomes_after_tax, contributions, expenses = scenario_cash_flows(scenario, configs, tax_regime)
+    multipliers, annuities = scenario_factors(scenario, frequency)
+    corpus = [scenario[key] for key in INSTRUMENTS]
+    for i, flows in enumerate(contributions):
+        yield ProjectionRow(
+            current_year + i, *corpus, sum(corpus), expenses[i], incomes[i], incomes[i] - incomes_after_tax[i], flows[FD],
+        )
+        corpus = step_year(corpus, flows, multipliers, annuities, frequency, i == scenario['ppf_installments_left'] - 1)
+    yield ProjectionRow(current_year + no_of_years, *corpus, sum(corpus), expenses[no_of_years], 0, 0, 0)
+
+def first_year(rows, condition):
+    '''
+    The first row of <rows> (e.g. iter_projection(...)) for which <condition>(row) is true, None when there is none.
+    Only the rows up to it are computed, e.g. the year the corpus reaches 25 times the expenses:
+        first_year(iter_projection(args, configs), lambda row: row.total_savings_corpus >= 25 * row.expenses)
+    '''
+    return next((row for row in rows if condition(row)), None)
+
+def projection_key(inputs, configs: Params, frequency, tax_regime, year):
+    '''
+    Content hash of a single scenario of parsed <inputs> and of everything else its projection depends on:
+    the tax tables, the options, the year (taxes follow the rules of the year) and ENGINE_VERSION
+    '''
+    tax_tables = (configs.TAX_SLABS, configs.TAX_SURCHARGE_SLABS, configs.HEALTH_AND_EDUCATION_CESS_RATE, configs.TAX_REGIME_RULES)
+    scenario = tuple((key, values[0].item()) for key, values in inputs.items())
+    return hashlib.sha256(repr((ENGINE_VERSION, year, frequency, tax_regime, tax_tables, scenario)).encode()).hexdigest()
+
+def project_batch(scenarios, configs: Params, columns=None, frequency='yearly', tax_regime='old'):
+    '''
+    Projects a batch of scenarios in one vectorized pass, see <parse_scenarios> for the accepted inputs.
+    Returns an int64 array of shape (scenarios, horizon + 1, len(BATCH_COLUMNS)), where the horizon is the
+    longest years_till_retirement of the batch and year 0 is the current year.
+    Years after the retirement of a scenario are left as 0.
+    '''
+    return run_batch(parse_scenarios(scenarios, configs, columns), configs, frequency, tax_regime)
+
+def run_batch(inputs, configs: Params, frequency='yearly', tax_regime='old'):
+    corpus, expenses = run_projection(inputs, configs, frequency, tax_regime)
+    return np.concatenate([corpus, corpus.sum(axis=-1, keepdims=True), expenses[..., None]], axis=-1)
+
+class ProjectionResult(object):
+    '''
+    Columnar result of a projection: a shared year index and one int64 column per entry of <BATCH_COLUMNS>.
+    Columns are read-only views into a single (years, columns) matrix, nothing is copied until a DataFrame or JSON is asked for.
+    The views of VIEWS other than 'nominal' are derived from the matrix the first time they are asked for and kept with
+    the result, switching between them never runs the projection again.
+    Attributes:
+        years: int64 array of the projected years
+        values: int64 matrix of shape (len(years), len(BATCH_COLUMNS))
+        inflation_rate: % a year, the amounts of the 'real' view are in the rupees of the first year
+    '''
+    __slots__ = ('years', 'values', 'inflation_rate', '_views')
+
+    def __init__(self, years, corpus, expenses, inflation_rate=0.0):
+        self.years = np.asarray(years, dtype=np.int64)
+        self.values = np.empty((len(self.years), len(BATCH_COLUMNS)), dtype=np.int64)
+        self.values[:, :len(INSTRUMENTS)] = corpus
+        self.values[:, len(INSTRUMENTS)] = self.values[:, :len(INSTRUMENTS)].sum(axis=1)
+        self.values[:, len(INSTRUMENTS) + 1] = expenses
+        self.years.setflags(write=False)
+        self.values.setflags(write=False)
+        self.inflation_rate = float(inflation_rate)
+        self._views = {'nominal': self.values}
+
+    def __getitem__(self, column):
+        return self.values[:, BATCH_COLUMNS.index(column)]
+
+    def __len__(self):
+        return len(self.years)
+
+    def to_numpy(self):
+        return self.values
+
+    def view(self, name='nominal'):
+        '''
+        Read-only matrix of the shape of <values> with the amounts of view <name> of VIEWS, computed once per result:
+            nominal: the projected amounts, int64
+            real: the amounts deflated by the inflation rate to the rupees of the first year, int64
+            allocation: % of the total savings corpus of the year, float64, the expenses too
+            growth: % change from the year before, float64, NaN for the first year and after a year at 0
+        '''
+        if name not in VIEWS:
+            raise ValueError(f'view must be one of {", ".join(VIEWS)}, got {name!r}')
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = VIEWS[name](self)
+            view.setflags(write=False)
+        return view
+
+    def to_frame(self, labels=SERIES_LABELS, view='nominal'):
+        '''
+        Long-format DataFrame with the columns Year, Amount and Savings Instrument (categorical, in the order of <labels>)
+        '''
+        import pandas as pd
+
+        columns = [BATCH_COLUMNS.index(column) for column in labels]
+        return pd.DataFrame({
+            'Year': np.tile(self.years, len(columns)),
+            'Amount': self.view(view)[:, columns].T.ravel(),
+            'Savings Instrument': pd.Categorical.from_codes(np.repeat(np.arange(len(columns)), len(self.years)), categories=list(labels.values())),
+        })
+
+    def to_chart_data(self, labels=SERIES_LABELS, view='nominal'):
+        '''
+        JSON friendly dict: the view, the years and the amounts of every series, in the order of <labels>.
+        Percentages are rounded to VIEW_DECIMALS, NaN is sent as null.
+        '''
+        values = self.view(view)
+        if values.dtype.kind == 'f':
+            values = np.round(values, VIEW_DECIMALS).astype(object)
+            values[np.isnan(values.astype(np.float64))] = None
+        return {
+            'view': view,
+            'years': self.years.tolist(),
+            'series': [[label, values[:, BATCH_COLUMNS.index(column)].tolist()] for column, label in labels.items()],
+        }
+
+    def to_json(self, labels=SERIES_LABELS, view='nominal'):
+        return json.dumps(self.to_chart_data(labels, view), separators=(',', ':'))
+
+def real_view(result: ProjectionResult):
+    deflator = (1 + result.inflation_rate / 100) ** (result.years - result.years[0]).astype(np.float64)
+    return np.rint(result.values / deflator[:, None]).astype(np.int64)
+
+def allocation_view(result: ProjectionResult):
+    total = result['total_savings_corpus'].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total[:, None] != 0, 100 * result.values / total[:, None], 0.0)
+
+def growth_view(result: ProjectionResult):
+    growth = np.full(result.values.shape, np.nan)
+    previous = result.values[:-1].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth[1:] = np.where(previous != 0, 100 * (result.values[1:] / previous - 1), np.nan)
+    return growth
+
+# views of a ProjectionResult and the functions deriving them from it, in the order of the view selectors
+VIEWS = {
+    'nominal': lambda result: result.values,
+    'real': real_view,
+    'allocation': allocation_view,
+    'growth': growth_view,
+}
+# display label of every view
+VIEW_LABELS = {
+    'nominal': 'Amount',
+    'real': 'Amount in present-day rupees',
+    'allocation': '% of the total savings',
+    'growth': '% growth over the year before',
+}
+# decimals of the percentages of the views sent as JSON
+VIEW_DECIMALS = 2
@@ -0,0 +1,95 @@
+import math
+
+import numpy as np
+
+from inputs import ProjectionOverflow, input_bounds, range_error
+from params import Params
+from projection import parse_args, run_projection
+
+# perturbation of the rates and % of basic inputs, in % points
+RATE_DELTA = 1.0
+# perturbation of the rupee contributions, as a fraction of their value
+CONTRIBUTION_DELTA = 0.1
+
+def sensitivity_inputs(configs: Params):
+    return (*configs.rates.keys(), *configs.basic_pct_contributions.keys(), *configs.contributions.keys())
+
+def perturbed_values(key, value, configs: Params, rate_delta=RATE_DELTA, contribution_delta=CONTRIBUTION_DELTA):
+    '''
+    The low and the high value of input <key>, clipped to its range: a rate moved down to -100% or below is left at <value>
+    '''
+    if key in configs.contributions:
+        low, high = value * (1 - contribution_delta), value * (1 + contribution_delta)
+    else:
+        low, high = value - rate_delta, value + rate_delta
+    lower, upper = input_bounds(key, configs)
+    clipped = (min(max(low, lower), upper), min(max(high, lower), upper))
+    return tuple(value if range_error(key, moved, configs) else moved for moved in clipped)
+
+def retirement_corpus(inputs, configs: Params, frequency, tax_regime):
+    '''
+    Total savings corpus at retirement of every scenario of <inputs>, None for the scenarios whose projection overflows:
+    a batch that overflows is projected again one scenario at a time
+    '''
+    no_of_years = inputs['years_till_retirement']
+    try:
+        corpus, _ = run_projection(inputs, configs, frequency, tax_regime)
+    except ProjectionOverflow:
+        if len(no_of_years) == 1:
+            return [None]
+        return [
+            total
+            for i in range(len(no_of_years))
+            for total in retirement_corpus({key: values[i:i + 1] for key, values in inputs.items()}, configs, frequency, tax_regime)
+        ]
+    # added up as Python ints, the instruments may add up beyond int64
+    return [sum(amounts) for amounts in corpus[np.arange(len(no_of_years)), no_of_years].tolist()]
+
+def sensitivity_analysis(args, configs: Params, rate_delta=RATE_DELTA, contribution_delta=CONTRIBUTION_DELTA, frequency='yearly', tax_regime='old'):
+    '''
+    Moves every input of <sensitivity_inputs> down and up (rates and % of basic by <rate_delta> % points,
+    contributions by <contribution_delta> of their value) one at a time, all 2 x inputs scenarios and the base
+    scenario are projected in one batch. The values are kept in the range of every input, see <perturbed_values>.
+    Returns
+        base_corpus: total savings corpus at retirement with the inputs unchanged
+        rows: one dict per input, sorted by the spread of the corpus between the low and the high value
+            input, base_value, low_value, high_value, low_corpus, high_corpus, impact (high_corpus - low_corpus)
+            elasticity: central finite-difference elasticity of the corpus to the input, None for an input at 0
+            The corpus of a value whose projection overflows is None, as are the impact and the elasticity, the
+            rows of those inputs come first.
+    Raises ProjectionOverflow when the projection of the base scenario overflows.
+    '''
+    keys = sensitivity_inputs(configs)
+    base = parse_args(args, configs)
+    no_of_scenarios = 1 + 2 * len(keys)
+    inputs = {key: np.repeat(value, no_of_scenarios) for key, value in base.items()}
+    for i, key in enumerate(keys):
+        low, high = perturbed_values(key, base[key][0], configs, rate_delta, contribution_delta)
+        inputs[key][1 + 2 * i] = low
+        inputs[key][2 + 2 * i] = high
+
+    totals = retirement_corpus(inputs, configs, frequency, tax_regime)
+    base_corpus = totals[0]
+    if base_corpus is None:
+        raise ProjectionOverflow()
+
+    rows = []
+    for i, key in enumerate(keys):
+        base_value, low_value, high_value = base[key][0], inputs[key][1 + 2 * i], inputs[key][2 + 2 * i]
+        low_corpus, high_corpus = totals[1 + 2 * i], totals[2 + 2 * i]
+        impact = None if low_corpus is None or high_corpus is None else high_corpus - low_corpus
+        elasticity = None
+        if impact is not None and base_value != 0 and base_corpus != 0 and high_value != low_value:
+            elasticity = float(((high_corpus - low_corpus) / base_corpus) / ((high_value - low_value) / base_value))
+        rows.append({
+            'input': key,
+            'base_value': base_value.item(),
+            'low_value': low_value.item(),
+            'high_value': high_value.item(),
+            'low_corpus': low_corpus,
+            'high_corpus': high_corpus,
+            'impact': impact,
+            'elasticity': elasticity,
+        })
+    rows.sort(key=lambda row: math.inf if row['impact'] is None else abs(row['impact']), reverse=True)
+    return base_corpus, rows
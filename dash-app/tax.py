@@ -1,3 +1,8 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
 from params import Params
 
 class Tax(object):
@@ -32,12 +37,7 @@ class Tax(object):
         return total_income_tax
 
     def calculate_primary_income_tax(self, taxable_income):
-        income_tax = 0
-        for threshold, rate in self.TAX_SLABS:
-            if taxable_income > threshold:
-                income_tax += (taxable_income - threshold) * (rate / 100)
-                taxable_income = threshold
-        return income_tax
+        return primary_income_tax(taxable_income, self.TAX_SLABS)
 
     def add_surcharge_tax(self, taxable_income, income_tax):
         tax_surcharge_rate, threshold = self.find_surcharge_rate(taxable_income)
@@ -51,9 +51,328 @@ class Tax(object):
         return min(total_tax, marginal_tax)
 
     def find_surcharge_rate(self, taxable_income):
-        tax_surcharge_rate = 0
-        for threshold, rate in self.TAX_SURCHARGE_SLABS:
-            if taxable_income > threshold:
-                tax_surcharge_rate = rate
-                break
-        return tax_surcharge_rate, threshold
+        return surcharge_rate(taxable_income, self.TAX_SURCHARGE_SLABS)
+
+# slab tables of <calculate_income_tax>, slabs are kept in the descending order of Params
+TaxTables = namedtuple('TaxTables', [
+    'thresholds',                  # descending thresholds of TAX_SLABS
+    'rates',                       # rate / 100 of every slab
+    'ascending_thresholds',        # for the binary search of the slab of an income
+    'full_slab_tax',               # tax on the whole width of every slab, 0 for the top slab
+    'surcharge_thresholds',        # descending thresholds of TAX_SURCHARGE_SLABS
+    'surcharge_rates',             # rate / 100 of every surcharge slab
+    'ascending_surcharge_thresholds',
+    'marginal_base_tax',           # tax with surcharge at the threshold of every surcharge slab
+    'default_surcharge_threshold', # threshold used for marginal relief when no surcharge slab applies
+    'default_marginal_base_tax',
+])
+
+def primary_income_tax(taxable_income, tax_slabs):
+    income_tax = 0
+    for threshold, rate in tax_slabs:
+        if taxable_income > threshold:
+            income_tax += (taxable_income - threshold) * (rate / 100)
+            taxable_income = threshold
+    return income_tax
+
+def surcharge_rate(taxable_income, tax_surcharge_slabs):
+    tax_surcharge_rate = 0
+    for threshold, rate in tax_surcharge_slabs:
+        if taxable_income > threshold:
+            tax_surcharge_rate = rate
+            break
+    return tax_surcharge_rate, threshold
+
+@lru_cache(maxsize=16)
+def compile_tax_tables(tax_slabs, tax_surcharge_slabs):
+    '''
+    Precomputes everything <calculate_income_tax> needs from the slabs, the slabs must be tuples
+    '''
+    thresholds = [threshold for threshold, _ in tax_slabs]
+    full_slab_tax = [0.0] + [(upper - lower) * (rate / 100) for upper, (lower, rate) in zip(thresholds, tax_slabs[1:])]
+
+    def marginal_base_tax(threshold):
+        income_tax = primary_income_tax(threshold, tax_slabs)
+        rate, _ = surcharge_rate(threshold, tax_surcharge_slabs)
+        return income_tax + (income_tax * (rate / 100))
+
+    surcharge_thresholds = [threshold for threshold, _ in tax_surcharge_slabs]
+    # <surcharge_rate> falls through to the last threshold when no slab applies
+    default_surcharge_threshold = surcharge_thresholds[-1]
+    return TaxTables(
+        thresholds=np.array(thresholds, dtype=np.int64),
+        rates=np.array([rate / 100 for _, rate in tax_slabs]),
+        ascending_thresholds=np.array(thresholds[::-1], dtype=np.int64),
+        full_slab_tax=np.array(full_slab_tax),
+        surcharge_thresholds=np.array(surcharge_thresholds, dtype=np.int64),
+        surcharge_rates=np.array([rate / 100 for _, rate in tax_surcharge_slabs]),
+        ascending_surcharge_thresholds=np.array(surcharge_thresholds[::-1], dtype=np.int64),
+        marginal_base_tax=np.array([marginal_base_tax(threshold) for threshold in surcharge_thresholds]),
+        default_surcharge_threshold=default_surcharge_threshold,
+        default_marginal_base_tax=marginal_base_tax(default_surcharge_threshold),
+    )
+
+def find_slab(taxable_income, ascending_thresholds):
+    '''
+    Index (in descending order) of the highest threshold below each income, len(thresholds) when there is none
+    '''
+    return len(ascending_thresholds) - np.searchsorted(ascending_thresholds, taxable_income, side='left')
+
+def calculate_income_tax(annual_income_before_tax, contribution_employer_pf, contribution_80c, contribution_nps, configs: Params):
+    '''
+    Vectorized Tax(...).total_income_tax, takes arrays (or scalars) of incomes and contributions that broadcast together.
+    The tax of the slabs below the slab of the income are added in the same order as <Tax.calculate_primary_income_tax>,
+    so that the result is the same float as the Tax object and not just close to it.
+    '''
+    taxable_income = (
+        np.trunc(annual_income_before_tax).astype(np.int64)
+        - np.asarray(contribution_employer_pf)
+        - total_deductions(0, contribution_80c, contribution_nps)
+    )
+    return calculate_tax_on_taxable_income(taxable_income, configs)
+
+def total_deductions(contribution_employer_pf, contribution_80c, contribution_nps):
+    return np.asarray(contribution_employer_pf) + np.minimum(150000, contribution_80c) + np.minimum(50000, contribution_nps)
+
+def calculate_tax_on_taxable_income(taxable_income, configs: Params):
+    '''
+    Total income tax (surcharge, marginal relief and cess included) on arrays of taxable income
+    '''
+    tables = compile_tax_tables(tuple(configs.TAX_SLABS), tuple(configs.TAX_SURCHARGE_SLABS))
+    return tax_on_taxable_income(taxable_income, tables, configs.HEALTH_AND_EDUCATION_CESS_RATE)
+
+def tax_on_taxable_income(taxable_income, tables: TaxTables, health_and_education_cess_rate):
+    income_tax_with_surcharge = tax_before_cess(taxable_income, tables)
+    health_and_education_cess = income_tax_with_surcharge * (health_and_education_cess_rate / 100)
+    return income_tax_with_surcharge + health_and_education_cess
+
+def tax_before_cess(taxable_income, tables: TaxTables):
+    # primary income tax: the part of the income in its own slab, then every full slab below it
+    slab = find_slab(taxable_income, tables.ascending_thresholds)
+    in_a_slab = slab < len(tables.thresholds)
+    slab = np.minimum(slab, len(tables.thresholds) - 1)
+    income_tax = np.where(in_a_slab, (taxable_income - tables.thresholds[slab]) * tables.rates[slab], 0.0)
+    for i in range(1, len(tables.thresholds)):
+        income_tax = income_tax + np.where(in_a_slab & (slab < i), tables.full_slab_tax[i], 0.0)
+
+    # surcharge with marginal relief
+    surcharge_slab = find_slab(taxable_income, tables.ascending_surcharge_thresholds)
+    in_a_surcharge_slab = surcharge_slab < len(tables.surcharge_thresholds)
+    surcharge_slab = np.minimum(surcharge_slab, len(tables.surcharge_thresholds) - 1)
+    tax_surcharge_rate = np.where(in_a_surcharge_slab, tables.surcharge_rates[surcharge_slab], 0.0)
+    threshold = np.where(in_a_surcharge_slab, tables.surcharge_thresholds[surcharge_slab], tables.default_surcharge_threshold)
+    marginal_base_tax = np.where(in_a_surcharge_slab, tables.marginal_base_tax[surcharge_slab], tables.default_marginal_base_tax)
+    total_tax = income_tax + (income_tax * tax_surcharge_rate)
+    marginal_tax = marginal_base_tax + (taxable_income - threshold)
+    return np.minimum(total_tax, marginal_tax)
+
+def calculate_after_tax_income(annual_income_before_tax, contribution_employer_pf, contribution_80c, contribution_nps, configs: Params):
+    '''
+    Vectorized Tax(...).after_tax_income
+    '''
+    annual_income_before_tax = np.trunc(annual_income_before_tax).astype(np.int64)
+    total_income_tax = calculate_income_tax(annual_income_before_tax, contribution_employer_pf, contribution_80c, contribution_nps, configs)
+    return np.trunc(annual_income_before_tax - total_income_tax).astype(np.int64)
+
+# regimes of Params.TAX_REGIME_RULES, 'auto' picks the cheaper one for every income
+REGIMES = ('old', 'new')
+TAX_REGIME_CHOICES = (*REGIMES, 'auto')
+
+RegimeRules = namedtuple('RegimeRules', [
+    'tables',              # TaxTables of the slabs and surcharge slabs
+    'standard_deduction',
+    'deductions',          # whether the 80C and NPS deductions are allowed
+    'rebate_limit',        # taxable income up to which the tax is rebated in full
+    'marginal_relief',     # whether the tax above the rebate limit is at most the income above it
+])
+
+@lru_cache(maxsize=32)
+def compile_regime_rules(tax_slabs, tax_surcharge_slabs, standard_deduction, deductions, rebate_limit, marginal_relief):
+    return RegimeRules(compile_tax_tables(tax_slabs, tax_surcharge_slabs), standard_deduction, deductions, rebate_limit, marginal_relief)
+
+def regime_rules_by_year(configs: Params, regime):
+    '''
+    Ascending first financial years and the compiled rules of <regime> from each of them
+    '''
+    return compile_regime_rules_by_year(configs.TAX_REGIME_RULES, regime)
+
+@lru_cache(maxsize=32)
+def compile_regime_rules_by_year(tax_regime_rules, regime):
+    entries = sorted((year, rules) for name, year, *rules in tax_regime_rules if name == regime)
+    if not entries:
+        raise ValueError(f'no tax rules for the {regime!r} regime, expected one of {", ".join(REGIMES)}')
+    first_years = np.array([year for year, _ in entries], dtype=np.int64)
+    first_years.setflags(write=False)
+    return (
+        first_years,
+        tuple(compile_regime_rules(tuple(slabs), tuple(surcharge_slabs), *rest) for year, (slabs, surcharge_slabs, *rest) in entries),
+    )
+
+def regime_tax(taxable_income_before_deductions, contribution_80c, contribution_nps, rules: RegimeRules, health_and_education_cess_rate):
+    taxable_income = taxable_income_before_deductions - rules.standard_deduction
+    if rules.deductions:
+        taxable_income = taxable_income - total_deductions(0, contribution_80c, contribution_nps)
+    income_tax = tax_before_cess(taxable_income, rules.tables)
+    if rules.rebate_limit:
+        # no tax up to the limit, and with marginal relief never more tax than the income above it
+        above_limit = np.minimum(income_tax, taxable_income - rules.rebate_limit) if rules.marginal_relief else income_tax
+        income_tax = np.where(taxable_income <= rules.rebate_limit, 0.0, above_limit)
+    return income_tax + income_tax * (health_and_education_cess_rate / 100)
+
+def calculate_regime_taxes(annual_income_before_tax, contribution_employer_pf, contribution_80c, contribution_nps, years, configs: Params, regimes=REGIMES):
+    '''
+    Total income tax under every regime of <regimes>, for incomes earned in the financial years <years>.
+    The incomes and contributions are arrays that broadcast together, <years> is either a single year or one year per
+    entry of their last axis (e.g. the projected years). The years sharing the same rules are taxed together, so every
+    regime costs one vectorized evaluation per change of its rules over the years.
+    Returns an array of shape (len(regimes), *shape of the incomes). The old regime is the tax of Tax after its
+    standard deduction and 87A rebate.
+    '''
+    income, employer_pf, contribution_80c, contribution_nps = np.broadcast_arrays(
+        np.trunc(annual_income_before_tax).astype(np.int64), contribution_employer_pf, contribution_80c, contribution_nps,
+    )
+    # the employer pf contribution is part of the income but is not taxed under either regime
+    taxable_income = income - employer_pf
+    years = np.asarray(years, dtype=np.int64)
+    taxes = np.empty((len(regimes), *income.shape))
+    for r, regime in enumerate(regimes):
+        first_years, rules = regime_rules_by_year(configs, regime)
+        applicable = np.maximum(np.searchsorted(first_years, years, side='right') - 1, 0)
+        if applicable.ndim == 0 or (applicable.size and applicable.min() == applicable.max()):
+            # every year under the same rules, e.g. all the years of a projection once the latest rules apply
+            taxes[r] = regime_tax(taxable_income, contribution_80c, contribution_nps, rules[applicable.flat[0]], configs.HEALTH_AND_EDUCATION_CESS_RATE)
+            continue
+        for i in np.unique(applicable):
+            columns = applicable == i
+            taxes[r][..., columns] = regime_tax(
+                taxable_income[..., columns], contribution_80c[..., columns], contribution_nps[..., columns],
+                rules[i], configs.HEALTH_AND_EDUCATION_CESS_RATE,
+            )
+    return taxes
+
+def calculate_regime_after_tax_income(annual_income_before_tax, contribution_employer_pf, contribution_80c, contribution_nps, years, configs: Params, regime='auto'):
+    '''
+    After tax income under <regime> (one of TAX_REGIME_CHOICES), 'auto' takes the cheaper regime of every income.
+    Every regime follows the rules of Params.TAX_REGIME_RULES, so 'old' is the tax 'auto' compares.
+    '''
+    if regime not in TAX_REGIME_CHOICES:
+        raise ValueError(f'tax regime must be one of {", ".join(TAX_REGIME_CHOICES)}, got {regime!r}')
+    annual_income_before_tax = np.trunc(annual_income_before_tax).astype(np.int64)
+    regimes = REGIMES if regime == 'auto' else (regime,)
+    taxes = calculate_regime_taxes(annual_income_before_tax, contribution_employer_pf, contribution_80c, contribution_nps, years, configs, regimes)
+    total_income_tax = taxes.min(axis=0) if len(regimes) > 1 else taxes[0]
+    return np.trunc(annual_income_before_tax - total_income_tax).astype(np.int64)
+
+def cheaper_regime(annual_income_before_tax, contribution_employer_pf, contribution_80c, contribution_nps, years, configs: Params):
+    '''
+    Name of the regime with the least tax for every income, the old regime on a tie
+    '''
+    taxes = calculate_regime_taxes(annual_income_before_tax, contribution_employer_pf, contribution_80c, contribution_nps, years, configs)
+    return np.array(REGIMES)[taxes.argmin(axis=0)]
+
+class TaxSchedule(object):
+    '''
+    The total income tax (surcharge, marginal relief and cess included) compiled into a piecewise-linear
+    function of the taxable income, use <TaxSchedule.from_params> to get the compiled schedule of a Params.
+    Attributes (read-only):
+        breakpoints: ascending taxable incomes at which the slope changes (slab and surcharge thresholds, end of marginal relief)
+        values: tax at every breakpoint
+        slopes: slope of every piece, piece 0 is (-inf, breakpoints[0]] and piece i is [breakpoints[i-1], breakpoints[i]]
+        intercepts: tax at 0 of the line of every piece
+    '''
+    __slots__ = ('breakpoints', 'values', 'slopes', 'intercepts')
+
+    def __init__(self, breakpoints, values, slopes, intercepts):
+        for name, array in zip(self.__slots__, (breakpoints, values, slopes, intercepts)):
+            array = np.array(array, dtype=np.float64)
+            array.setflags(write=False)
+            object.__setattr__(self, name, array)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('TaxSchedule is immutable')
+
+    @classmethod
+    def from_params(cls, configs: Params):
+        return compile_tax_schedule(tuple(configs.TAX_SLABS), tuple(configs.TAX_SURCHARGE_SLABS), configs.HEALTH_AND_EDUCATION_CESS_RATE)
+
+    def piece(self, taxable_income):
+        return np.searchsorted(self.breakpoints, taxable_income, side='right')
+
+    def tax(self, taxable_income):
+        '''
+        Total income tax on arrays of taxable income, O(log n) per income
+        '''
+        piece = self.piece(taxable_income)
+        anchor = np.maximum(piece - 1, 0)
+        return self.values[anchor] + self.slopes[piece] * (taxable_income - self.breakpoints[anchor])
+
+    def after_tax_income(self, annual_income_before_tax, contribution_employer_pf=0, contribution_80c=0, contribution_nps=0):
+        deductions = total_deductions(contribution_employer_pf, contribution_80c, contribution_nps)
+        return annual_income_before_tax - self.tax(annual_income_before_tax - deductions)
+
+    def gross_income(self, after_tax_income, contribution_employer_pf=0, contribution_80c=0, contribution_nps=0):
+        '''
+        Inverse of <after_tax_income>: the lowest gross income that leaves at least <after_tax_income> after tax.
+        Income left after tax dips slightly inside the marginal relief bands (the cess applies to every extra rupee),
+        so the first piece at which the running maximum reaches the target is solved for.
+        Only non-negative taxable incomes are considered, so the answer is never below the deductions.
+        '''
+        deductions = total_deductions(contribution_employer_pf, contribution_80c, contribution_nps)
+        target = np.asarray(after_tax_income, dtype=np.float64) - deductions
+
+        # income left after tax as a function of the taxable income, from the first non-negative breakpoint onwards
+        start = int(np.searchsorted(self.breakpoints, 0, side='left'))
+        breakpoints = self.breakpoints[start:]
+        left_after_tax = breakpoints - self.values[start:]
+        reached = np.searchsorted(np.maximum.accumulate(left_after_tax), target, side='left')
+
+        last = len(breakpoints) - 1
+        lower = np.clip(reached - 1, 0, last)
+        upper = np.minimum(reached, last)
+        # on the piece [breakpoints[lower], breakpoints[upper]], or the last ray when the target is beyond every breakpoint
+        slope = np.where(reached > last, 1 - self.slopes[-1], (left_after_tax[upper] - left_after_tax[lower]) / np.where(upper > lower, breakpoints[upper] - breakpoints[lower], 1))
+        taxable_income = np.where(
+            reached == 0,
+            breakpoints[0],
+            breakpoints[lower] + (target - left_after_tax[lower]) / np.where(slope > 0, slope, 1),
+        )
+        return taxable_income + deductions
+
+@lru_cache(maxsize=16)
+def compile_tax_schedule(tax_slabs, tax_surcharge_slabs, health_and_education_cess_rate):
+    '''
+    Builds the TaxSchedule of the slabs, the slabs must be tuples
+    '''
+    tables = compile_tax_tables(tax_slabs, tax_surcharge_slabs)
+
+    # between two of these the primary tax and the surcharge rate are linear / constant
+    thresholds = sorted({0, *(threshold for threshold, _ in tax_slabs), *(threshold for threshold, _ in tax_surcharge_slabs)})
+    span = max(thresholds[-1], 1)
+
+    # marginal relief caps the tax with surcharge at <tax at the threshold> + <income above the threshold>,
+    # the cap and the uncapped tax cross at most once between two thresholds
+    crossings = []
+    for lower, upper in zip(thresholds, [*thresholds[1:], thresholds[-1] + span]):
+        rate, threshold = surcharge_rate(upper, tax_surcharge_slabs)
+        slab = find_slab(upper, tables.ascending_surcharge_thresholds)
+        base_tax = tables.marginal_base_tax[slab] if slab < len(tables.surcharge_thresholds) else tables.default_marginal_base_tax
+
+        def uncapped_minus_cap(taxable_income):
+            income_tax = primary_income_tax(taxable_income, tax_slabs)
+            return (income_tax + income_tax * (rate / 100)) - (base_tax + (taxable_income - threshold))
+
+        at_lower, at_upper = uncapped_minus_cap(lower), uncapped_minus_cap(upper)
+        if at_lower != at_upper:
+            crossing = lower + at_lower * (upper - lower) / (at_lower - at_upper)
+            # the last piece is unbounded, the crossing may be beyond <upper>
+            if lower < crossing and (crossing < upper or upper > thresholds[-1]):
+                crossings.append(crossing)
+
+    breakpoints = np.array(sorted({*thresholds, *crossings}), dtype=np.float64)
+    values = tax_on_taxable_income(breakpoints, tables, health_and_education_cess_rate)
+    # the two unbounded pieces
+    left_slope = (values[0] - tax_on_taxable_income(breakpoints[0] - span, tables, health_and_education_cess_rate)) / span
+    right_slope = (tax_on_taxable_income(breakpoints[-1] + span, tables, health_and_education_cess_rate) - values[-1]) / span
+    slopes = np.concatenate([[left_slope], np.diff(values) / np.diff(breakpoints), [right_slope]])
+    intercepts = np.concatenate([[values[0] - slopes[0] * breakpoints[0]], values - slopes[1:] * breakpoints])
+    return TaxSchedule(breakpoints, values, slopes, intercepts)
@@ -0,0 +1,678 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import bulk
+import grid
+import jobs
+import metrics
+from coalescing import Coalescer, Superseded
+from goal_seek import FLOAT_TOLERANCE, solve_for
+from inputs import InputError, ProjectionInputs
+from monte_carlo import simulate
+from params import Params
+from projection import BATCH_COLUMNS, INSTRUMENTS, SERIES_LABELS, ProjectionResult, first_year, iter_projection, monthly_factors, parse_args, parse_records, project_batch, project_savings, run_batch, run_projection
+from sensitivity import sensitivity_analysis
+from shared_cache import SharedCache, projection_cache
+from startup import StartupReport
+from tax import Tax, TaxSchedule, calculate_after_tax_income, calculate_income_tax, calculate_regime_taxes, calculate_tax_on_taxable_income, cheaper_regime
+from utils import calc_compound_interest_final_amount, new_corpus_value_at_year_end, savings_calculation
+
+configs = Params()
+
+def old_regime_after_tax_income(income, employer_pf, contribution_80c, contribution_nps):
+    '''
+    After tax income under the old regime of Params.TAX_REGIME_RULES through Tax: the tax of Tax after the standard
+    deduction, none up to the 87A rebate limit
+    '''
+    (_, _, _, _, standard_deduction, _, rebate_limit, _), = [rules for rules in configs.TAX_REGIME_RULES if rules[0] == 'old']
+    tax = Tax(income - standard_deduction, employer_pf, contribution_80c, contribution_nps, configs)
+    taxable_income = tax.annual_income_before_tax - employer_pf - tax.deduction_80c - tax.deduction_nps
+    return int(income - (0 if taxable_income <= rebate_limit else tax.total_income_tax))
+
+def legacy_savings_calculation(args, configs):
+    '''
+    The original per-year loop of utils.savings_calculation, kept as the parity reference for the engine,
+    with the tax of the old regime
+    '''
+    no_of_years = int(args['years_till_retirement'])
+    year_wise_savings = {key: [int(args[key])] for key in INSTRUMENTS}
+    year_wise_expenses = [12 * int(args['monthly_fixed_expense'])]
+    for i in range(no_of_years):
+        current_annual_basic = calc_compound_interest_final_amount(p=int(args['annual_basic']), r=float(args['income_growth_rate']) / 100, t=i)
+        current_nps_contribution = int(current_annual_basic * (float(args['nps_contribution']) / 100))
+        current_employer_pf_contribution = int(current_annual_basic * (float(args['employer_pf_contribution']) / 100))
+        current_employee_pf_contribution = int(current_annual_basic * (float(args['employee_pf_contribution']) / 100))
+        current_pf_contribution = current_employer_pf_contribution + current_employee_pf_contribution
+        current_mf_contribution = calc_compound_interest_final_amount(p=int(args['mf_contribution']), r=float(args['mf_step_up']) / 100, t=i)
+        current_equity_contribution = calc_compound_interest_final_amount(p=int(args['equity_contribution']), r=float(args['equity_step_up']) / 100, t=i)
+        current_ppf_contribution = int(args['ppf_contribution']) if i < int(args['ppf_installments_left']) else 0
+        current_income = calc_compound_interest_final_amount(p=int(args['annual_income']), r=float(args['income_growth_rate']) / 100, t=i)
+        after_tax_income = old_regime_after_tax_income(current_income, current_employer_pf_contribution, int(args['80c_deductions']), current_nps_contribution)
+        current_expense = calc_compound_interest_final_amount(p=12 * int(args['monthly_fixed_expense']), r=float(args['inflation_rate']) / 100, t=i)
+        current_fd_contribution = after_tax_income - current_expense - current_nps_contribution - current_pf_contribution - current_mf_contribution - current_equity_contribution - current_ppf_contribution
+
+        additions = {
+            'nps_corpus': current_nps_contribution,
+            'pf_corpus': current_pf_contribution,
+            'mf_corpus': current_mf_contribution,
+            'equity_corpus': current_equity_contribution,
+            'fd_corpus': current_fd_contribution,
+            'savings_corpus': 0,
+            'other_savings_corpus': 0,
+        }
+        for key, additional_investment in additions.items():
+            year_wise_savings[key].append(new_corpus_value_at_year_end(starting_value=year_wise_savings[key][-1], rate=float(args[key.replace('_corpus', '_ror')]), additional_investment=additional_investment))
+        if i == int(args['ppf_installments_left']) - 1:
+            year_wise_savings['fd_corpus'][-1] = year_wise_savings['fd_corpus'][-1] + new_corpus_value_at_year_end(starting_value=year_wise_savings['ppf_corpus'][-1], rate=float(args['ppf_ror']), additional_investment=current_ppf_contribution)
+            year_wise_savings['ppf_corpus'].append(0)
+        else:
+            year_wise_savings['ppf_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['ppf_corpus'][-1], rate=float(args['ppf_ror']), additional_investment=current_ppf_contribution))
+        year_wise_expenses.append(calc_compound_interest_final_amount(p=12 * int(args['monthly_fixed_expense']), r=float(args['inflation_rate']) / 100, t=i+1))
+    return year_wise_savings, year_wise_expenses
+
+def random_args(rng):
+    args = configs.get_var_dict()
+    for key in configs.current_savings_by_instrument:
+        args[key] = rng.randrange(0, 5000000)
+    for key in configs.contributions:
+        args[key] = rng.randrange(0, 600000)
+    for key in configs.rates:
+        args[key] = round(rng.uniform(0, 15), 1)
+    for key in configs.basic_pct_contributions:
+        args[key] = round(rng.uniform(0, 15), 1)
+    args['annual_income'] = rng.randrange(100000, 30000000)
+    args['annual_basic'] = rng.randrange(0, args['annual_income'])
+    args['monthly_fixed_expense'] = rng.randrange(0, 400000)
+    args['years_till_retirement'] = rng.randrange(0, 61)
+    args['ppf_installments_left'] = rng.randrange(-1, 20)
+    args['80c_deductions'] = rng.randrange(0, 300000)
+    return args
+
+def assert_matches_legacy(args):
+    _, corpus, expenses = project_savings(args, configs)
+    year_wise_savings, year_wise_expenses = legacy_savings_calculation(args, configs)
+    for j, key in enumerate(INSTRUMENTS):
+        assert corpus[:, j].tolist() == year_wise_savings[key], key
+    assert expenses.tolist() == year_wise_expenses
+
+def test_projection_matches_legacy_loop_for_defaults():
+    assert_matches_legacy(configs.get_var_dict())
+
+def test_projection_matches_legacy_loop_for_random_inputs():
+    rng = random.Random(2021)
+    for _ in range(300):
+        assert_matches_legacy(random_args(rng))
+
+def test_projection_accepts_query_string_values():
+    args = {key: str(value) for key, value in configs.get_var_dict().items()}
+    _, corpus, _ = project_savings(args, configs)
+    assert corpus.dtype == np.int64
+    assert_matches_legacy(args)
+
+def test_streamed_projection_matches_the_engine():
+    rng = random.Random(11)
+    for frequency, tax_regime in (('yearly', 'old'), ('monthly', 'new'), ('monthly', 'auto')):
+        args = random_args(rng)
+        years, corpus, expenses = project_savings(args, configs, frequency, tax_regime)
+        rows = list(iter_projection(args, configs, frequency, tax_regime))
+        assert [row.year for row in rows] == years.tolist()
+        assert np.array_equal([[getattr(row, key) for key in INSTRUMENTS] for row in rows], corpus)
+        assert [row.expenses for row in rows] == expenses.tolist()
+        assert [row.total_savings_corpus for row in rows] == corpus.sum(axis=1).tolist()
+
+    # only the years up to the first match are computed
+    args = configs.get_var_dict()
+    rows = iter_projection(args, configs)
+    row = first_year(rows, lambda row: row.fd_contribution < 0)
+    assert row.fd_contribution < 0 and row.income_tax > 0
+    assert next(rows).year == row.year + 1
+    assert first_year(iter_projection(args, configs), lambda row: False) is None
+
+def test_inputs_are_parsed_once_and_validated():
+    args = configs.get_var_dict()
+    inputs = ProjectionInputs.from_args(args, configs)
+    assert inputs == ProjectionInputs.from_args({key: f' {value} ' for key, value in args.items()}, configs)
+    assert hash(inputs) == hash(ProjectionInputs.from_args({**args, 'mf_contribution': '2,00,000'}, configs))
+    assert inputs['mf_ror'] == 8.0 and isinstance(inputs['mf_contribution'], int)
+    assert (project_savings(inputs, configs)[1] == project_savings(args, configs)[1]).all()
+    try:
+        inputs.values = ()
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError('ProjectionInputs is mutable')
+
+    try:
+        ProjectionInputs.from_args({**args, 'mf_ror': '', 'nps_corpus': 'abc', 'years_till_retirement': -1, 'fd_corpus': -5}, configs)
+    except InputError as e:
+        assert list(e.errors) == ['nps_corpus', 'fd_corpus', 'years_till_retirement', 'mf_ror']
+        assert e.errors['mf_ror'] == 'is required'
+        assert e.errors['fd_corpus'] == 'cannot be negative'
+    else:
+        raise AssertionError('invalid inputs were accepted')
+
+def test_amounts_and_rates_too_large_to_project_are_rejected():
+    args = configs.get_var_dict()
+    try:
+        ProjectionInputs.from_args({**args, 'annual_income': 1e300, 'fd_corpus': 10 ** 19, 'mf_ror': 1000}, configs)
+    except InputError as e:
+        assert list(e.errors) == ['fd_corpus', 'annual_income', 'mf_ror']
+        assert e.errors['fd_corpus'] == 'must be at most 1,000,000,000,000'
+        assert e.errors['mf_ror'] == 'must be at most 100%'
+    else:
+        raise AssertionError('amounts beyond int64 were accepted')
+    try:
+        parse_records([{**args, 'annual_income': 1e300}], configs)
+    except ValueError as e:
+        assert 'scenario 0: annual_income must be at most' in str(e)
+    else:
+        raise AssertionError('amounts beyond int64 were accepted')
+
+    # each input in range, the projection still overflows
+    largest = {**args, 'years_till_retirement': 100, 'mf_corpus': 10 ** 12, 'mf_ror': 100}
+    for project in (project_savings, lambda args, configs: list(iter_projection(args, configs, 'monthly'))):
+        try:
+            project(largest, configs)
+        except InputError as e:
+            assert list(e.errors) == ['years_till_retirement']
+        else:
+            raise AssertionError('the overflow of the projection was not reported')
+
+def test_monthly_projection_folds_the_months_of_a_year():
+    rates = np.array([0.0, 3.0, 8.0, 12.5, -4.0])
+    growth, annuity = monthly_factors(rates)
+    corpus, installments = np.full(len(rates), 1000.0), np.zeros(len(rates))
+    for _ in range(12):
+        corpus *= 1 + rates / 1200
+        installments = installments * (1 + rates / 1200) + 1 / 12
+    assert np.allclose(growth * 1000, corpus) and np.allclose(annuity, installments)
+
+    args = configs.get_var_dict()
+    flat = {**args, **{key: 0.0 for key in configs.rates}}
+    assert (project_savings(flat, configs, 'monthly')[1] == project_savings(flat, configs)[1]).all()
+    yearly, monthly = project_savings(args, configs)[1], project_savings(args, configs, 'monthly')[1]
+    assert (monthly[-1] > yearly[-1])[[INSTRUMENTS.index(key) for key in ('nps_corpus', 'pf_corpus', 'mf_corpus', 'equity_corpus')]].all()
+    assert monthly[-1, INSTRUMENTS.index('ppf_corpus')] == yearly[-1, INSTRUMENTS.index('ppf_corpus')]
+
+def test_batch_matches_scalar_projection():
+    rng = random.Random(7)
+    scenarios = [random_args(rng) for _ in range(50)]
+    keys = configs.get_input_keys()
+    table = {key: [args[key] for args in scenarios] for key in keys}
+    batch = project_batch(table, configs)
+    assert batch.shape[-1] == len(BATCH_COLUMNS)
+    for s, args in enumerate(scenarios):
+        _, corpus, expenses = project_savings(args, configs)
+        no_of_years = len(expenses)
+        assert (batch[s, :no_of_years, :len(INSTRUMENTS)] == corpus).all()
+        assert (batch[s, :no_of_years, BATCH_COLUMNS.index('total_savings_corpus')] == corpus.sum(axis=1)).all()
+        assert (batch[s, :no_of_years, BATCH_COLUMNS.index('expenses')] == expenses).all()
+        assert (batch[s, no_of_years:] == 0).all()
+
+    rows = np.array([[args[key] for key in keys] for args in scenarios], dtype=np.float64)
+    assert (project_batch(rows, configs) == batch).all()
+    assert (run_batch(parse_records(scenarios, configs), configs) == batch).all()
+
+    # a single scenario is stepped in Python numbers, a batch in arrays
+    for frequency, tax_regime in (('monthly', 'old'), ('yearly', 'new'), ('monthly', 'auto')):
+        batch = project_batch(table, configs, frequency=frequency, tax_regime=tax_regime)
+        for s, args in enumerate(scenarios):
+            _, corpus, expenses = project_savings(args, configs, frequency, tax_regime)
+            assert (batch[s, :len(expenses), :len(INSTRUMENTS)] == corpus).all()
+            assert (batch[s, :len(expenses), BATCH_COLUMNS.index('expenses')] == expenses).all()
+
+def test_records_are_validated_up_front():
+    args = configs.get_var_dict()
+    for records, message in [
+        ({'years_till_retirement': 5}, 'expected a list'),
+        ([args, {key: value for key, value in args.items() if key != 'mf_ror'}], 'scenario 1: missing mf_ror'),
+        ([{**args, 'mf_ror': '7'}], 'scenario 0: mf_ror must be a number'),
+        ([{**args, 'mf_ror': True}], 'scenario 0: mf_ror must be a number'),
+        ([{**args, 'years_till_retirement': 500}], 'scenario 0: years_till_retirement must be between'),
+    ]:
+        try:
+            parse_records(records, configs)
+        except ValueError as e:
+            assert message in str(e)
+        else:
+            raise AssertionError(f'{records!r} was accepted')
+
+def test_vectorized_tax_matches_tax_object():
+    rng = np.random.default_rng(3)
+    thresholds = [threshold for threshold, _ in configs.TAX_SLABS + configs.TAX_SURCHARGE_SLABS]
+    incomes = np.concatenate([
+        rng.integers(-100000, 80000000, 20000),
+        np.repeat(thresholds, 5) + np.tile([-1, 0, 1, 1000, 99999], len(thresholds)),
+        np.arange(5000000, 5400000, 997),
+    ])
+    employer_pf = rng.integers(0, 100000, len(incomes))
+    deduction_80c = rng.integers(0, 300000, len(incomes))
+    nps = rng.integers(0, 100000, len(incomes))
+    total_income_tax = calculate_income_tax(incomes, employer_pf, deduction_80c, nps, configs)
+    after_tax_income = calculate_after_tax_income(incomes, employer_pf, deduction_80c, nps, configs)
+    for i, (income, pf, deduction, contribution) in enumerate(zip(incomes.tolist(), employer_pf.tolist(), deduction_80c.tolist(), nps.tolist())):
+        tax = Tax(income, pf, deduction, contribution, configs)
+        assert total_income_tax[i] == tax.total_income_tax, income
+        assert after_tax_income[i] == tax.after_tax_income, income
+
+def test_tax_regimes_by_year():
+    rng = np.random.default_rng(5)
+    incomes = rng.integers(0, 80000000, (50, 3))
+    employer_pf, contribution_80c, contribution_nps = rng.integers(0, 200000, (3, 50, 3))
+    old, new = calculate_regime_taxes(incomes, employer_pf, contribution_80c, contribution_nps, [2023, 2024, 2030], configs)
+    # old regime: the tax of Tax after the standard deduction, rebated in full up to 5 lakh without marginal relief
+    taxable_income = incomes - employer_pf - np.minimum(contribution_80c, 150000) - np.minimum(contribution_nps, 50000) - 50000
+    assert (old == np.where(taxable_income <= 500000, 0, calculate_income_tax(incomes - 50000, employer_pf, contribution_80c, contribution_nps, configs))).all()
+    old_regime_tax = lambda income: calculate_regime_taxes(income, 0, 150000, 50000, 2026, configs, ('old',))[0]
+    assert old_regime_tax(700000) == 0
+    assert old_regime_tax(760000) == calculate_income_tax(710000, 0, 150000, 50000, configs) > 10000
+
+    # new regime: standard deduction, no 80C / NPS deductions, rebate with marginal relief, rules of the year
+    new_regime_tax = lambda income, year: calculate_regime_taxes(income, 0, 150000, 50000, year, configs, ('new',))[0]
+    assert new_regime_tax(1275000, 2025) == 0
+    assert new_regime_tax(1285000, 2025) == 10000 * 1.04
+    assert new_regime_tax(2000000, 2030) == 185000 * 1.04
+    assert new_regime_tax(1000000, 2024) == 42500 * 1.04
+    assert (new_regime_tax(np.array([1000000, 1000000]), np.array([2024, 2025])) == [42500 * 1.04, 0]).all()
+
+    assert cheaper_regime([1200000, 50000000], 0, 150000, 50000, 2026, configs).tolist() == ['new', 'new']
+    # at 8 lakh in 2023 the standard deduction makes the old regime the cheaper one, the tax of Tax alone is more than the new regime's
+    assert calculate_income_tax(800000, 0, 150000, 50000, configs) > new_regime_tax(800000, 2023)
+    assert cheaper_regime(800000, 0, 150000, 50000, 2023, configs) == 'old'
+    args = configs.get_var_dict()
+    corpus = {regime: project_savings(args, configs, tax_regime=regime)[1] for regime in ('old', 'new', 'auto')}
+    assert (corpus['old'] == project_savings(args, configs)[1]).all()
+    assert (corpus['auto'].sum(axis=1) >= np.maximum(corpus['old'], corpus['new']).sum(axis=1) - 1).all()
+
+def test_tax_schedule_matches_slabs_and_inverts():
+    schedule = TaxSchedule.from_params(configs)
+    taxable_income = np.concatenate([np.linspace(-1000000, 80000000, 400001), schedule.breakpoints])
+    assert np.allclose(schedule.tax(taxable_income), calculate_tax_on_taxable_income(taxable_income, configs), rtol=1e-12, atol=1e-6)
+
+    after_tax_income = np.linspace(300000, 80000000, 100001)
+    gross_income = schedule.gross_income(after_tax_income, 48000, 150000, 20000)
+    assert np.allclose(schedule.after_tax_income(gross_income, 48000, 150000, 20000), after_tax_income, rtol=1e-12)
+    # the lowest such income, even where marginal relief makes the income after tax dip
+    assert (schedule.after_tax_income(gross_income - 1, 48000, 150000, 20000) < after_tax_income).all()
+
+def test_monte_carlo_bands():
+    args = configs.get_var_dict()
+    _, corpus, _ = project_savings(args, configs)
+    # without volatility every path is the deterministic projection
+    years, bands = simulate(args, configs, no_of_paths=10, volatilities={}, seed=1)
+    assert len(years) == len(corpus)
+    assert all((band == corpus.sum(axis=1)).all() for band in bands.values())
+
+    _, bands = simulate(args, configs, no_of_paths=500, seed=1)
+    _, same_bands = simulate(args, configs, no_of_paths=500, seed=1, workers=2)
+    assert (bands[10] <= bands[50]).all() and (bands[50] <= bands[90]).all()
+    assert all((bands[percentile] == same_bands[percentile]).all() for percentile in bands)
+
+def test_projection_result_frame_matches_long_format():
+    args = configs.get_var_dict()
+    result = savings_calculation(args, configs)
+    assert isinstance(result, ProjectionResult)
+    years, corpus, expenses = project_savings(args, configs)
+    columns = dict(zip(INSTRUMENTS, corpus.T), total_savings_corpus=corpus.sum(axis=1), expenses=expenses)
+    expected = pd.concat(
+        [
+            pd.DataFrame(np.column_stack([years, columns[column], [label] * len(years)]), columns=["Year", "Amount", "Savings Instrument"]).astype({"Year": int, "Amount": int})
+            for column, label in SERIES_LABELS.items()
+        ],
+        ignore_index=True
+    )
+    frame = result.to_frame()
+    assert isinstance(frame['Savings Instrument'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(frame.astype({'Savings Instrument': object}), expected, check_dtype=False)
+    assert np.shares_memory(result['fd_corpus'], result.to_numpy())
+    assert result.to_chart_data()['series'][0] == ['Total Savings', corpus.sum(axis=1).tolist()]
+
+def test_projection_views_are_derived_once():
+    args = configs.get_var_dict()
+    result = savings_calculation(args, configs)
+    total, inflation = result['total_savings_corpus'], 1 + args['inflation_rate'] / 100
+    real = result.view('real')
+    assert real[0, -1] == result['expenses'][0] and np.all(np.abs(real[:, -1] - result['expenses'][0]) <= 1)
+    assert real[-1, -2] == round(total[-1] / inflation ** (len(result) - 1))
+    allocation = result.view('allocation')
+    assert np.allclose(allocation[:, :len(INSTRUMENTS)].sum(axis=1), 100) and np.all(allocation[:, -2] == 100)
+    growth = result.view('growth')
+    assert np.isnan(growth[0]).all() and np.isclose(growth[1, -1], args['inflation_rate'])
+    assert result.view('growth') is growth and not growth.flags.writeable
+    chart = result.to_chart_data(view='growth')
+    assert chart['view'] == 'growth' and chart['series'][0][1][:2] == [None, round(100 * (total[1] / total[0] - 1), 2)]
+    try:
+        result.view('log')
+    except ValueError as e:
+        assert 'view must be one of' in str(e)
+    else:
+        raise AssertionError('an unknown view was accepted')
+
+def test_goal_seek_finds_the_boundary_value():
+    args = configs.get_var_dict()
+    retirement_corpus = lambda args: project_savings(args, configs)[1][-1].sum()
+    for unknown, target_corpus, step in [('mf_contribution', 1e8, -1), ('years_till_retirement', 1e8, -1), ('monthly_fixed_expense', 3e7, 1), ('mf_step_up', 1e8, -1e-3)]:
+        answer = solve_for(unknown, target_corpus, args, configs)
+        assert retirement_corpus({**args, unknown: answer}) >= target_corpus
+        assert retirement_corpus({**args, unknown: answer + step}) < target_corpus
+        # warm start from the previous answer gives the same answer, up to the tolerance of a rate
+        assert abs(solve_for(unknown, target_corpus, args, configs) - answer) <= FLOAT_TOLERANCE
+
+def test_goal_seek_warm_starts_only_from_the_same_inputs(monkeypatch):
+    import goal_seek
+
+    guesses = []
+    starting_candidates = goal_seek.starting_candidates
+    def recording_starting_candidates(lower, upper, guess, integer):
+        guesses.append(guess)
+        return starting_candidates(lower, upper, guess, integer)
+    monkeypatch.setattr(goal_seek, 'starting_candidates', recording_starting_candidates)
+    args = configs.get_var_dict()
+    other = {**args, 'annual_income': 2 * args['annual_income']}
+    answer = solve_for('mf_contribution', 2e8, args, configs)
+    solve_for('mf_contribution', 2e8, other, configs, tax_regime='new')
+    next_answer = solve_for('mf_contribution', 3e8, args, configs)
+    # the value of the unknown given with the inputs is not part of the profile
+    solve_for('mf_contribution', 3e8, {**args, 'mf_contribution': 1}, configs)
+    assert guesses[1:] == [None, answer, next_answer]
+
+def test_goal_seek_takes_the_candidates_that_overflow_as_above_the_target():
+    args = {**configs.get_var_dict(), 'years_till_retirement': 90}
+    retirement_corpus = lambda args: project_savings(args, configs)[1][-1].sum()
+    try:
+        retirement_corpus({**args, 'mf_step_up': 50})
+    except InputError:
+        pass
+    else:
+        raise AssertionError('the largest step-up did not overflow')
+    answer = solve_for('mf_step_up', 1e15, args, configs)
+    assert retirement_corpus({**args, 'mf_step_up': answer}) >= 1e15 > retirement_corpus({**args, 'mf_step_up': answer - 1e-3})
+
+def test_sensitivity_matches_one_at_a_time_projections():
+    args = configs.get_var_dict()
+    base_corpus, rows = sensitivity_analysis(args, configs)
+    retirement_corpus = lambda args: project_savings(args, configs)[1][-1].sum()
+    assert base_corpus == retirement_corpus(args)
+    assert [abs(row['impact']) for row in rows] == sorted((abs(row['impact']) for row in rows), reverse=True)
+    for row in rows:
+        assert row['low_corpus'] == retirement_corpus({**args, row['input']: row['low_value']})
+        assert row['high_corpus'] == retirement_corpus({**args, row['input']: row['high_value']})
+
+def test_sensitivity_stays_in_range_and_reports_the_values_that_overflow():
+    args = {**configs.get_var_dict(), 'employer_pf_contribution': 0, 'fd_ror': 100, 'savings_ror': -99.5}
+    _, rows = sensitivity_analysis(args, configs)
+    values = {row['input']: (row['low_value'], row['high_value']) for row in rows}
+    assert values['employer_pf_contribution'] == (0, 1) and values['fd_ror'] == (99, 100) and values['savings_ror'] == (-99.5, -98.5)
+
+    # only moving the step-up up overflows
+    args = {**configs.get_var_dict(), 'years_till_retirement': 90, 'mf_contribution': 10 ** 9, 'mf_step_up': 26.5}
+    base_corpus, rows = sensitivity_analysis(args, configs)
+    assert base_corpus == sum(project_savings(args, configs)[1][-1].tolist())
+    assert rows[0]['input'] == 'mf_step_up' and rows[0]['high_corpus'] is None and rows[0]['impact'] is None
+    assert rows[0]['low_corpus'] == sum(project_savings({**args, 'mf_step_up': 25.5}, configs)[1][-1].tolist())
+    assert all(row['impact'] is not None for row in rows[1:])
+
+def test_metrics_add_up_the_workers(tmp_path, monkeypatch):
+    monkeypatch.setenv('METRICS_DIR', str(tmp_path))
+    metrics.reset()
+    other_worker = metrics.new_histogram()
+    other_worker['buckets'][-1] = 1
+    other_worker.update(sum=20.0, count=1)
+    (tmp_path / '1.json').write_text(json.dumps({'histograms': {'projection.tax': other_worker}, 'counters': {'dash.superseded_computations': 2}}))
+    metrics.observe('projection.tax', 0.002)
+    with metrics.timed('projection.yearly_loop'):
+        pass
+    metrics.increment('dash.superseded_computations')
+
+    text = metrics.prometheus_text()
+    assert (tmp_path / f'{os.getpid()}.json').exists()
+    assert 'fin_health_stage_duration_seconds_bucket{stage="projection.tax",le="0.0025"} 1' in text
+    assert 'fin_health_stage_duration_seconds_bucket{stage="projection.tax",le="+Inf"} 2' in text
+    assert 'fin_health_stage_duration_seconds_count{stage="projection.tax"} 2' in text
+    assert 'fin_health_stage_duration_seconds_count{stage="projection.yearly_loop"} 1' in text
+    assert 'fin_health_events_total{event="dash.superseded_computations"} 3' in text
+    # like the master process of gunicorn once warmed up, the workers no longer add up what it observed
+    metrics.reset()
+    assert not (tmp_path / f'{os.getpid()}.json').exists()
+    assert 'fin_health_stage_duration_seconds_count{stage="projection.tax"} 1' in metrics.prometheus_text()
+    (tmp_path / '1.json').unlink()
+    metrics.reset()
+
+def test_startup_report_times_new_imports(tmp_path, monkeypatch):
+    (tmp_path / 'startup_outer.py').write_text('import json\nimport startup_inner\n')
+    (tmp_path / 'startup_inner.py').write_text('VALUE = 1\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    report = StartupReport()
+    with report.recording_imports():
+        import startup_outer
+        with report.stage('layout'):
+            pass
+
+    # json is already loaded, it costs nothing and is not listed
+    assert [(entry['module'], entry['depth']) for entry in report.imports] == [('startup_inner', 1), ('startup_outer', 0)]
+    inner, outer = report.imports
+    assert outer['cumulative_ms'] >= inner['cumulative_ms'] and outer['self_ms'] <= outer['cumulative_ms']
+    assert report.total_import_ms() == outer['cumulative_ms']
+    assert list(report.stages) == ['layout']
+    assert 'startup_outer' in report.format()
+    monkeypatch.delitem(sys.modules, 'startup_outer')
+    monkeypatch.delitem(sys.modules, 'startup_inner')
+
+def test_grid_answers_like_the_projection(tmp_path, monkeypatch):
+    monkeypatch.setattr(grid, 'GRID_AXES', (('annual_income', np.arange(800000, 1400001, 100000)), ('monthly_fixed_expense', np.arange(20000, 40001, 10000))))
+    monkeypatch.setattr(grid, 'GRID_DIR', str(tmp_path))
+    monkeypatch.setattr(grid, '_grids', {})
+    grid.build_grid(configs)
+    args = configs.get_var_dict()
+
+    # on the grid, with fewer years than the grid
+    hit = dict(args, annual_income=1300000, monthly_fixed_expense=40000, years_till_retirement=12)
+    assert grid.lookup(parse_args(hit, configs), configs) is not None
+    assert_matches_legacy(hit)
+
+    # between the points of the grid, only within the interpolation error of the cell
+    between = parse_args(dict(args, annual_income=1250000, monthly_fixed_expense=25000), configs)
+    assert grid.lookup(between, configs) is None
+    error = grid.load_grid(configs).errors[4, 0]
+    corpus, expenses = grid.lookup(between, configs, max_error=error)
+    exact, exact_expenses = run_projection(between, configs)
+    assert np.abs(corpus - exact[0]).max() <= error * exact[0].sum(axis=-1).max() + 1
+    assert np.abs(expenses - exact_expenses[0]).max() <= 1
+    assert grid.lookup(between, configs, max_error=error / 2) is None
+
+    # any other input changed, off the grid, another year or another frequency fall back to the projection
+    assert grid.lookup(parse_args(dict(args, mf_ror=9.0), configs), configs) is None
+    assert grid.lookup(parse_args(dict(args, annual_income=2000000), configs), configs) is None
+    assert grid.lookup(parse_args(dict(args, years_till_retirement=grid.GRID_YEARS + 1), configs), configs) is None
+    assert grid.lookup(parse_args(args, configs), configs, frequency='monthly') is None
+
+def test_bulk_chunks_are_validated_and_projected_per_row():
+    rng = random.Random(7)
+    profiles = [random_args(rng) for _ in range(20)]
+    frame = pd.DataFrame([{key: profile[key] for key in configs.get_input_keys()} for profile in profiles])
+    frame['annual_income'] = frame['annual_income'].astype(object)
+    frame.loc[3, 'annual_income'] = 'n/a'
+    frame.loc[5, 'years_till_retirement'] = 101
+    frame.loc[6, 'annual_basic'] = None
+
+    inputs, valid, errors = bulk.validate_chunk(frame)
+    assert errors == [(3, "annual_income must be a number, got 'n/a'"), (5, 'years_till_retirement must be between 0 and 100'), (6, 'annual_basic is required')]
+    table, overflows = bulk.project_rows(inputs, 100 + np.flatnonzero(valid))
+    assert overflows == []
+    assert set(table['row']) == {100 + row for row in range(20) if row not in (3, 5, 6)}
+    for row in (0, 4, 19):
+        years, corpus, expenses = project_savings(profiles[row], configs)
+        rows = table['row'] == 100 + row
+        assert np.array_equal(table['year'][rows], years)
+        assert np.array_equal(np.stack([table[key][rows] for key in INSTRUMENTS], axis=-1), corpus)
+        assert np.array_equal(table['expenses'][rows], expenses)
+
+def test_bulk_rows_that_overflow_are_listed_with_the_errors(tmp_path):
+    pytest.importorskip('pyarrow')
+    rng = random.Random(9)
+    profiles = [{key: profile[key] for key in configs.get_input_keys()} for profile in (random_args(rng) for _ in range(10))]
+    # each input in range, the projection still overflows
+    profiles[6].update(mf_contribution=10 ** 9, mf_step_up=50, years_till_retirement=90)
+    pd.DataFrame(profiles).to_csv(tmp_path / 'profiles.csv', index=False)
+
+    output = str(tmp_path / 'results')
+    totals = bulk.project_file(str(tmp_path / 'profiles.csv'), output, chunk_size=4, workers=1)
+    assert totals == {'projected': 9, 'invalid': 1, 'skipped': 0}
+    table = pd.read_parquet(output)
+    assert sorted(set(table['row'])) == [row for row in range(10) if row != 6]
+    for row in (5, 7):
+        _, corpus, _ = project_savings(profiles[row], configs)
+        assert np.array_equal(table[table['row'] == row][list(INSTRUMENTS)].to_numpy(), corpus)
+    errors = pd.read_csv(os.path.join(output, '_errors', 'chunk=00001.csv'))
+    assert errors['row'].tolist() == [6] and errors['message'][0].startswith('years_till_retirement is too long')
+    # the run is complete, running it again skips every chunk
+    assert bulk.project_file(str(tmp_path / 'profiles.csv'), output, chunk_size=4, workers=1)['skipped'] == 10
+
+def test_shared_cache_fills_once_and_evicts(tmp_path, monkeypatch):
+    cache = SharedCache(str(tmp_path / 'cache.sqlite'), max_bytes=1000)
+    computed = []
+    def compute():
+        computed.append(1)
+        time.sleep(0.05)
+        return b'value'
+    values = []
+    threads = [threading.Thread(target=lambda: values.append(cache.get_or_compute('key', compute))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert values == [b'value'] * 4 and len(computed) == 1
+    assert cache.waits + cache.hits == 3
+
+    for i in range(64):
+        cache.set(f'key {i}', b'x' * 100)
+    stats = cache.stats()
+    assert stats['bytes'] <= 1000 and cache.get('key 63') is not None and cache.get('key 0') is None
+
+    # projections through the cache are the projections of the engine, whether they were stored or not
+    monkeypatch.setenv('PROJECTION_CACHE', str(tmp_path / 'projections.sqlite'))
+    args = random_args(random.Random(3))
+    for _ in range(2):
+        assert_matches_legacy(args)
+    assert (projection_cache().misses, projection_cache().hits) == (1, 1)
+
+def test_coalescer_drops_superseded_requests():
+    coalescer = Coalescer()
+    superseded = metrics._counters.get('kind.superseded_computations', 0)
+    started, release = threading.Event(), threading.Event()
+    computed, results = [], {}
+    def compute(seq):
+        computed.append(seq)
+        if seq == 1:
+            started.set()
+            release.wait()
+        return seq
+    def run(seq):
+        try:
+            results[seq] = coalescer.run('kind', {'session': 's', 'seq': seq}, lambda: compute(seq))
+        except Superseded:
+            results[seq] = None
+    # 2 and 3 wait for 1, 2 is superseded by 3 meanwhile
+    threads = [threading.Thread(target=run, args=(1,))]
+    threads[0].start()
+    started.wait()
+    for seq in (2, 3):
+        threads.append(threading.Thread(target=run, args=(seq,)))
+        threads[-1].start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert computed == [1, 3] and results == {1: 1, 2: None, 3: 3}
+    # late requests are superseded, other sessions are not
+    run(2)
+    assert results[2] is None
+    assert coalescer.run('kind', {'session': 't', 'seq': 1}, lambda: 'other') == 'other'
+    assert metrics._counters['kind.superseded_computations'] == superseded + 2
+
+def test_jobs_run_report_and_cancel(tmp_path, monkeypatch):
+    now = [0.0]
+    queue = jobs.JobQueue(str(tmp_path / 'jobs.sqlite'), lease_seconds=10, clock=lambda: now[0])
+    args = configs.get_var_dict()
+    job_id = queue.submit('projections', {'scenarios': [args] * 3})
+    assert queue.get(job_id)['state'] == 'queued' and queue.result(job_id) is None
+    assert jobs.run_next(queue, 'worker') and not jobs.run_next(queue, 'worker')
+    assert queue.get(job_id)['state'] == 'done' and queue.get(job_id)['progress'] == 1
+    years, corpus, _ = project_savings(args, configs)
+    assert [row['years'] for row in queue.result(job_id)] == [years.tolist()] * 3
+    assert queue.result(job_id)[2]['fd_corpus'] == corpus[:, INSTRUMENTS.index('fd_corpus')].tolist()
+
+    # a running job stops at its next report once cancelled
+    reports = []
+    def task(params, progress):
+        for fraction in (0.5, 1):
+            reports.append(fraction)
+            if fraction == 0.5:
+                queue.cancel(job_id)
+            progress(fraction)
+    monkeypatch.setattr(jobs, 'resolve_task', lambda name: task)
+    job_id = queue.submit('projections', {})
+    jobs.run_next(queue, 'worker')
+    assert reports == [0.5] and queue.get(job_id)['state'] == 'cancelled' and not queue.cancel(job_id)
+
+    # the job of a worker that stopped reporting goes to another worker, till it fails after MAX_ATTEMPTS
+    job_id = queue.submit('monte_carlo', {})
+    for attempt in range(jobs.MAX_ATTEMPTS):
+        assert queue.claim(f'worker {attempt}')[0] == job_id
+        assert queue.claim('other') is None
+        # the lease was lost, the previous worker is told to stop
+        assert attempt == 0 or not queue.report(job_id, f'worker {attempt - 1}', 0.5)
+        now[0] += 11
+    assert queue.claim('other') is None and queue.get(job_id)['state'] == 'failed'
+    assert queue.stats() == {'queued': 0, 'running': 0, 'done': 1, 'failed': 1, 'cancelled': 1}
+
+def test_concurrent_requests_of_a_session_are_coalesced(monkeypatch):
+    import app
+    from sensitivity import sensitivity_analysis
+
+    started, release = threading.Event(), threading.Event()
+    def slow_sensitivity_analysis(*args, **kwargs):
+        started.set()
+        release.wait()
+        return sensitivity_analysis(*args, **kwargs)
+    monkeypatch.setattr(app, 'sensitivity_analysis', slow_sensitivity_analysis)
+    superseded = metrics._counters.get('dash.update_sensitivity_chart.superseded_computations', 0)
+
+    client = app.server.test_client()
+    values = configs.get_var_dict()
+    def post(seq, statuses):
+        body = {
+            'output': 'sensitivity_store.data',
+            'outputs': {'id': 'sensitivity_store', 'property': 'data'},
+            'inputs': [{'id': 'sensitivity_request', 'property': 'data', 'value': {'session': 'tab', 'seq': seq, 'triggered': []}}],
+            'state': [
+                {'id': 'frequency_radio', 'property': 'value', 'value': 'yearly'},
+                {'id': 'tax_regime_radio', 'property': 'value', 'value': 'old'},
+                *[{'id': key, 'property': 'value', 'value': values[key]} for key in configs.get_input_keys()],
+            ],
+            'changedPropIds': ['sensitivity_request.data'],
+        }
+        statuses[seq] = client.post('/_dash-update-component', json=body).status_code
+
+    # 2 and 3 arrive while 1 is computed, on other threads of the worker: 2 is dropped, 3 is computed
+    statuses = {}
+    threads = [threading.Thread(target=post, args=(1, statuses))]
+    threads[0].start()
+    started.wait()
+    for seq in (2, 3):
+        threads.append(threading.Thread(target=post, args=(seq, statuses)))
+        threads[-1].start()
+        time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert statuses == {1: 200, 2: 204, 3: 200}
+    assert metrics._counters['dash.update_sensitivity_chart.superseded_computations'] == superseded + 1
@@ -1,22 +1,263 @@
-from flask import Flask
-from flask import escape, render_template, request
-from params import Params
-from utils import create_input_html_content, create_usage_instructions_html, savings_calculation
+from startup import startup_report
 
-app = Flask(__name__)
+# the imports are timed for the startup report, served on /startup
+with startup_report.recording_imports():
+    import hashlib
+    import json
+    from datetime import date
+    from functools import lru_cache
+
+    from flask import Blueprint, Flask
+    from flask import Response, escape, make_response, render_template, request, url_for
+    from cache import ResponseCache
+    from inputs import InputError, ProjectionInputs
+    from jobs import job_queue
+    from metrics import CONTENT_TYPE, prometheus_text, timed
+    from params import Params
+    from projection import BATCH_COLUMNS, FREQUENCIES, VIEW_LABELS, VIEWS, parse_records, run_batch
+    from goal_seek import UNKNOWNS as GOAL_SEEK_UNKNOWNS, solve_for
+    from sensitivity import CONTRIBUTION_DELTA, RATE_DELTA, sensitivity_analysis
+    from shared_cache import projection_cache
+    from tax import TAX_REGIME_CHOICES
+    from utils import create_frequency_html, create_goal_seek_html, create_tax_regime_html, create_view_html, create_input_errors_html, create_input_html_content, create_usage_instructions_html, savings_calculation
+
+views = Blueprint('views', __name__)
 configs = Params()
+default_args = configs.get_var_dict()
+
+# rendered pages of the index route, keyed on the inputs of <page_args>
+page_cache = ResponseCache(maxsize=512, ttl=3600)
+not_modified_responses = 0
+# scenarios projected together by the batch API, bounds the memory of a streamed response
+PROJECTION_CHUNK_SIZE = 1000
+
+def page_args(args):
+    '''
+    The query args the index page depends on, stripped of surrounding spaces, unknown query args are left out.
+    The page is rendered from them and cached by them, so requests differing only by spaces get the same page.
+    '''
+    keys = (*configs.get_input_keys(), 'solve_for', 'target_corpus', 'frequency', 'tax_regime', 'view')
+    return {key: args[key].strip() for key in keys if key in args}
+
+def page_cache_key(args):
+    '''
+    The page only depends on <args> (see <page_args>) and the current year
+    '''
+    options = (
+        *(args.get(key, '') for key in ('solve_for', 'target_corpus')),
+        request_choice(args, 'frequency', FREQUENCIES),
+        request_choice(args, 'tax_regime', TAX_REGIME_CHOICES),
+        request_choice(args, 'view', tuple(VIEWS)),
+    )
+    if "years_till_retirement" not in args:
+        return (date.today().year, None, options)
+    return (date.today().year, tuple((key, args.get(key, '')) for key in configs.get_input_keys()), options)
+
+def request_choice(args, key, choices):
+    '''
+    Option <key> of the projection asked for in the query string, the first of <choices> unless another one is asked for
+    '''
+    value = args.get(key, choices[0])
+    return value if value in choices else choices[0]
 
-@app.route("/")
+@views.route("/")
 def index():
-    if "years_till_retirement" in request.args:
-        current_args = request.args
+    global not_modified_responses
+    args = page_args(request.args)
+    key = page_cache_key(args)
+    cached = page_cache.get(key)
+    if cached is None:
+        with timed('index.render'):
+            body = render_index(args)
+        cached = (body, hashlib.sha256(body.encode()).hexdigest())
+        page_cache.set(key, cached)
+    body, etag = cached
+
+    response = make_response(body)
+    response.set_etag(etag)
+    # let browsers revalidate with If-None-Match every time, unchanged pages are answered with an empty 304
+    response.cache_control.no_cache = True
+    response.make_conditional(request)
+    if response.status_code == 304:
+        not_modified_responses += 1
+    return response
+
+@views.route("/cache-stats")
+def cache_stats():
+    shared = projection_cache()
+    return {**page_cache.stats(), 'not_modified_responses': not_modified_responses, 'projection_cache': shared.stats() if shared else None}
+
+@views.route("/metrics")
+def metrics():
+    return Response(prometheus_text(), content_type=CONTENT_TYPE)
+
+@views.route("/startup")
+def startup():
+    return startup_report.to_dict()
+
+@views.route("/api/v1/sensitivity")
+def sensitivity():
+    '''
+    Impact on the retirement corpus of moving every rate and contribution down and up, inputs are read like the index page
+    '''
+    current_args = request.args if "years_till_retirement" in request.args else default_args
+    try:
+        base_corpus, rows = sensitivity_analysis(
+            current_args,
+            configs,
+            rate_delta=float(request.args.get('rate_delta', RATE_DELTA)),
+            contribution_delta=float(request.args.get('contribution_delta', CONTRIBUTION_DELTA)),
+            frequency=request.args.get('frequency', 'yearly'),
+            tax_regime=request.args.get('tax_regime', 'old'),
+        )
+    except ValueError as e:
+        return {'error': f'invalid input: {e}'}, 400
+    return {'base_corpus': base_corpus, 'rows': rows}
+
+@views.route("/api/v1/projections", methods=["POST"])
+def projections():
+    '''
+    Projects a JSON array of scenarios keyed like Params.get_var_dict(), the whole array is validated before anything is
+    computed and the results are streamed back as NDJSON, one line per scenario in the order of the request.
+    Monthly SIPs and compounding are used with ?frequency=monthly, the tax regime is chosen with ?tax_regime=old|new|auto.
+    '''
+    try:
+        _, inputs, frequency, tax_regime = projection_request()
+    except ValueError as e:
+        return {'error': f'invalid input: {e}'}, 400
+    return Response(stream_projections(inputs, frequency, tax_regime), mimetype='application/x-ndjson')
+
+def projection_request():
+    '''
+    The scenarios of a projections request, parsed, and its options, raises ValueError naming what is invalid
+    '''
+    scenarios = request.get_json(silent=True)
+    frequency, tax_regime = request.args.get('frequency', 'yearly'), request.args.get('tax_regime', 'old')
+    if frequency not in FREQUENCIES:
+        raise ValueError(f'frequency must be one of {", ".join(FREQUENCIES)}')
+    if tax_regime not in TAX_REGIME_CHOICES:
+        raise ValueError(f'tax_regime must be one of {", ".join(TAX_REGIME_CHOICES)}')
+    return scenarios, parse_records(scenarios, configs), frequency, tax_regime
+
+@views.route("/jobs", methods=["POST"])
+def submit_job():
+    '''
+    Queues the projections of a request like /api/v1/projections as a background job, validated before it is queued,
+    for the cohorts too large to be projected within a request. Answers 202 with the id of the job.
+    '''
+    try:
+        scenarios, _, frequency, tax_regime = projection_request()
+    except ValueError as e:
+        return {'error': f'invalid input: {e}'}, 400
+    job_id = job_queue().submit('projections', {'scenarios': scenarios, 'frequency': frequency, 'tax_regime': tax_regime})
+    return job_queue().get(job_id), 202, {'Location': url_for('views.job', job_id=job_id)}
+
+@views.route("/jobs/<job_id>")
+def job(job_id):
+    '''
+    State and progress (0 to 1) of a job
+    '''
+    state = job_queue().get(job_id)
+    if state is None:
+        return {'error': f'no job {job_id}'}, 404
+    return state
+
+@views.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    state = job_queue().get(job_id)
+    if state is None:
+        return {'error': f'no job {job_id}'}, 404
+    if state['state'] != 'done':
+        return {'error': f'the job is {state["state"]}', **state}, 409
+    return {'result': job_queue().result(job_id)}
+
+@views.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    if job_queue().get(job_id) is None:
+        return {'error': f'no job {job_id}'}, 404
+    if not job_queue().cancel(job_id):
+        return {'error': 'the job has already ended', **job_queue().get(job_id)}, 409
+    return job_queue().get(job_id), 202
+
+def stream_projections(inputs, frequency='yearly', tax_regime='old'):
+    '''
+    Runs the projection PROJECTION_CHUNK_SIZE scenarios at a time and yields a JSON line per scenario.
+    A chunk whose projection overflows is projected again one scenario at a time, the scenarios that overflow are
+    answered with an error line as the response has already started.
+    '''
+    no_of_scenarios = len(inputs['years_till_retirement'])
+    for start in range(0, no_of_scenarios, PROJECTION_CHUNK_SIZE):
+        chunk = {key: values[start:start + PROJECTION_CHUNK_SIZE] for key, values in inputs.items()}
+        try:
+            yield from projection_lines(start, chunk, frequency, tax_regime)
+        except InputError:
+            for i in range(len(chunk['years_till_retirement'])):
+                try:
+                    yield from projection_lines(start + i, {key: values[i:i + 1] for key, values in chunk.items()}, frequency, tax_regime)
+                except InputError as e:
+                    yield json.dumps({'scenario': start + i, 'error': f'invalid input: {e}'}) + '\n'
+
+def projection_lines(start, chunk, frequency, tax_regime):
+    '''
+    The JSON lines of the scenarios of <chunk>, numbered from <start>, a list as nothing is yielded when one overflows
+    '''
+    current_year = date.today().year
+    batch = run_batch(chunk, configs, frequency, tax_regime)
+    lines = []
+    for i, no_of_years in enumerate(int(years) for years in chunk['years_till_retirement']):
+        values = batch[i, :no_of_years + 1].T.tolist()
+        row = {'scenario': start + i, 'years': list(range(current_year, current_year + no_of_years + 1))}
+        row.update(zip(BATCH_COLUMNS, values))
+        lines.append(json.dumps(row) + '\n')
+    return lines
+
+# projection of the page, the pages of its other views are derived from it without projecting again
+@lru_cache(maxsize=128)
+def projection_result(inputs: ProjectionInputs, frequency, tax_regime):
+    return savings_calculation(inputs, configs, frequency, tax_regime)
+
+def render_index(args):
+    if "years_till_retirement" in args:
+        current_args = args
     else:
-        current_args = configs.get_var_dict()
-    years_list, year_wise_savings, year_wise_expenses = savings_calculation(current_args, configs)
-    total_yearly_savings_corpus = []
-    for i in range(len(years_list)):
-        total_yearly_savings_corpus.append(sum([arr[i] for arr in year_wise_savings.values()]))
+        current_args = default_args
+    solve_for_unknown, target_corpus = args.get('solve_for', ''), args.get('target_corpus', '').strip()
+    frequency = request_choice(args, 'frequency', FREQUENCIES)
+    tax_regime = request_choice(args, 'tax_regime', TAX_REGIME_CHOICES)
+    view = request_choice(args, 'view', tuple(VIEWS))
+    try:
+        inputs = ProjectionInputs.from_args(current_args, configs)
+    except InputError as e:
+        # the form is shown again with the values as typed, there is nothing to chart
+        return render_page(current_args, solve_for_unknown, target_corpus, frequency, tax_regime, view, create_input_errors_html(e.errors))
+
+    with timed('index.compute'):
+        try:
+            result = projection_result(inputs, frequency, tax_regime)
+        except InputError as e:
+            # inputs in range whose projection overflows
+            return render_page(current_args, solve_for_unknown, target_corpus, frequency, tax_regime, view, create_input_errors_html(e.errors))
+        goal_seek_answer = ''
+        if solve_for_unknown and target_corpus:
+            try:
+                answer = solve_for(solve_for_unknown, float(target_corpus), inputs, configs, frequency=frequency, tax_regime=tax_regime)
+                answer = f'{answer:,.2f}%' if isinstance(answer, float) else f'{answer:,}'
+                goal_seek_answer = f'<h3>{escape(solve_for_unknown.replace("_", " ").title())} needed: {answer}</h3>'
+            except ValueError as e:
+                goal_seek_answer = f'<h3>{escape(str(e))}</h3>'
+
+        chart_data = result.to_chart_data({'total_savings_corpus': 'Total Savings Corpus'}, view)
+        years_list, ((legend, total_yearly_savings_corpus),) = chart_data['years'], chart_data['series']
+        if view != 'nominal':
+            legend = f'{legend} ({VIEW_LABELS[view]})'
+
+    with timed('index.html_build'):
+        form = render_page(current_args, solve_for_unknown, target_corpus, frequency, tax_regime, view, goal_seek_answer)
+    with timed('index.template_render'):
+        chart = render_template("savings_chart.html", values=total_yearly_savings_corpus, labels=years_list, legend=legend)
+    return f'{form}{chart}<br><br>'
 
+def render_page(current_args, solve_for_unknown, target_corpus, frequency, tax_regime, view, message):
     return (
         '<style>h2{text-align: center; background-color: lightgreen;}</style>'
         '<title>Financial Health Calculator by Shomit Goyal</title>'
@@ -24,12 +265,37 @@ def index():
         f'{create_usage_instructions_html()}'
         f'<form action="" method="get">\n'
             f'{create_input_html_content(configs, current_args)}'
+            f'{create_frequency_html(FREQUENCIES, frequency)}'
+            f'{create_tax_regime_html(TAX_REGIME_CHOICES, tax_regime)}'
+            f'{create_view_html(VIEWS, view)}'
+            f'{create_goal_seek_html(GOAL_SEEK_UNKNOWNS, solve_for_unknown, target_corpus)}'
             f'<input type="submit" value="Estimate Financial Health"><br>'
         f'</form>'
-        f'{render_template("savings_chart.html", values=total_yearly_savings_corpus, labels=years_list, legend="Total Savings Corpus")}<br><br>'
+        f'{message}'
     )
 #        f'{output_formatter(years_list, year_wise_savings, year_wise_expenses)}'
 
+def create_app():
+    '''
+    The Flask app serving the views.
+    gunicorn.conf.py loads it once in the master process and forks the workers from it, the imported modules and the
+    warmed up caches are then shared by the workers instead of being built again in each of them.
+    '''
+    app = Flask(__name__)
+    app.register_blueprint(views)
+    return app
+
+def warm_up():
+    '''
+    Renders the default page once, like the first request does, so that the tax rules and the templates are ready
+    before the workers are forked. The page itself is not kept, the cache is for pages of the current day.
+    '''
+    with app.test_request_context():
+        render_index(default_args)
+
+with startup_report.stage('flask.create_app'):
+    app = create_app()
+
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=8080, debug=True)
     #current_args = configs.get_var_dict()
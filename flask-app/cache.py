@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ResponseCache(object):
+    '''
+    A bounded LRU cache whose entries expire <ttl> seconds after they were stored.
+    Attributes:
+        maxsize: number of entries kept, the least recently used entry is evicted first
+        ttl: time to live of an entry, in seconds
+        hits, misses, evictions, expirations: counters since the cache was created
+    '''
+    def __init__(self, maxsize=256, ttl=3600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
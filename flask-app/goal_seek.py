@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+from inputs import ProjectionOverflow
+from params import Params
+from projection import parse_args, projection_key, run_projection
+
+# inputs that can be solved for, with the range searched and whether the answer is a whole number
+UNKNOWNS = {
+    'mf_contribution': (0, 10 ** 10, True),
+    'years_till_retirement': (0, 100, True),
+    'monthly_fixed_expense': (0, 10 ** 9, True),
+    'mf_step_up': (-50.0, 50.0, False),
+}
+# candidates evaluated together in every round of the search
+CANDIDATES_PER_ROUND = 32
+FLOAT_TOLERANCE = 1e-4
+
+# last answer for every unknown and set of the other inputs, the starting point of the next search of the same profile
+# (e.g. for another target), the least recently used answer is forgotten first
+previous_answers = OrderedDict()
+MAX_PREVIOUS_ANSWERS = 1024
+
+def retirement_corpus(unknown, candidates, inputs, configs: Params, frequency='yearly', tax_regime='old'):
+    '''
+    Total savings corpus at retirement for every candidate value of <unknown>, in one batched projection,
+    <inputs> are the parsed inputs of a single scenario.
+    When the projection overflows the candidates are projected again one at a time, those that overflow are nan.
+    '''
+    batch = {key: np.repeat(value, len(candidates)) for key, value in inputs.items()}
+    batch[unknown] = candidates.astype(batch[unknown].dtype)
+    try:
+        corpus, _ = run_projection(batch, configs, frequency, tax_regime)
+    except ProjectionOverflow:
+        if len(candidates) == 1:
+            return np.array([np.nan])
+        return np.concatenate([
+            retirement_corpus(unknown, candidates[i:i + 1], inputs, configs, frequency, tax_regime) for i in range(len(candidates))
+        ])
+    # in floats, the instruments may add up beyond int64
+    return corpus[np.arange(len(candidates)), batch['years_till_retirement']].sum(axis=-1, dtype=np.float64)
+
+def beyond_overflow(corpus, increasing):
+    '''
+    <corpus> with the candidates that overflow (nan) beyond every other one in the direction the corpus moves
+    '''
+    return np.where(np.isnan(corpus), np.inf if increasing else -np.inf, corpus)
+
+def starting_candidates(lower, upper, guess, integer):
+    '''
+    A ladder over the whole range, denser around <guess>
+    '''
+    span = upper - lower
+    ladder = [lower, upper, *(lower + span * np.geomspace(1e-9, 1, CANDIDATES_PER_ROUND))]
+    if guess is not None:
+        ladder += [guess, *(guess + span * np.geomspace(1e-9, 1e-2, 8)), *(guess - span * np.geomspace(1e-9, 1e-2, 8))]
+    ladder = np.clip(np.array(ladder, dtype=np.float64), lower, upper)
+    return np.unique(np.round(ladder) if integer else ladder)
+
+def solve_for(unknown, target_corpus, args, configs: Params, guess=None, frequency='yearly', tax_regime='old'):
+    '''
+    Value of <unknown> for which the total savings corpus at retirement reaches <target_corpus>, every other input
+    is taken from <args>. The corpus is assumed to be monotonic in the unknown (either direction), the answer is
+    the least value that reaches the target when the corpus grows with the unknown (e.g. contribution, years) and
+    the largest one otherwise (e.g. an expense ceiling).
+    Candidates are bracketed on a ladder denser around <guess> (the previous answer for the same inputs by default) and the bracket is
+    then split into CANDIDATES_PER_ROUND parts per round, each round being a single batched projection.
+    A candidate whose projection overflows is taken as beyond every candidate that does not, e.g. above the target
+    for a contribution or a step-up.
+    Raises ValueError when the target cannot be reached within UNKNOWNS[unknown], ProjectionOverflow when every
+    candidate of the ladder overflows.
+    '''
+    if unknown not in UNKNOWNS:
+        raise ValueError(f'cannot solve for {unknown!r}, expected one of {", ".join(UNKNOWNS)}')
+    lower, upper, integer = UNKNOWNS[unknown]
+    target_corpus = float(target_corpus)
+    inputs = parse_args(args, configs)
+    # the value of the unknown given with the inputs is only replaced, it is not part of the profile
+    other_inputs = {key: values for key, values in inputs.items() if key != unknown}
+    key = (unknown, projection_key(other_inputs, configs, frequency, tax_regime, date.today().year))
+    if guess is None and key in previous_answers:
+        guess = previous_answers[key]
+        previous_answers.move_to_end(key)
+    candidates = starting_candidates(lower, upper, guess, integer)
+    corpus = retirement_corpus(unknown, candidates, inputs, configs, frequency, tax_regime)
+    projected = corpus[~np.isnan(corpus)]
+    if len(projected) == 0:
+        raise ProjectionOverflow()
+    increasing = projected[-1] >= projected[0]
+    corpus = beyond_overflow(corpus, increasing)
+    while True:
+        # the candidates meeting the target are a suffix of the candidates when the corpus grows with the unknown, a prefix otherwise
+        meets = corpus >= target_corpus
+        boundary = np.flatnonzero(meets if increasing else ~meets)
+        if len(boundary) == 0 and not increasing:
+            answer = candidates[-1]
+            break
+        if len(boundary) == 0 or (boundary[0] == 0 and not increasing):
+            raise ValueError(f'a retirement corpus of {target_corpus:,.0f} cannot be reached by changing {unknown} between {lower} and {upper}')
+        if boundary[0] == 0:
+            answer = candidates[0]
+            break
+        low, high = candidates[boundary[0] - 1], candidates[boundary[0]]
+        if (high - low <= 1) if integer else (high - low <= FLOAT_TOLERANCE):
+            # least value reaching the target, or the largest one still reaching it for a decreasing corpus
+            answer = high if increasing else low
+            break
+        candidates = np.linspace(low, high, CANDIDATES_PER_ROUND + 1)
+        candidates = np.unique(np.round(candidates)) if integer else candidates
+        corpus = beyond_overflow(retirement_corpus(unknown, candidates, inputs, configs, frequency, tax_regime), increasing)
+
+    answer = int(answer) if integer else float(answer)
+    previous_answers[key] = answer
+    previous_answers.move_to_end(key)
+    while len(previous_answers) > MAX_PREVIOUS_ANSWERS:
+        previous_answers.popitem(last=False)
+    return answer
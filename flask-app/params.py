@@ -3,6 +3,19 @@ class Params(object):
         self.TAX_SLABS = ((1000000, 30), (500000, 20), (250000, 5))
         self.TAX_SURCHARGE_SLABS = ((50000000, 37), (20000000, 25), (10000000, 15), (5000000, 10), (0, 0))
         self.HEALTH_AND_EDUCATION_CESS_RATE = 4.0
+        # tax rules of every regime by the financial year they apply from, a year uses the latest rules that started on or
+        # before it (the earliest ones before that): (regime, from year, slabs, surcharge slabs, standard deduction,
+        # whether the 80C and NPS deductions are allowed, taxable income up to which the tax is rebated in full, whether
+        # there is marginal relief above it).
+        # These are the rules the regimes are compared on, the projections under the old regime alone are still the ones
+        # of Tax, without its standard deduction and 87A rebate, so that they do not change.
+        new_regime_surcharge_slabs = ((20000000, 25), (10000000, 15), (5000000, 10), (0, 0))
+        self.TAX_REGIME_RULES = (
+            ('old', 2020, self.TAX_SLABS, self.TAX_SURCHARGE_SLABS, 50000, True, 500000, False),
+            ('new', 2023, ((1500000, 30), (1200000, 20), (900000, 15), (600000, 10), (300000, 5)), new_regime_surcharge_slabs, 50000, False, 700000, True),
+            ('new', 2024, ((1500000, 30), (1200000, 20), (1000000, 15), (700000, 10), (300000, 5)), new_regime_surcharge_slabs, 75000, False, 700000, True),
+            ('new', 2025, ((2400000, 30), (2000000, 25), (1600000, 20), (1200000, 15), (800000, 10), (400000, 5)), new_regime_surcharge_slabs, 75000, False, 1200000, True),
+        )
 
         self.rates = {
             'inflation_rate': 7.0,
@@ -61,6 +74,18 @@ class Params(object):
                 param_dict[key] = value
         return param_dict
 
+    def get_input_keys(self):
+        '''
+        names of the user inputs of a projection, in the order of the input sections
+        '''
+        return (
+            *self.current_savings_by_instrument.keys(),
+            *self.basic_pct_contributions.keys(),
+            *self.contributions.keys(),
+            *self.income_and_expenses.keys(),
+            *self.rates.keys(),
+        )
+
 #monthly_personal_loan_emi = 7100
 #monthly_home_loan_emi = 15500
 #monthly_lic_premium = 3100
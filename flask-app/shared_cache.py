@@ -0,0 +1,154 @@
+'''
+A cache on disk shared by every worker of the server, and kept across restarts: a SQLite database in WAL mode, so
+readers never wait for the writer. Used for the projections when PROJECTION_CACHE is set to the path of the database.
+Fills are single-flight across processes: the first worker missing a key takes a lease on it and computes the value,
+the workers missing the same key meanwhile wait for the value instead of computing it again. A lease older than
+<lease_seconds> is taken over, its worker is assumed to have died.
+The values are kept under <max_bytes> by evicting the least recently used entries, checked every EVICTION_INTERVAL
+stores of a worker.
+'''
+import os
+import sqlite3
+import threading
+import time
+
+# values kept, in bytes
+MAX_BYTES = 256 * 1024 * 1024
+LEASE_SECONDS = 10.0
+POLL_INTERVAL = 0.005
+# the last use of an entry is written at most this often, a hit is then mostly a read
+TOUCH_INTERVAL = 60.0
+# stores between two checks of the size of the database
+EVICTION_INTERVAL = 64
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)',
+    'CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, started REAL NOT NULL)',
+)
+
+class SharedCache(object):
+    '''
+    Attributes:
+        path: path of the SQLite database, created when missing
+        max_bytes, lease_seconds, poll_interval: see the module docstring
+        hits, misses, waits (misses answered by the fill of another worker), evictions: counters of this process
+    '''
+    def __init__(self, path, max_bytes=MAX_BYTES, lease_seconds=LEASE_SECONDS, poll_interval=POLL_INTERVAL, clock=time.time):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self._stores = 0
+        self._local = threading.local()
+        for statement in SCHEMA:
+            self.connection().execute(statement)
+
+    def connection(self):
+        '''
+        The connection of this thread, a connection is never shared with a forked worker or another thread
+        '''
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def get(self, key):
+        connection = self.connection()
+        row = connection.execute('SELECT value, last_used FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = self.clock()
+        if now - row[1] >= TOUCH_INTERVAL:
+            connection.execute('UPDATE entries SET last_used = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def set(self, key, value):
+        connection = self.connection()
+        connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (key, value, len(value), self.clock()))
+        self._stores += 1
+        if self._stores % EVICTION_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        '''
+        Deletes the least recently used entries until the values are under 90% of <max_bytes>
+        '''
+        connection = self.connection()
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * 0.9)
+        rows = connection.execute('SELECT key, size FROM entries ORDER BY last_used').fetchall()
+        keys = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= size
+        connection.executemany('DELETE FROM entries WHERE key = ?', keys)
+        self.evictions += len(keys)
+
+    def get_or_compute(self, key, compute):
+        '''
+        The value of <key>, computed by <compute>() (bytes) and stored by a single worker when it is missing
+        '''
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        owner = f'{os.getpid()}:{threading.get_ident()}'
+        connection = self.connection()
+        while True:
+            now = self.clock()
+            connection.execute('DELETE FROM leases WHERE key = ? AND started < ?', (key, now - self.lease_seconds))
+            if connection.execute('INSERT OR IGNORE INTO leases VALUES (?, ?, ?)', (key, owner, now)).rowcount:
+                break
+            # another worker is computing it
+            time.sleep(self.poll_interval)
+            value = self.get(key)
+            if value is not None:
+                self.waits += 1
+                return value
+        try:
+            # it may have been stored between our miss and our lease
+            value = self.get(key)
+            if value is None:
+                value = compute()
+                self.set(key, value)
+            return value
+        finally:
+            connection.execute('DELETE FROM leases WHERE key = ? AND owner = ?', (key, owner))
+
+    def stats(self):
+        entries, size = self.connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'waits': self.waits,
+            'evictions': self.evictions,
+        }
+
+_caches = {}
+
+def projection_cache():
+    '''
+    The shared cache at PROJECTION_CACHE, None when it is not set
+    '''
+    path = os.environ.get('PROJECTION_CACHE')
+    if not path:
+        return None
+    if path not in _caches:
+        _caches[path] = SharedCache(path, max_bytes=int(os.environ.get('PROJECTION_CACHE_MAX_BYTES', MAX_BYTES)))
+    return _caches[path]
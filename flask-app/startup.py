@@ -0,0 +1,108 @@
+'''
+Where the startup time of the app goes, like python -X importtime but recorded by the app itself and served as JSON
+on /startup: the time of every module imported while the app was loading, self and cumulative, and the time of the
+stages of building the app (layout, callbacks, warm-up).
+With gunicorn.conf.py the app is loaded once in the master process, the workers are forked from it and share its
+report, it is also written to the gunicorn log once the server is ready.
+'''
+import builtins
+import importlib.util
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# imports listed by format(), the slowest first
+TOP_IMPORTS = 20
+
+class StartupReport(object):
+    '''
+    Attributes:
+        imports: one dict per module imported while recording: module, depth, self_ms (excluding the modules it
+            imported), cumulative_ms, in the order the imports finished like -X importtime
+        stages: stage name -> ms, in the order the stages finished
+    '''
+    def __init__(self):
+        self.imports = []
+        self.stages = {}
+        self._stack = []
+
+    @contextmanager
+    def recording_imports(self):
+        '''
+        Records the modules imported by the main thread in the body of the with block, modules already loaded cost nothing
+        '''
+        original_import = builtins.__import__
+        thread = threading.get_ident()
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            module = resolve_module_name(name, globals, level)
+            if module in sys.modules or threading.get_ident() != thread:
+                return original_import(name, globals, locals, fromlist, level)
+            # [time spent in the modules imported by this one]
+            self._stack.append([0.0])
+            start = time.perf_counter()
+            try:
+                return original_import(name, globals, locals, fromlist, level)
+            finally:
+                cumulative = time.perf_counter() - start
+                children = self._stack.pop()[0]
+                if self._stack:
+                    self._stack[-1][0] += cumulative
+                self.imports.append({
+                    'module': module,
+                    'depth': len(self._stack),
+                    'self_ms': round((cumulative - children) * 1000, 3),
+                    'cumulative_ms': round(cumulative * 1000, 3),
+                })
+
+        builtins.__import__ = timed_import
+        try:
+            yield self
+        finally:
+            builtins.__import__ = original_import
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round((time.perf_counter() - start) * 1000, 3)
+
+    def total_import_ms(self):
+        return round(sum(entry['cumulative_ms'] for entry in self.imports if entry['depth'] == 0), 3)
+
+    def to_dict(self, top=TOP_IMPORTS):
+        return {
+            'import_ms': self.total_import_ms(),
+            'stages_ms': dict(self.stages),
+            'slowest_imports': sorted(self.imports, key=lambda entry: entry['self_ms'], reverse=True)[:top],
+            'imports': self.imports,
+        }
+
+    def format(self, top=TOP_IMPORTS):
+        '''
+        Text summary for the logs: the stages, then the <top> slowest imports by self time
+        '''
+        lines = [f'imports: {self.total_import_ms():.1f} ms']
+        lines += [f'{name}: {ms:.1f} ms' for name, ms in self.stages.items()]
+        lines.append(f'{"self ms":>10} | {"cumulative ms":>13} | module')
+        for entry in sorted(self.imports, key=lambda entry: entry['self_ms'], reverse=True)[:top]:
+            lines.append(f'{entry["self_ms"]:10.1f} | {entry["cumulative_ms"]:13.1f} | {entry["module"]}')
+        return '\n'.join(lines)
+
+def resolve_module_name(name, globals, level):
+    '''
+    Absolute name of the module of an import statement, relative imports are resolved against the importing package
+    '''
+    if level == 0:
+        return name
+    package = (globals or {}).get('__package__') or ''
+    try:
+        return importlib.util.resolve_name('.' * level + name, package)
+    except (ImportError, ValueError):
+        return name
+
+# report of this process, filled in while the app module is loading
+startup_report = StartupReport()
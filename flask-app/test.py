@@ -0,0 +1,111 @@
+import json
+
+import app
+from cache import ResponseCache
+from params import Params
+from projection import BATCH_COLUMNS, INSTRUMENTS, project_savings
+
+configs = Params()
+
+def query_args(**changes):
+    return {**{key: str(value) for key, value in configs.get_var_dict().items()}, **changes}
+
+def test_index_is_not_modified_while_its_inputs_are_the_same():
+    client = app.app.test_client()
+    query = query_args(mf_contribution='123456')
+    page = client.get('/', query_string=query)
+    assert page.status_code == 200 and page.headers['ETag']
+    etag = page.headers['ETag']
+
+    not_modified_responses = app.not_modified_responses
+    revalidated = client.get('/', query_string=query, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304 and revalidated.data == b''
+    assert app.not_modified_responses == not_modified_responses + 1
+    # spaces around the inputs are not part of the page, it shows the inputs without them
+    assert client.get('/', query_string=query_args(mf_contribution=' 123456 '), headers={'If-None-Match': etag}).status_code == 304
+    app.page_cache.clear()
+    spaced = client.get('/', query_string=query_args(mf_contribution=' 123456 '))
+    assert spaced.headers['ETag'] == etag and spaced.data == page.data
+    assert b'name="mf_contribution" value="123456"' in spaced.data
+
+    changed = client.get('/', query_string=query_args(mf_contribution='123457'), headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert client.get('/', query_string=query, headers={'If-None-Match': changed.headers['ETag']}).status_code == 200
+
+def test_response_cache_evicts_the_least_recently_used_and_expires():
+    now = [0.0]
+    cache = ResponseCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    # b is now the least recently used
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+    now[0] = 9.9
+    assert cache.get('a') == 1
+    now[0] = 10.0
+    assert cache.get('a') is None and cache.get('c') is None
+    cache.set('a', 4)
+    assert cache.get('a') == 4
+    assert cache.stats() == {'size': 1, 'maxsize': 2, 'hits': 5, 'misses': 3, 'evictions': 1, 'expirations': 2}
+
+def test_cache_stats_count_the_pages_rendered_and_served_from_the_cache():
+    client = app.app.test_client()
+    app.page_cache.clear()
+    before = client.get('/cache-stats').get_json()
+    query = query_args(equity_contribution='65432')
+    first = client.get('/', query_string=query)
+    second = client.get('/', query_string=query)
+    assert first.data == second.data
+
+    stats = client.get('/cache-stats').get_json()
+    assert stats['misses'] == before['misses'] + 1
+    assert stats['hits'] == before['hits'] + 1
+    assert stats['size'] == 1 and stats['maxsize'] == app.page_cache.maxsize
+    assert stats['not_modified_responses'] == before['not_modified_responses']
+
+def test_projections_stream_one_line_per_scenario(monkeypatch):
+    # a chunk of two scenarios, the third one is projected in a chunk of its own
+    monkeypatch.setattr(app, 'PROJECTION_CHUNK_SIZE', 2)
+    client = app.app.test_client()
+    scenarios = [
+        configs.get_var_dict(),
+        {**configs.get_var_dict(), 'years_till_retirement': 5},
+        {**configs.get_var_dict(), 'mf_contribution': 50000, 'years_till_retirement': 0},
+    ]
+    response = client.post('/api/v1/projections?frequency=monthly&tax_regime=auto', json=scenarios)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) == len(scenarios)
+    for i, (line, args) in enumerate(zip(lines, scenarios)):
+        row = json.loads(line)
+        years, corpus, expenses = project_savings(args, configs, 'monthly', 'auto')
+        assert row['scenario'] == i and row['years'] == years.tolist()
+        assert [row[key] for key in INSTRUMENTS] == corpus.T.tolist()
+        assert row['total_savings_corpus'] == corpus.sum(axis=1).tolist() and row['expenses'] == expenses.tolist()
+        assert set(row) == {'scenario', 'years', *BATCH_COLUMNS}
+
+def test_projections_are_validated_before_streaming():
+    client = app.app.test_client()
+    scenarios = [configs.get_var_dict(), {**configs.get_var_dict(), 'mf_ror': 'abc'}, {'years_till_retirement': 10}]
+    response = client.post('/api/v1/projections', json=scenarios)
+    assert response.status_code == 400 and response.mimetype == 'application/json'
+    error = response.get_json()['error']
+    assert 'scenario 1: mf_ror must be a number' in error and 'scenario 2: missing annual_income' in error
+    assert client.post('/api/v1/projections', json={'scenarios': []}).status_code == 400
+    assert client.post('/api/v1/projections?frequency=weekly', json=[configs.get_var_dict()]).status_code == 400
+    assert client.post('/api/v1/projections', json=[]).get_data() == b''
+
+def test_projections_answer_the_scenarios_that_overflow_with_an_error_line():
+    client = app.app.test_client()
+    largest = {**configs.get_var_dict(), 'years_till_retirement': 100, 'mf_corpus': 10 ** 12, 'mf_ror': 100}
+    response = client.post('/api/v1/projections', json=[configs.get_var_dict(), largest, configs.get_var_dict()])
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row['scenario'] for row in rows] == [0, 1, 2]
+    assert 'error' not in rows[0] and rows[0] == {**rows[2], 'scenario': 0}
+    assert set(rows[1]) == {'scenario', 'error'}
+    assert rows[1]['error'].startswith('invalid input: years_till_retirement is too long')
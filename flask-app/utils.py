@@ -1,6 +1,8 @@
-from datetime import date
+from markupsafe import escape
 
+from metrics import timed
 from params import Params
+from projection import VIEW_LABELS, ProjectionResult, project_savings
 from tax import Tax
 
 def calc_compound_interest_final_amount(p, r, t, n = 1):
@@ -13,7 +15,7 @@ def new_corpus_value_at_year_end(starting_value, rate, additional_investment):
 def create_input_text_boxes(names, lookup_dict, suffix='', boxes_per_row=4):
     html = ''
     for i, name in enumerate(names):
-        value = lookup_dict[name]
+        value = escape(lookup_dict.get(name, ''))
         display_name = name.replace('_', ' ').title()
         html += f'\
             <label for="{name}"><strong>{display_name}:</strong></label>\
@@ -67,74 +69,60 @@ def create_input_html_content(configs, current_args, boxes_per_row=4):
     
     return input_boxes_html + '<br>'
 
-def savings_calculation(args, configs):
+def create_input_errors_html(errors):
+    html = '<h3>Please correct these inputs</h3><ul>'
+    for name, message in errors.items():
+        html += f'<li><strong>{name.replace("_", " ").title()}</strong> {escape(message)}</li>'
+    return html + '</ul>'
+
+def create_goal_seek_html(unknowns, solve_for='', target_corpus=''):
+    html = '<h3>Goal Seek</h3>'
+    html += '<label for="solve_for"><strong>Solve For:</strong></label>'
+    html += '<select name="solve_for"><option value="">-</option>'
+    for name in unknowns:
+        selected = ' selected' if name == solve_for else ''
+        html += f'<option value="{name}"{selected}>{name.replace("_", " ").title()}</option>'
+    html += '</select>'
+    html += f'\
+        <label for="target_corpus"><strong>Target Corpus at Retirement:</strong></label>\
+        <input tpye="text" name="target_corpus" value="{escape(target_corpus)}">\
+    '
+    return f'{html}<br><br>'
+
+def create_frequency_html(frequencies, frequency='yearly'):
+    html = '<label for="frequency"><strong>Contributions and Compounding:</strong></label>'
+    html += '<select name="frequency">'
+    for name in frequencies:
+        selected = ' selected' if name == frequency else ''
+        html += f'<option value="{name}"{selected}>{name.title()}</option>'
+    return f'{html}</select><br><br>'
+
+def create_tax_regime_html(tax_regimes, tax_regime='old'):
+    html = '<label for="tax_regime"><strong>Tax Regime:</strong></label>'
+    html += '<select name="tax_regime">'
+    for name in tax_regimes:
+        selected = ' selected' if name == tax_regime else ''
+        label = 'Cheaper of the two, every year' if name == 'auto' else f'{name.title()} regime'
+        html += f'<option value="{name}"{selected}>{label}</option>'
+    return f'{html}</select><br><br>'
+
+def create_view_html(views, view='nominal'):
+    html = '<label for="view"><strong>Chart:</strong></label>'
+    html += '<select name="view">'
+    for name in views:
+        selected = ' selected' if name == view else ''
+        html += f'<option value="{name}"{selected}>{VIEW_LABELS[name]}</option>'
+    return f'{html}</select><br><br>'
+
+def savings_calculation(args, configs, frequency='yearly', tax_regime='old'):
     '''
     ASSUMPTIONS
         1. NPS and PF investments are made at the same %basic till retirement
         2. Fixed expenses grow at the rate of inflation
     '''
-    current_year = date.today().year
-    no_of_years = int(args['years_till_retirement'])
-    years_list = list(range(current_year, current_year + no_of_years + 1))
-
-    # compute yearly savings by instrument
-    # initialize all instruments with current savings
-    year_wise_savings = {
-        'nps_corpus': [int(args['nps_corpus'])],
-        'pf_corpus': [int(args['pf_corpus'])],
-        'ppf_corpus': [int(args['ppf_corpus'])],
-        'mf_corpus': [int(args['mf_corpus'])],
-        'equity_corpus': [int(args['equity_corpus'])],
-        'fd_corpus': [int(args['fd_corpus'])],
-        'savings_corpus': [int(args['savings_corpus'])],
-        'other_savings_corpus': [int(args['other_savings_corpus'])]
-    }
-    
-    # contains the list of expenses for the next year, i.e. year starting at the corresponding index in <years_list>
-    year_wise_expenses = [12 * int(args['monthly_fixed_expense'])]
-
-    # compute year wise basic for the number of years of service left
-    for i in range(no_of_years):
-        current_annual_basic = calc_compound_interest_final_amount(p=int(args['annual_basic']), r=float(args['income_growth_rate']) / 100, t=i)
-        current_nps_contribution = int(current_annual_basic * (float(args['nps_contribution']) / 100))
-        
-        current_employer_pf_contribution = int(current_annual_basic * (float(args['employer_pf_contribution']) / 100))
-        current_employee_pf_contribution = int(current_annual_basic * (float(args['employee_pf_contribution']) / 100))
-        current_pf_contribution = current_employer_pf_contribution + current_employee_pf_contribution
-        
-        current_mf_contribution = calc_compound_interest_final_amount(p=int(args['mf_contribution']), r=float(args['mf_step_up']) / 100, t=i)
-        current_equity_contribution = calc_compound_interest_final_amount(p=int(args['equity_contribution']), r=float(args['equity_step_up']) / 100, t=i)
-
-        current_ppf_contribution = int(args['ppf_contribution']) if i < int(args['ppf_installments_left']) else 0
-        
-        current_income = calc_compound_interest_final_amount(p=int(args['annual_income']), r=float(args['income_growth_rate']) / 100, t=i)
-        
-        tax = Tax(current_income, current_employer_pf_contribution, int(args['80c_deductions']), current_nps_contribution, configs)
-        current_after_tax_income = tax.after_tax_income
-
-        current_expense = calc_compound_interest_final_amount(p=12 * int(args['monthly_fixed_expense']), r=float(args['inflation_rate']) / 100, t=i)
-        
-        current_fd_contribution = current_after_tax_income - current_expense - current_nps_contribution - current_pf_contribution - current_mf_contribution - current_equity_contribution - current_ppf_contribution
-
-        # update the value of different investment instruments at the end of the year
-        year_wise_savings['nps_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['nps_corpus'][-1], rate=float(args['nps_ror']), additional_investment=current_nps_contribution))
-        year_wise_savings['pf_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['pf_corpus'][-1], rate=float(args['pf_ror']), additional_investment=current_pf_contribution))
-        year_wise_savings['mf_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['mf_corpus'][-1], rate=float(args['mf_ror']), additional_investment=current_mf_contribution))
-        year_wise_savings['equity_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['equity_corpus'][-1], rate=float(args['equity_ror']), additional_investment=current_equity_contribution))
-        year_wise_savings['fd_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['fd_corpus'][-1], rate=float(args['fd_ror']), additional_investment=current_fd_contribution))
-        year_wise_savings['savings_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['savings_corpus'][-1], rate=float(args['savings_ror']), additional_investment=0))
-        year_wise_savings['other_savings_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['other_savings_corpus'][-1], rate=float(args['other_savings_ror']), additional_investment=0))
-
-        # when we reach the end of ppf term, we will transfer the ppf amount to fd and the ppf corpus will become 0 from that year onwards
-        if i == int(args['ppf_installments_left']) - 1:
-            year_wise_savings['fd_corpus'][-1] = year_wise_savings['fd_corpus'][-1] + new_corpus_value_at_year_end(starting_value=year_wise_savings['ppf_corpus'][-1], rate=float(args['ppf_ror']), additional_investment=current_ppf_contribution)
-            year_wise_savings['ppf_corpus'].append(0)
-        else:
-            year_wise_savings['ppf_corpus'].append(new_corpus_value_at_year_end(starting_value=year_wise_savings['ppf_corpus'][-1], rate=float(args['ppf_ror']), additional_investment=current_ppf_contribution))
-        
-        # next year's expense
-        year_wise_expenses.append(calc_compound_interest_final_amount(p=12 * int(args['monthly_fixed_expense']), r=float(args['inflation_rate']) / 100, t=i+1))
-    return years_list, year_wise_savings, year_wise_expenses
+    years, corpus, expenses = project_savings(args, configs, frequency, tax_regime)
+    with timed('savings_calculation.result'):
+        return ProjectionResult(years, corpus, expenses, inflation_rate=float(args['inflation_rate']))
 
 def output_formatter(years_list, year_wise_savings, year_wise_expenses):
     return(